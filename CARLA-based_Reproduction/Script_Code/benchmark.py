@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks of the replay's hot paths, without a CARLA server.
+
+Synthetic cases are written in the falsifier's format (tab separated
+result.csv with '*t* = ...' row labels, TimePath.txt, acceleration_config.txt)
+using the header of a template case, one per requested trace length. For
+each length the suite times
+
+    load_trace        parsing result.csv into a TraceStore (plus stitching)
+    cache_cold        TraceCache parse + writing the binary sidecar
+    cache_warm        TraceCache reading the sidecar back
+    stream_scan       TraceStream read of every row, as a replay would
+    row_at_tick       tick -> row lookups for every tick of the trace
+    compute_danger    danger evaluation on sampled rows
+    calculate_accel   acceleration controller on sampled rows
+
+and once, on a case of --replay-seconds, the replay loop itself in the local
+backend (per-phase times from the --profile instrumentation).
+
+Results are written as JSON, or CSV for a .csv output name, one record per
+benchmark and trace length; compare two runs before and after a change:
+
+    python benchmark.py --rows 1e3,1e4,1e5 -o before.json
+    python benchmark.py --rows 1e3,1e4,1e5,1e6,1e7 --skip stream_scan
+
+10^7 rows is a multi-gigabyte result.csv; the work directory must hold it.
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import contextlib
+import csv
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import local_carla
+from trace_store import T_WRAP, TraceCache, TraceStream, load_trace, read_header, stitch_periods
+
+
+# ==============================================================================
+# -- Global functions ----------------------------------------------------------
+# ==============================================================================
+
+
+TEMPLATE_CASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Case1_Random_Actor')
+DEFAULT_ROWS = '1e3,1e4,1e5'
+TIME_STEP = 0.01
+# Controller samples evaluated per trace length, at most.
+CONTROLLER_SAMPLES = 20000
+BENCHMARKS = (
+    'load_trace', 'cache_cold', 'cache_warm', 'stream_scan', 'row_at_tick',
+    'compute_danger', 'calculate_accel', 'replay')
+
+# Synthetic values: the ego drives along x, the NPC keeps its distance and
+# the walker and barrel stay far behind, so a replay runs without collision.
+SYNTHETIC_VALUES = {
+    'v_env': 20.0, 'v_ego': 10.0, 'a_env': 0.0, 'a_ego': 0.0,
+    'RandomActorX_env': -1000.0, 'RandomActorY_env': 0.0,
+    'staticActorX_env': -1000.0, 'staticActorY_env': 0.0,
+    'RandomActorX_envsample': -1000.0, 'RandomActorY_envsample': 0.0,
+    'staticActorX_envsample': -1000.0, 'staticActorY_envsample': 0.0,
+    'signal_env': 0.0, 'railSignal_env': 0.0,
+    'friction': 0.015, 'frictionsample': 0.015, 'slope': 0.0, 'slopesample': 0.0,
+    'err': -0.94, 'errsample': -0.94}
+
+
+def parse_rows(text):
+    return [int(float(value)) for value in text.split(',') if value]
+
+
+def write_case(case_dir, rows, template=TEMPLATE_CASE, chunk_rows=100000):
+    """Write a synthetic case of rows trace rows, with the template's columns."""
+    if not os.path.isdir(case_dir):
+        os.makedirs(case_dir)
+    header = read_header(os.path.join(template, 'result.csv'))
+    keys = header[1:]
+    columns = dict((key, n) for n, key in enumerate(keys))
+    with open(os.path.join(template, 'result.csv'), 'r') as file:
+        file.readline()
+        first = file.readline().rstrip('\r\n').split('\t')[1:]
+    base = np.array([float(value) for value in first], dtype=np.float64)
+    for key, value in SYNTHETIC_VALUES.items():
+        if key in columns:
+            base[columns[key]] = value
+
+    fmt = '*t* = %.6g' + '\t%.6g' * len(keys)
+    with open(os.path.join(case_dir, 'result.csv'), 'w') as file:
+        file.write('\t'.join(header) + '\n')
+        for start in range(0, rows, chunk_rows):
+            n = np.arange(start, min(rows, start + chunk_rows))
+            t = n * TIME_STEP
+            # The falsifier's clock runs up to T_WRAP and restarts after it.
+            label = np.where(n > 0, t - T_WRAP * np.floor((t - 1e-9) / T_WRAP), 0.0)
+            data = np.tile(base, (len(n), 1))
+            for key in ('t', 'tsample'):
+                if key in columns:
+                    data[:, columns[key]] = label
+            for key, offset in (('x_ego', 0.0), ('x_egosample', 0.0), ('x_env', 30.0), ('x_envsample', 30.0)):
+                if key in columns:
+                    data[:, columns[key]] = base[columns[key]] + offset + SYNTHETIC_VALUES['v_ego'] * t
+            np.savetxt(file, np.column_stack((label, data)), fmt=fmt)
+
+    # One sample / respond / wait cycle per second of trace, as in TimePath.txt.
+    cycles = max(1, int(rows * TIME_STEP))
+    path = '[system_init]^system_t0^[init]' + ''.join(
+        '^sample^[WaitControl,Environment,Plant]^response^[Actuate,Environment,Plant]^%s' % (
+            'next_period^[init]' if n < cycles - 1 else 'target_transition^[system_virtual_target]')
+        for n in range(cycles))
+    with open(os.path.join(case_dir, 'TimePath.txt'), 'w') as file:
+        file.write('path staying time: \n')
+        file.write('  0' + '  0.01  0.03  0.96' * cycles + '  0  \n')
+        file.write('Witness: \n')
+        file.write('\tNo0. :%s\n' % path)
+    shutil.copy(os.path.join(template, 'acceleration_config.txt'), case_dir)
+
+
+def timed(function, repeat=1):
+    """Best wall-clock time of repeat calls, and the last result."""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def record(benchmark, rows, seconds, items, **extra):
+    entry = collections.OrderedDict()
+    entry['benchmark'] = benchmark
+    entry['rows'] = rows
+    entry['items'] = items
+    entry['seconds'] = seconds
+    entry['us_per_item'] = 1e6 * seconds / items if items else None
+    entry.update(extra)
+    return entry
+
+
+# ==============================================================================
+# -- Benchmarks ----------------------------------------------------------------
+# ==============================================================================
+
+
+def bench_trace(case_dir, rows, skip, repeat):
+    """Loading and row lookup benchmarks for one synthetic case."""
+    import manual_control
+    results = []
+    csv_path = os.path.join(case_dir, 'result.csv')
+    keys = manual_control.key_list
+
+    def load():
+        trace = load_trace(csv_path, keys)
+        trace['t'] = stitch_periods(trace['t'])
+        return trace
+
+    seconds, trace = timed(load, repeat)
+    if 'load_trace' not in skip:
+        results.append(record('load_trace', rows, seconds, rows,
+                              file_mb=os.path.getsize(csv_path) / 1e6))
+
+    cache_dir = os.path.join(case_dir, '.bench_cache')
+    if 'cache_cold' not in skip:
+        def cold():
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            return TraceCache(case_dir, cache_dir).load_trace(csv_path, keys)
+        seconds, _ = timed(cold, repeat)
+        results.append(record('cache_cold', rows, seconds, rows))
+    if 'cache_warm' not in skip:
+        TraceCache(case_dir, cache_dir).load_trace(csv_path, keys)
+        seconds, _ = timed(lambda: TraceCache(case_dir, cache_dir).load_trace(csv_path, keys), repeat)
+        results.append(record('cache_warm', rows, seconds, rows))
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+    if 'stream_scan' not in skip:
+        def scan():
+            stream = TraceStream(csv_path, keys)
+            x = stream['x_env']
+            idx = 0
+            while stream.has_row(idx):
+                x[idx]
+                stream.release(idx)
+                idx += 1
+            return idx
+        seconds, scanned = timed(scan, repeat)
+        results.append(record('stream_scan', rows, seconds, scanned))
+
+    if 'row_at_tick' not in skip:
+        ticks = int(round(trace['t'][-1] / TIME_STEP)) + 1
+
+        def lookup():
+            found = 0
+            for tick in range(ticks):
+                if trace.row_at_tick(tick, TIME_STEP) is not None:
+                    found += 1
+            return found
+        seconds, _ = timed(lookup, repeat)
+        results.append(record('row_at_tick', rows, seconds, ticks))
+
+    results.extend(bench_controller(case_dir, trace, rows, skip, repeat))
+    return results
+
+
+def bench_controller(case_dir, trace, rows, skip, repeat):
+    import manual_control
+    results = []
+    manual_control.info = trace
+    manual_control.restricted_areas = None
+    manual_control.parse_acceleration_config(os.path.join(case_dir, 'acceleration_config.txt'))
+    samples = np.linspace(0, rows - 1, min(rows, CONTROLLER_SAMPLES)).astype(np.int64).tolist()
+    init = local_carla.Location(100.0, 0.0, 0.3)
+    ego = local_carla.Location(90.0, 0.0, 0.0)
+    obstacle = local_carla.Location(1000.0, 0.0, 0.0)
+
+    def danger():
+        for idx in samples:
+            manual_control.compute_danger(idx, init, ego, obstacle, obstacle)
+
+    def acceleration():
+        for idx in samples:
+            manual_control.calculate_acceleration(0, idx, manual_control.calculate_dd(idx))
+
+    if 'compute_danger' not in skip:
+        seconds, _ = timed(danger, repeat)
+        results.append(record('compute_danger', rows, seconds, len(samples)))
+    if 'calculate_accel' not in skip:
+        seconds, _ = timed(acceleration, repeat)
+        results.append(record('calculate_accel', rows, seconds, len(samples)))
+    return results
+
+
+def bench_replay(case_dir, seconds, work_dir):
+    """Replay a synthetic case in the local backend; one record per loop phase."""
+    import manual_control
+    profile_path = os.path.join(work_dir, 'replay_profile.json')
+    args = manual_control.parse_args([
+        '--case', case_dir, '--backend', 'local', '--headless',
+        '--no-trace-cache', '--max-time', str(seconds), '--profile', profile_path])
+    with open(os.path.join(work_dir, 'replay.log'), 'w') as log, contextlib.redirect_stdout(log):
+        wall, (outcome,) = timed(lambda: manual_control.replay_case(args))
+    results = [record('replay', None, wall, outcome['ticks'], collision=outcome['collision'])]
+    for phase, stats in outcome.get('profile', {}).items():
+        results.append(record(
+            'replay_' + phase, None, stats['total_s'], stats['count'],
+            p50_ms=stats['p50_ms'], p95_ms=stats['p95_ms'], p99_ms=stats['p99_ms'], max_ms=stats['max_ms']))
+    return results
+
+
+# ==============================================================================
+# -- Output --------------------------------------------------------------------
+# ==============================================================================
+
+
+def environment():
+    return collections.OrderedDict((
+        ('python', platform.python_version()),
+        ('numpy', np.__version__),
+        ('platform', platform.platform()),
+        ('processor', platform.processor()),
+        ('time', time.strftime('%Y-%m-%dT%H:%M:%S'))))
+
+
+def write_results(results, file_path):
+    if file_path.endswith('.csv'):
+        fields = []
+        for entry in results:
+            fields.extend(key for key in entry if key not in fields)
+        with open(file_path, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(results)
+    else:
+        with open(file_path, 'w') as file:
+            json.dump({'environment': environment(), 'results': results}, file, indent=2)
+
+
+def print_results(results):
+    print('%-24s %10s %10s %12s %14s' % ('benchmark', 'rows', 'items', 'seconds', 'us per item'))
+    for entry in results:
+        print('%-24s %10s %10s %12.6f %14s' % (
+            entry['benchmark'], entry['rows'] if entry['rows'] is not None else '-', entry['items'],
+            entry['seconds'],
+            '%.3f' % entry['us_per_item'] if entry['us_per_item'] is not None else '-'))
+
+
+# ==============================================================================
+# -- main() --------------------------------------------------------------------
+# ==============================================================================
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description='Benchmark trace loading, the controller and the replay loop')
+    argparser.add_argument(
+        '--rows',
+        metavar='N1,N2,...',
+        default=DEFAULT_ROWS,
+        help='trace lengths to generate and benchmark (default: %s)' % DEFAULT_ROWS)
+    argparser.add_argument(
+        '--replay-seconds',
+        metavar='SECONDS',
+        default=20.0,
+        type=float,
+        help='trace time replayed by the replay benchmark (default: 20)')
+    argparser.add_argument(
+        '--repeat',
+        metavar='N',
+        default=3,
+        type=int,
+        help='runs per benchmark, the best one is reported (default: 3)')
+    argparser.add_argument(
+        '--skip',
+        metavar='NAME,...',
+        default='',
+        help='benchmarks to leave out, among: %s' % ', '.join(BENCHMARKS))
+    argparser.add_argument(
+        '--template',
+        metavar='DIR',
+        default=TEMPLATE_CASE,
+        help='case folder whose result.csv columns the synthetic traces copy')
+    argparser.add_argument(
+        '--work-dir',
+        metavar='DIR',
+        default=None,
+        help='folder for the synthetic cases, kept after the run (default: a temporary folder)')
+    argparser.add_argument(
+        '-o', '--output',
+        metavar='FILE',
+        default='benchmark_results.json',
+        help='results file, CSV for a .csv name and JSON otherwise (default: benchmark_results.json)')
+    args = argparser.parse_args()
+
+    skip = set(name for name in args.skip.split(',') if name)
+    unknown = skip.difference(BENCHMARKS)
+    if unknown:
+        argparser.error('unknown benchmark(s): %s' % ', '.join(sorted(unknown)))
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='replay_bench_')
+    results = []
+    try:
+        for rows in parse_rows(args.rows):
+            case_dir = os.path.join(work_dir, 'rows_%d' % rows)
+            print('generating %d rows in %s' % (rows, case_dir))
+            seconds, _ = timed(lambda: write_case(case_dir, rows, args.template))
+            results.append(record('generate', rows, seconds, rows))
+            results.extend(bench_trace(case_dir, rows, skip, args.repeat))
+            if args.work_dir is None:
+                shutil.rmtree(case_dir, ignore_errors=True)
+        if 'replay' not in skip:
+            case_dir = os.path.join(work_dir, 'replay')
+            # Trace rows beyond the horizon keep the injection going to the end.
+            write_case(case_dir, int(args.replay_seconds / TIME_STEP) + 100, args.template)
+            print('replaying %g s in the local backend' % args.replay_seconds)
+            results.extend(bench_replay(case_dir, args.replay_seconds, work_dir))
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    write_results(results, args.output)
+    print_results(results)
+    print('results written to %s' % args.output)
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+
+"""
+Replay a whole tree of falsifier case folders through manual_control.py in
+parallel and collect the outcomes in one results table.
+
+Every folder below the given roots that holds a result.csv and a
+TimePath.txt is one case (Case1_Random_Actor, Case2_Static_Actor, ...).
+Cases run in a process pool; each running case leases one CARLA port from
+--ports, or uses the local stand-in backend. Options after '--' are passed
+to manual_control.py for every case:
+
+    python campaign.py .. --backend local --workers 8 -- --headless
+    python campaign.py ../cases --ports 2000,3000 -- --host 10.0.0.5 --headless
+
+With '-- --witness all' every witness of a case's TimePath.txt is replayed
+in the case's CARLA session, one results row per witness.
+"""
+
+from __future__ import print_function
+
+import argparse
+import contextlib
+import csv
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+
+# ==============================================================================
+# -- Global functions ----------------------------------------------------------
+# ==============================================================================
+
+
+CASE_FILES = ('result.csv', 'TimePath.txt')
+ACTORS = ('ego', 'npc', 'walker', 'barrel')
+
+RESULT_FIELDS = (
+    ['case', 'witness', 'status', 'collision_time', 'collision_intensity', 'divergence', 'ticks',
+     'setup_seconds', 'wall_seconds'] +
+    ['%s_%s' % (actor, axis) for actor in ACTORS for axis in ('x', 'y')] +
+    ['port', 'error'])
+
+
+def find_cases(roots):
+    """Case folders (holding all CASE_FILES) below roots, sorted."""
+    cases = []
+    for root in roots:
+        for dir_path, dir_names, file_names in os.walk(root):
+            dir_names[:] = sorted(name for name in dir_names if not name.startswith('.'))
+            if all(name in file_names for name in CASE_FILES):
+                cases.append(os.path.normpath(dir_path))
+    return sorted(set(cases))
+
+
+def case_name(case_dir, roots):
+    for root in roots:
+        rel = os.path.relpath(case_dir, root)
+        if not rel.startswith(os.pardir):
+            return rel if rel != os.curdir else os.path.basename(os.path.abspath(case_dir))
+    return case_dir
+
+
+# ==============================================================================
+# -- Workers -------------------------------------------------------------------
+# ==============================================================================
+
+
+_ports = None
+
+
+def _init_worker(ports):
+    global _ports
+    _ports = ports
+
+
+def outcome_row(row, outcome):
+    """Fill row with the outcome of one replayed witness."""
+    if outcome.get('diverged'):
+        row['status'] = 'diverged'
+    elif outcome['collision']:
+        row['status'] = 'collision'
+        row['collision_time'] = '%.2f' % outcome['collision_time']
+        row['collision_intensity'] = '%.1f' % outcome['collision_intensity']
+    else:
+        row['status'] = 'no_collision' if outcome['finished'] else 'cancelled'
+    row['witness'] = outcome['witness']
+    row['ticks'] = outcome['ticks']
+    row['setup_seconds'] = '%.2f' % outcome['setup_seconds']
+    if outcome.get('divergence'):
+        row['divergence'] = '%.3f' % max(
+            stats['position_max'] for stats in outcome['divergence'].values())
+    for actor, location in outcome.get('positions', {}).items():
+        if location is not None:
+            row[actor + '_x'] = '%.3f' % location[0]
+            row[actor + '_y'] = '%.3f' % location[1]
+    return row
+
+
+def run_case(case_dir, replay_argv, backend, log_path=None):
+    """Replay one case in this process; returns its rows of the results table, one per witness."""
+    row = dict((field, '') for field in RESULT_FIELDS)
+    row['case'] = case_dir
+    rows = [row]
+    port = _ports.get() if backend == 'carla' and _ports is not None else None
+    start = time.time()
+    try:
+        # Imported here so the campaign itself does not need carla or pygame.
+        import manual_control
+        argv = list(replay_argv) + ['--case', case_dir, '--backend', backend]
+        if port is not None:
+            argv += ['--port', str(port)]
+            row['port'] = port
+        args = manual_control.parse_args(argv)
+        if log_path is None:
+            outcomes = manual_control.replay_case(args)
+        else:
+            with open(log_path, 'w') as log, contextlib.redirect_stdout(log):
+                outcomes = manual_control.replay_case(args)
+        if not outcomes:
+            row['status'] = 'cancelled'
+        else:
+            rows = [outcome_row(dict(row), outcome) for outcome in outcomes]
+    except Exception as error:
+        row['status'] = 'error'
+        row['error'] = '%s: %s' % (type(error).__name__, error)
+        rows = [row]
+        if log_path is not None:
+            with open(log_path, 'a') as log:
+                traceback.print_exc(file=log)
+    finally:
+        if port is not None:
+            _ports.put(port)
+    for row in rows:
+        row['wall_seconds'] = '%.2f' % (time.time() - start)
+    return rows
+
+
+def _run_case(task):
+    return run_case(*task)
+
+
+# ==============================================================================
+# -- Campaign ------------------------------------------------------------------
+# ==============================================================================
+
+
+def run_campaign(cases, replay_argv, backend='local', workers=1, ports=None, log_dir=None):
+    """Replay cases in a process pool; yields each case's result rows as it finishes.
+
+    With the carla backend at most one case runs per port at a time.
+    """
+    if backend == 'carla':
+        ports = list(ports or [2000])
+        workers = min(workers, len(ports))
+    if log_dir is not None and not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+    manager = multiprocessing.Manager()
+    port_queue = None
+    if backend == 'carla':
+        port_queue = manager.Queue()
+        for port in ports:
+            port_queue.put(port)
+    tasks = []
+    for n, case_dir in enumerate(cases):
+        log_path = None
+        if log_dir is not None:
+            log_path = os.path.join(log_dir, '%04d_%s.log' % (n, os.path.basename(case_dir)))
+        tasks.append((case_dir, replay_argv, backend, log_path))
+    # One case per worker process: manual_control keeps the replay in module
+    # globals, and a fresh process starts every case from a clean state.
+    pool = multiprocessing.Pool(workers, _init_worker, (port_queue,), maxtasksperchild=1)
+    try:
+        for rows in pool.imap_unordered(_run_case, tasks):
+            yield rows
+    finally:
+        pool.terminate()
+        pool.join()
+        manager.shutdown()
+
+
+def write_results(rows, file_path):
+    with open(file_path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def print_results(rows):
+    print('%-40s %7s %-13s %10s %8s %9s' % ('case', 'witness', 'status', 'collision', 'ticks', 'setup [s]'))
+    for row in rows:
+        print('%-40s %7s %-13s %10s %8s %9s' % (
+            row['case'], row['witness'], row['status'], row['collision_time'], row['ticks'], row['setup_seconds']))
+        if row['error']:
+            print('    %s' % row['error'])
+    counts = dict()
+    for row in rows:
+        counts[row['status']] = counts.get(row['status'], 0) + 1
+    print('%d replays: %s' % (len(rows), ', '.join('%d %s' % (n, status) for status, n in sorted(counts.items()))))
+
+
+# ==============================================================================
+# -- main() --------------------------------------------------------------------
+# ==============================================================================
+
+
+def main():
+    argv = sys.argv[1:]
+    replay_argv = []
+    if '--' in argv:
+        split = argv.index('--')
+        argv, replay_argv = argv[:split], argv[split + 1:]
+
+    argparser = argparse.ArgumentParser(
+        description='Replay a tree of falsifier case folders in parallel')
+    argparser.add_argument(
+        'roots',
+        nargs='+',
+        metavar='DIR',
+        help='directories searched for case folders (holding %s)' % ' and '.join(CASE_FILES))
+    argparser.add_argument(
+        '--backend',
+        default='local',
+        choices=['carla', 'local'],
+        help='simulator each case replays in (default: local)')
+    argparser.add_argument(
+        '-j', '--workers',
+        metavar='N',
+        default=multiprocessing.cpu_count(),
+        type=int,
+        help='parallel replays; with --backend carla at most one per port (default: CPU count)')
+    argparser.add_argument(
+        '--ports',
+        metavar='P1,P2,...',
+        default='2000',
+        help='CARLA server ports, one running case per port (default: 2000)')
+    argparser.add_argument(
+        '--max-time',
+        metavar='SECONDS',
+        default=30.0,
+        type=float,
+        help='replay horizon of a case without collision, as the falsifier\'s '
+             'time-bound (default: 30)')
+    argparser.add_argument(
+        '-o', '--output',
+        metavar='FILE',
+        default='campaign_results.csv',
+        help='results table (default: campaign_results.csv)')
+    argparser.add_argument(
+        '--log-dir',
+        metavar='DIR',
+        default=None,
+        help='write each case\'s replay output to DIR/<n>_<case>.log instead of stdout')
+    args = argparser.parse_args(argv)
+
+    cases = find_cases(args.roots)
+    if not cases:
+        print('no case folders found below %s' % ', '.join(args.roots))
+        return 1
+    ports = [int(port) for port in args.ports.split(',') if port]
+    if '--max-time' not in replay_argv:
+        replay_argv += ['--max-time', str(args.max_time)]
+    print('replaying %d cases with %s backend' % (len(cases), args.backend))
+
+    rows = []
+    for case_rows in run_campaign(cases, replay_argv, args.backend, args.workers, ports, args.log_dir):
+        for row in case_rows:
+            print('%-40s %s' % (row['case'], row['status']))
+        rows.extend(case_rows)
+    order = dict((case_dir, n) for n, case_dir in enumerate(cases))
+    # sorted() is stable: a case's witnesses stay in replay order.
+    rows.sort(key=lambda row: order[row['case']])
+    for row in rows:
+        row['case'] = case_name(row['case'], args.roots)
+    write_results(rows, args.output)
+    print_results(rows)
+    print('results written to %s' % args.output)
+    return 1 if any(row['status'] == 'error' for row in rows) else 0
+
+
+if __name__ == '__main__':
+
+    raise SystemExit(main())
@@ -0,0 +1,409 @@
+#!/usr/bin/env python
+
+"""
+Compiled evaluation of the 'initial' and 'forbidden' expressions of a case
+.cfg file (random.cfg, static.cfg, ...) over whole traces.
+
+An expression such as
+
+    loc()==Actuate,Environment,Plant & action==-1 & abs(RandomActorX_env - x_ego)< 0.1
+
+is parsed once into a tree of NumPy closures; evaluating it on a trace gives
+one boolean per row. Run as a script it reports the first forbidden frame and
+every violating interval of the given case folders:
+
+    python cfg_predicates.py ../Case1_Random_Actor ../Case2_Static_Actor
+"""
+
+from __future__ import print_function
+
+import argparse
+import functools
+import glob
+import os
+import re
+
+import numpy as np
+
+from timetable import load_witnesses
+from trace_store import load_trace, read_header, stitch_periods
+
+
+# ==============================================================================
+# -- Global functions ----------------------------------------------------------
+# ==============================================================================
+
+
+EQ_TOLERANCE = 1e-9
+
+FUNCTIONS = {
+    'abs': np.abs,
+    'sqrt': np.sqrt,
+    'exp': np.exp,
+    'log': np.log,
+    'sin': np.sin,
+    'cos': np.cos,
+    'tan': np.tan,
+    'min': np.minimum,
+    'max': np.maximum,
+}
+
+_TOKEN_RE = re.compile(r'''
+    \s*(?:
+        (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+      | (?P<loc>loc\(\))
+      | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+      | (?P<op>==|!=|<=|>=|&&|\|\||[<>&|!+\-*/(),])
+    )''', re.VERBOSE)
+
+_COMPARISONS = {
+    '<': np.less,
+    '<=': np.less_equal,
+    '>': np.greater,
+    '>=': np.greater_equal,
+}
+
+
+def read_cfg(file_path):
+    """Read the 'key = value' lines of a case .cfg file into a dict of strings."""
+    cfg = dict()
+    with open(file_path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith('#') or '=' not in line:
+                continue
+            key, value = line.split('=', 1)
+            cfg[key.strip()] = value.strip().strip('"').strip()
+    return cfg
+
+
+def tokenize(text):
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = _TOKEN_RE.match(text, pos)
+        if match is None:
+            raise SyntaxError('unexpected %r at offset %d in %r' % (text[pos:pos + 10], pos, text))
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        pos = match.end()
+    return tokens
+
+
+def compile_predicate(text):
+    """Compile a .cfg expression into a Predicate."""
+    return Predicate(text)
+
+
+def violation_intervals(mask):
+    """Return [(first_row, last_row + 1), ...] for every run of True in mask."""
+    mask = np.asarray(mask, dtype=bool)
+    edges = np.diff(np.concatenate(([0], mask.view(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+# ==============================================================================
+# -- Predicate -----------------------------------------------------------------
+# ==============================================================================
+
+
+class Predicate(object):
+    """A compiled .cfg expression, evaluated on all rows of a trace at once.
+
+    'variables' lists the trace columns it reads. loc() terms compare against
+    an optional per-row array of location names ('Actuate,Environment,Plant');
+    without one they are left unconstrained.
+    """
+    def __init__(self, text):
+        self.source = text
+        self.variables = set()
+        self.locations = set()
+        self._tokens = tokenize(text)
+        self._pos = 0
+        self._eval = self._parse_or()
+        if self._pos != len(self._tokens):
+            raise SyntaxError('unexpected %r in %r' % (self._tokens[self._pos][1], text))
+        del self._tokens
+
+    def __call__(self, trace, loc=None, eq_tolerance=EQ_TOLERANCE):
+        if self.variables:
+            rows = len(trace[next(iter(self.variables))])
+        elif loc is not None:
+            rows = len(loc)
+        else:
+            keys = list(trace.keys())
+            if not keys:
+                raise ValueError('%r reads no column: pass a non-empty trace or loc' % self.source)
+            rows = len(trace[keys[0]])
+        if loc is not None:
+            loc = np.asarray(loc)
+        result = self._eval(_Env(trace, loc, eq_tolerance))
+        return np.broadcast_to(np.asarray(result, dtype=bool), (rows,))
+
+    # -- parser ----------------------------------------------------------------
+
+    def _peek(self):
+        return self._tokens[self._pos] if self._pos < len(self._tokens) else (None, None)
+
+    def _accept(self, *ops):
+        kind, value = self._peek()
+        if kind == 'op' and value in ops:
+            self._pos += 1
+            return value
+        return None
+
+    def _expect(self, op):
+        if self._accept(op) is None:
+            raise SyntaxError('expected %r in %r' % (op, self.source))
+
+    def _parse_or(self):
+        terms = [self._parse_and()]
+        while self._accept('|', '||'):
+            terms.append(self._parse_and())
+        if len(terms) == 1:
+            return terms[0]
+        return lambda env: functools.reduce(np.logical_or, [term(env) for term in terms])
+
+    def _parse_and(self):
+        terms = [self._parse_not()]
+        while self._accept('&', '&&'):
+            terms.append(self._parse_not())
+        if len(terms) == 1:
+            return terms[0]
+        return lambda env: functools.reduce(np.logical_and, [term(env) for term in terms])
+
+    def _parse_not(self):
+        if self._accept('!'):
+            operand = self._parse_not()
+            return lambda env: np.logical_not(operand(env))
+        return self._parse_comparison()
+
+    def _parse_comparison(self):
+        kind, _ = self._peek()
+        if kind == 'loc':
+            return self._parse_loc()
+        left = self._parse_sum()
+        checks = []
+        while True:
+            op = self._accept('<', '<=', '>', '>=', '==', '!=')
+            if op is None:
+                break
+            right = self._parse_sum()
+            checks.append(self._comparison(op, left, right))
+            left = right
+        if not checks:
+            return left
+        if len(checks) == 1:
+            return checks[0]
+        # Chained comparisons: 0.0<staticActorX_env<100.0
+        return lambda env: functools.reduce(np.logical_and, [check(env) for check in checks])
+
+    @staticmethod
+    def _comparison(op, left, right):
+        if op == '==':
+            return lambda env: np.abs(left(env) - right(env)) <= env.eq_tolerance
+        if op == '!=':
+            return lambda env: np.abs(left(env) - right(env)) > env.eq_tolerance
+        compare = _COMPARISONS[op]
+        return lambda env: compare(left(env), right(env))
+
+    def _parse_loc(self):
+        self._pos += 1
+        op = self._accept('==', '!=')
+        if op is None:
+            raise SyntaxError('loc() must be compared with == or != in %r' % self.source)
+        names = [self._parse_name()]
+        while self._accept(','):
+            names.append(self._parse_name())
+        location = ','.join(names)
+        self.locations.add(location)
+        negate = op == '!='
+
+        def evaluate(env):
+            if env.loc is None:
+                return True
+            return (env.loc != location) if negate else (env.loc == location)
+        return evaluate
+
+    def _parse_name(self):
+        kind, value = self._peek()
+        if kind != 'name':
+            raise SyntaxError('expected a location name in %r' % self.source)
+        self._pos += 1
+        return value
+
+    def _parse_sum(self):
+        left = self._parse_product()
+        while True:
+            op = self._accept('+', '-')
+            if op is None:
+                return left
+            right = self._parse_product()
+            left = self._binary(np.add if op == '+' else np.subtract, left, right)
+
+    def _parse_product(self):
+        left = self._parse_unary()
+        while True:
+            op = self._accept('*', '/')
+            if op is None:
+                return left
+            right = self._parse_unary()
+            left = self._binary(np.multiply if op == '*' else np.true_divide, left, right)
+
+    @staticmethod
+    def _binary(function, left, right):
+        return lambda env: function(left(env), right(env))
+
+    def _parse_unary(self):
+        if self._accept('-'):
+            operand = self._parse_unary()
+            return lambda env: np.negative(operand(env))
+        if self._accept('+'):
+            return self._parse_unary()
+        return self._parse_primary()
+
+    def _parse_primary(self):
+        kind, value = self._peek()
+        if kind == 'number':
+            self._pos += 1
+            number = float(value)
+            return lambda env: number
+        if kind == 'name':
+            self._pos += 1
+            if self._accept('('):
+                if value not in FUNCTIONS:
+                    raise SyntaxError('unknown function %r in %r' % (value, self.source))
+                function = FUNCTIONS[value]
+                args = [self._parse_or()]
+                while self._accept(','):
+                    args.append(self._parse_or())
+                self._expect(')')
+                return lambda env: function(*[arg(env) for arg in args])
+            self.variables.add(value)
+            return lambda env: env.column(value)
+        if self._accept('('):
+            inner = self._parse_or()
+            self._expect(')')
+            return inner
+        raise SyntaxError('unexpected %r in %r' % (value, self.source))
+
+
+class _Env(object):
+    def __init__(self, trace, loc, eq_tolerance):
+        self._trace = trace
+        self._columns = dict()
+        self.loc = loc
+        self.eq_tolerance = eq_tolerance
+
+    def column(self, key):
+        if key not in self._columns:
+            self._columns[key] = np.asarray(self._trace[key], dtype=np.float64)
+        return self._columns[key]
+
+
+# ==============================================================================
+# -- Case checks ---------------------------------------------------------------
+# ==============================================================================
+
+
+def find_cfg(case_dir):
+    found = sorted(glob.glob(os.path.join(case_dir, '*.cfg')))
+    if not found:
+        raise IOError('no .cfg file in %s' % case_dir)
+    return found[0]
+
+
+def witness_locations(case_dir, times, witness=0):
+    """Location of the case's witness at every trace time, from its TimePath.txt.
+
+    times is the trace's 't' column, stitched across period wraps here.
+    Returns None when the case folder holds no TimePath.txt.
+    """
+    file_path = os.path.join(case_dir, 'TimePath.txt')
+    if not os.path.exists(file_path):
+        return None
+    witness = load_witnesses(file_path)[witness]
+    # The trace ends in the state the path reaches its target from, i.e. in
+    # the last location it stays in rather than the zero-stay target itself.
+    staying = np.flatnonzero(witness.stay > 0)
+    last = witness.modes[staying[-1]] if len(staying) else witness.modes[-1]
+    return np.array([
+        witness.location_at(t) if t < witness.duration else last
+        for t in stitch_periods(times)])
+
+
+def check_case(case_dir, cfg_path=None, loc=None, witness=0):
+    """Evaluate the case's forbidden (and initial) predicates over its trace.
+
+    loc defaults to the locations of the given witness of the case's
+    TimePath.txt. Returns a dict with the 'forbidden' row mask, the violating
+    'intervals', the 'first_forbidden' row (or None) and whether row 0
+    satisfies 'initial'.
+    """
+    cfg = read_cfg(cfg_path or find_cfg(case_dir))
+    trace_path = os.path.join(case_dir, 'result.csv')
+    forbidden = compile_predicate(cfg['forbidden'])
+    initial = compile_predicate(cfg['initial']) if 'initial' in cfg else None
+    header = set(read_header(trace_path))
+    keys = set(forbidden.variables) | set(['t'])
+    if initial is not None:
+        keys |= set(key for key in initial.variables if key in header)
+    trace = load_trace(trace_path, sorted(keys))
+    if loc is None:
+        loc = witness_locations(case_dir, trace['t'], witness)
+    if loc is None and (forbidden.locations or (initial is not None and initial.locations)):
+        print('Warning: %s has no TimePath.txt, loc() terms are not checked' % case_dir)
+    mask = forbidden(trace, loc)
+    intervals = violation_intervals(mask)
+    report = {
+        'forbidden': mask,
+        'intervals': intervals,
+        'first_forbidden': intervals[0][0] if intervals else None,
+        'times': trace['t'],
+        'initial': None}
+    if initial is not None and initial.variables <= header:
+        report['initial'] = bool(initial(trace, loc)[0])
+    return report
+
+
+# ==============================================================================
+# -- main() --------------------------------------------------------------------
+# ==============================================================================
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description='Report forbidden frames of falsifier traces from their .cfg predicates')
+    argparser.add_argument(
+        'cases',
+        nargs='+',
+        metavar='CASE_DIR',
+        help='case folders holding result.csv, TimePath.txt and a .cfg file')
+    argparser.add_argument(
+        '--witness',
+        default=0,
+        type=int,
+        metavar='N',
+        help='TimePath.txt witness whose locations loc() terms are checked against (default: 0)')
+    args = argparser.parse_args()
+
+    for case_dir in args.cases:
+        report = check_case(case_dir, witness=args.witness)
+        times = report['times']
+        if report['first_forbidden'] is None:
+            print('%-40s no forbidden frame' % case_dir)
+        else:
+            row = report['first_forbidden']
+            print('%-40s first forbidden frame: row %d (t = %g)' % (case_dir, row, times[row]))
+        for start, end in report['intervals']:
+            print('    rows %d-%d (t = %g .. %g)' % (start, end - 1, times[start], times[end - 1]))
+        if report['initial'] is not None:
+            print('    initial condition %s on row 0' % ('holds' if report['initial'] else 'does not hold'))
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+"""
+Vectorized offline evaluation of the EnvAADL controller models.
+
+Mirrors the behavior annex of ADSControllerLowAggressive and
+ADSControllerHighAggressive (env-self-driving-car/case-study) over every row
+of a falsifier trace at once, so the danger/dd/contl_aego/action columns the
+Java engine wrote to result.csv can be cross-checked without CARLA:
+
+    python controller_model.py ../Case1_Random_Actor ../Case2_Static_Actor
+
+The controller reads the values latched by the last 'sample' transition, i.e.
+the '*sample' columns of the trace.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+
+import numpy as np
+
+from trace_store import load_trace
+
+
+# ==============================================================================
+# -- Global functions ----------------------------------------------------------
+# ==============================================================================
+
+
+LOW_AGGRESSIVE = 'ADSLowAggressive'
+HIGH_AGGRESSIVE = 'ADSHighAggressive'
+
+DANGER_RADIUS = 0.5
+SAFETY_DISTANCE = {LOW_AGGRESSIVE: 30.0, HIGH_AGGRESSIVE: 10.0}
+DEFAULT_ACCELERATION = 2.8
+DEFAULT_DECELERATION = -2.8
+
+SAMPLED_KEYS = [
+    'x_env', 'err', 'x_ego', 'y_ego', 'friction', 'slope',
+    'staticActorX_env', 'staticActorY_env', 'RandomActorX_env', 'RandomActorY_env',
+    'restrictSignalAreaX_env', 'signal_env',
+    'restrictRailCrossAreaXmin_env', 'restrictRailCrossAreaXmax_env',
+    'restrictRailCrossAreaYmin_env', 'restrictRailCrossAreaYmax_env', 'railSignal_env',
+    'restrictParkAreaXmin_env', 'restrictParkAreaXmax_env',
+    'restrictParkAreaYmin_env', 'restrictParkAreaYmax_env',
+    'restrictUturnAreaXmin_env', 'restrictUturnAreaXmax_env',
+    'restrictUturnAreaYmin_env', 'restrictUturnAreaYmax_env']
+OUTPUT_KEYS = ['danger', 'dd', 'contl_aego', 'action']
+CONTROLLER_KEYS = [key + 'sample' for key in SAMPLED_KEYS] + OUTPUT_KEYS
+
+
+def read_acceleration_config(file_path):
+    """Read acceleration_config.txt ('Acceleration: 2.8' lines) into a dict."""
+    config = dict()
+    with open(file_path, 'r') as file:
+        for line in file:
+            if ':' not in line:
+                continue
+            key, value = line.split(':', 1)
+            try:
+                config[key.strip()] = float(value)
+            except ValueError:
+                print("Warning: Cannot parse value '%s' (line content: '%s')" % (value.strip(), line.strip()))
+    return config
+
+
+def _near(a, b):
+    return np.abs(a - b) < DANGER_RADIUS
+
+
+def evaluate_danger(trace, suffix='sample'):
+    """'danger' of the LowAggressive controller for every row (0.0 or 1.0)."""
+    def val(key):
+        return np.asarray(trace[key + suffix], dtype=np.float64)
+    x_ego = val('x_ego')
+    y_ego = val('y_ego')
+    # Every branch of the if/elsif chain assigns danger := 1, so the chain is
+    # the disjunction of its conditions.
+    static_actor = _near(val('staticActorX_env'), x_ego) & _near(val('staticActorY_env'), y_ego)
+    random_actor = _near(val('RandomActorX_env'), x_ego) & _near(val('RandomActorY_env'), y_ego)
+    signal = _near(val('restrictSignalAreaX_env'), x_ego) & (val('signal_env') > 0.5)
+    danger = static_actor | random_actor | signal
+    for area in ('RailCross', 'Park', 'Uturn'):
+        inside = (
+            _near(val('restrict%sAreaXmin_env' % area), x_ego) |
+            _near(val('restrict%sAreaXmax_env' % area), x_ego) |
+            _near(val('restrict%sAreaYmin_env' % area), y_ego) |
+            _near(val('restrict%sAreaYmax_env' % area), y_ego))
+        if area == 'RailCross':
+            inside &= val('railSignal_env') > 0.5
+        danger |= inside
+    return danger.astype(np.float64)
+
+
+def evaluate_controller(trace, model=LOW_AGGRESSIVE, acceleration=DEFAULT_ACCELERATION,
+                        deceleration=DEFAULT_DECELERATION, suffix='sample'):
+    """Run the controller's response transition on every row of the trace.
+
+    trace maps variable names to equally long arrays (a TraceStore works).
+    Returns a dict with the 'danger', 'dd', 'contl_aego' and 'action' arrays.
+    """
+    def val(key):
+        return np.asarray(trace[key + suffix], dtype=np.float64)
+    if model not in SAFETY_DISTANCE:
+        raise ValueError('unknown controller model %r' % model)
+    dd = val('x_env') - val('x_ego') + val('err')
+    modify_acc = 10 * 0.01 * val('friction') * np.cos(val('slope'))
+    accelerate = dd > SAFETY_DISTANCE[model]
+    if model == LOW_AGGRESSIVE:
+        danger = evaluate_danger(trace, suffix)
+        accelerate &= ~(danger > 0)
+    else:
+        danger = np.zeros_like(dd)
+    contl_aego = np.where(accelerate, acceleration, deceleration) - modify_acc
+    return {
+        'danger': danger,
+        'dd': dd,
+        'contl_aego': contl_aego,
+        'action': np.sign(contl_aego)}
+
+
+def responded_rows(trace):
+    """Rows at or after the controller's first response in the trace.
+
+    Before it, the engine's output columns still hold their initial zeros.
+    """
+    action = np.asarray(trace['action'])
+    responded = np.flatnonzero(action != 0)
+    mask = np.zeros(action.shape, dtype=bool)
+    if responded.size:
+        mask[responded[0]:] = True
+    return mask
+
+
+def compare_with_engine(trace, result, rows=None, rtol=1e-5, atol=1e-4):
+    """Compare evaluate_controller output with the engine's columns.
+
+    Returns {key: (max abs error, number of mismatching rows)} over rows
+    (default: responded_rows). The engine prints 6 significant digits.
+    """
+    if rows is None:
+        rows = responded_rows(trace)
+    report = dict()
+    for key in OUTPUT_KEYS:
+        expected = np.asarray(trace[key], dtype=np.float64)[rows]
+        actual = result[key][rows]
+        error = np.abs(actual - expected)
+        mismatches = ~np.isclose(actual, expected, rtol=rtol, atol=atol)
+        report[key] = (float(error.max()) if error.size else 0.0, int(np.count_nonzero(mismatches)))
+    return report
+
+
+def evaluate_case(case_dir, model=LOW_AGGRESSIVE):
+    """Load a case folder and return (trace, controller output)."""
+    trace = load_trace(os.path.join(case_dir, 'result.csv'), CONTROLLER_KEYS)
+    config_path = os.path.join(case_dir, 'acceleration_config.txt')
+    config = read_acceleration_config(config_path) if os.path.exists(config_path) else {}
+    result = evaluate_controller(
+        trace,
+        model,
+        acceleration=config.get('Acceleration', DEFAULT_ACCELERATION),
+        deceleration=config.get('Deacceleration', DEFAULT_DECELERATION))
+    return trace, result
+
+
+# ==============================================================================
+# -- main() --------------------------------------------------------------------
+# ==============================================================================
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description='Cross-check result.csv controller columns against the EnvAADL controller model')
+    argparser.add_argument(
+        'cases',
+        nargs='+',
+        metavar='CASE_DIR',
+        help='case folders holding result.csv (and acceleration_config.txt)')
+    argparser.add_argument(
+        '--model',
+        default=LOW_AGGRESSIVE,
+        choices=[LOW_AGGRESSIVE, HIGH_AGGRESSIVE],
+        help='controller behavior annex to evaluate (default: %s)' % LOW_AGGRESSIVE)
+    args = argparser.parse_args()
+
+    failed = 0
+    for case_dir in args.cases:
+        trace, result = evaluate_case(case_dir, args.model)
+        report = compare_with_engine(trace, result)
+        ok = all(mismatches == 0 for _, mismatches in report.values())
+        failed += 0 if ok else 1
+        print('%-40s %s' % (case_dir, 'OK' if ok else 'MISMATCH'))
+        for key in OUTPUT_KEYS:
+            print('    %-10s max error % .3g, %d mismatching rows' % ((key,) + report[key]))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+
+    raise SystemExit(main())
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""
+Online check that a replay follows the trace it reproduces.
+
+Every tick with a trace row, manual_control.py hands the monitor the position
+and speed each actor should have according to the trace and the ones it has
+in the simulator. The monitor keeps, per actor, the running maximum and RMS
+of the position error (metres, in the ground plane) and of the speed error
+(m/s): a constant amount of work and memory per tick, however long the
+replay. When a limit is set and an error exceeds it, exceeded is set and
+the replay can stop early instead of running a scenario that has already
+left the counterexample's envelope.
+"""
+
+from __future__ import print_function
+
+import collections
+import math
+
+import numpy as np
+
+
+# ==============================================================================
+# -- DivergenceMonitor ---------------------------------------------------------
+# ==============================================================================
+
+
+POSITION = 'position'
+SPEED = 'speed'
+
+
+class DivergenceMonitor(object):
+    """Running max/RMS position and speed error per actor.
+
+    update() takes (n, 3) arrays of (x, y, speed) rows, one per actor in the
+    order of actors; rows holding NaN (actor not spawned) are skipped.
+    """
+    def __init__(self, actors, position_limit=None, speed_limit=None):
+        self.actors = list(actors)
+        self.position_limit = position_limit
+        self.speed_limit = speed_limit
+        n = len(self.actors)
+        self.count = np.zeros(n, dtype=np.int64)
+        self.position_sq = np.zeros(n)
+        self.position_max = np.zeros(n)
+        self.position_max_time = np.full(n, np.nan)
+        self.speed_sq = np.zeros(n)
+        self.speed_max = np.zeros(n)
+        self.speed_max_time = np.full(n, np.nan)
+        # (actor, POSITION or SPEED, error, time) of the first limit exceeded.
+        self.exceeded = None
+
+    def update(self, time, expected, actual):
+        """Add one tick; returns True once a limit has been exceeded."""
+        expected = np.asarray(expected, dtype=np.float64)
+        actual = np.asarray(actual, dtype=np.float64)
+        valid = ~(np.isnan(expected).any(axis=1) | np.isnan(actual).any(axis=1))
+        position = np.where(valid, np.hypot(*(actual[:, :2] - expected[:, :2]).T), 0.0)
+        speed = np.where(valid, np.abs(actual[:, 2] - expected[:, 2]), 0.0)
+        self.count += valid
+        self.position_sq += position * position
+        self.speed_sq += speed * speed
+        worse = position > self.position_max
+        self.position_max[worse] = position[worse]
+        self.position_max_time[worse] = time
+        worse = speed > self.speed_max
+        self.speed_max[worse] = speed[worse]
+        self.speed_max_time[worse] = time
+        if self.exceeded is None:
+            self._check(time, POSITION, position, self.position_limit)
+            self._check(time, SPEED, speed, self.speed_limit)
+        return self.exceeded is not None
+
+    def _check(self, time, kind, errors, limit):
+        if limit is None or self.exceeded is not None:
+            return
+        over = np.flatnonzero(errors > limit)
+        if over.size:
+            n = over[np.argmax(errors[over])]
+            self.exceeded = (self.actors[n], kind, float(errors[n]), time)
+
+    def summary(self):
+        """{actor: {samples, position/speed rms, max and time of max}}."""
+        summary = collections.OrderedDict()
+        for n, actor in enumerate(self.actors):
+            count = int(self.count[n])
+            stats = collections.OrderedDict()
+            stats['samples'] = count
+            stats['position_rms'] = math.sqrt(self.position_sq[n] / count) if count else 0.0
+            stats['position_max'] = float(self.position_max[n])
+            stats['position_max_time'] = float(self.position_max_time[n])
+            stats['speed_rms'] = math.sqrt(self.speed_sq[n] / count) if count else 0.0
+            stats['speed_max'] = float(self.speed_max[n])
+            stats['speed_max_time'] = float(self.speed_max_time[n])
+            summary[actor] = stats
+        return summary
+
+    def format(self):
+        lines = ['%-8s %8s %12s %12s %10s %12s %12s %10s' % (
+            'actor', 'samples', 'pos rms [m]', 'pos max [m]', 'at [s]',
+            'v rms [m/s]', 'v max [m/s]', 'at [s]')]
+        for actor, stats in self.summary().items():
+            lines.append('%-8s %8d %12.3f %12.3f %10.2f %12.3f %12.3f %10.2f' % (
+                actor, stats['samples'], stats['position_rms'], stats['position_max'],
+                stats['position_max_time'], stats['speed_rms'], stats['speed_max'],
+                stats['speed_max_time']))
+        return '\n'.join(lines)
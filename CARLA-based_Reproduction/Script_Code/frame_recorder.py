@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+
+"""
+Background recording of sensor frames for manual_control.py.
+
+The sensor callback only copies a frame into a bounded queue; writer
+threads take care of encoding and disk I/O, so a slow disk cannot stall the
+callback or perturb the replay. When the queue is full the recorder either
+drops the frame ('drop', the default, never blocks the simulation) or waits
+for a free slot ('block', loses no frame but slows the client down).
+
+Frames go to one of two stores:
+
+    images  one compressed image per frame (png, jpg, ...) or .npy for
+            non-image sensor data
+    raw     fixed-size frames appended to chunked, memory-mapped files
+            (frames_00000.raw, ...) described by frames.json, in a new
+            recording_<n> folder per recording; read them back with
+            read_raw_store()
+
+A raw store can be turned into a video without CARLA:
+
+    python frame_recorder.py _out/recording_000 --to-images png
+"""
+
+from __future__ import print_function
+
+import argparse
+import errno
+import json
+import os
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import numpy as np
+
+try:
+    import pygame
+except ImportError:
+    pygame = None
+
+
+# ==============================================================================
+# -- Global functions ----------------------------------------------------------
+# ==============================================================================
+
+
+DROP = 'drop'
+BLOCK = 'block'
+POLICIES = (DROP, BLOCK)
+
+IMAGE_FORMATS = ('png', 'jpg', 'bmp', 'tga', 'npy')
+RAW = 'raw'
+STORES = IMAGE_FORMATS + (RAW,)
+
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_WRITERS = 2
+DEFAULT_CHUNK_FRAMES = 256
+
+RAW_INDEX_NAME = 'frames.json'
+RAW_CHUNK_NAME = 'frames_%05d.raw'
+RAW_RECORDING_NAME = 'recording_%03d'
+
+
+def new_recording_dir(output_dir):
+    """Create and return the first output_dir/recording_<n> folder that does not exist yet."""
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    number = 0
+    while True:
+        store_dir = os.path.join(output_dir, RAW_RECORDING_NAME % number)
+        try:
+            os.mkdir(store_dir)
+            return store_dir
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+            number += 1
+
+
+def save_image(file_path, array):
+    """Save an (height, width, 4) BGRA uint8 array, compressed by file extension."""
+    if pygame is None:
+        raise RuntimeError('cannot import pygame, make sure pygame package is installed')
+    height, width = array.shape[:2]
+    surface = pygame.image.frombuffer(np.ascontiguousarray(array), (width, height), 'BGRA')
+    pygame.image.save(surface, file_path)
+
+
+def read_raw_store(store_dir):
+    """Yield (frame, array) for every frame of a raw store, memory-mapped."""
+    with open(os.path.join(store_dir, RAW_INDEX_NAME), 'r') as file:
+        index = json.load(file)
+    shape = tuple(index['shape'])
+    dtype = np.dtype(index['dtype'])
+    chunk_frames = index['chunk_frames']
+    frames = index['frames']
+    for chunk in range(0, len(frames), chunk_frames):
+        count = min(chunk_frames, len(frames) - chunk)
+        data = np.memmap(
+            os.path.join(store_dir, RAW_CHUNK_NAME % (chunk // chunk_frames)),
+            dtype=dtype, mode='r', shape=(chunk_frames,) + shape)
+        for n in range(count):
+            yield frames[chunk + n], data[n]
+
+
+# ==============================================================================
+# -- Stores --------------------------------------------------------------------
+# ==============================================================================
+
+
+class ImageSequenceStore(object):
+    """One file per frame: <output_dir>/<frame>.<format>."""
+    def __init__(self, output_dir, image_format='png'):
+        self.output_dir = output_dir
+        self.image_format = image_format
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+
+    def write(self, frame, array):
+        file_path = os.path.join(self.output_dir, '%08d' % frame)
+        if self.image_format == 'npy' or array.ndim != 3 or array.shape[2] != 4 or array.dtype != np.uint8:
+            np.save(file_path + '.npy', array)
+        else:
+            save_image(file_path + '.' + self.image_format, array)
+
+    def close(self):
+        pass
+
+
+class RawFrameStore(object):
+    """Frames of one shape and dtype appended to chunked memory-mapped files.
+
+    Chunks are preallocated for chunk_frames frames, so writing a frame is a
+    plain memory copy. The index (shape, dtype, frame numbers) is rewritten
+    whenever a chunk fills up and on close(). Every store gets a folder of
+    its own below output_dir, so a later recording (after World.restart,
+    say) never overwrites an earlier one.
+    """
+    def __init__(self, output_dir, chunk_frames=DEFAULT_CHUNK_FRAMES):
+        self.output_dir = new_recording_dir(output_dir)
+        self.chunk_frames = chunk_frames
+        self.shape = None
+        self.dtype = None
+        self.frames = []
+        self._chunk = None
+        self._lock = threading.Lock()
+
+    def write(self, frame, array):
+        with self._lock:
+            if self.shape is None:
+                self.shape = array.shape
+                self.dtype = array.dtype
+            elif array.shape != self.shape or array.dtype != self.dtype:
+                raise ValueError('raw store holds %s %s frames, got %s %s' % (
+                    self.shape, self.dtype, array.shape, array.dtype))
+            slot = len(self.frames) % self.chunk_frames
+            if slot == 0:
+                self._open_chunk(len(self.frames) // self.chunk_frames)
+            self._chunk[slot] = array
+            self.frames.append(frame)
+            if slot == self.chunk_frames - 1:
+                self._chunk.flush()
+                self._write_index()
+
+    def _open_chunk(self, number):
+        if self._chunk is not None:
+            self._chunk.flush()
+        self._chunk = np.memmap(
+            os.path.join(self.output_dir, RAW_CHUNK_NAME % number),
+            dtype=self.dtype, mode='w+', shape=(self.chunk_frames,) + tuple(self.shape))
+
+    def _write_index(self):
+        index = {
+            'shape': list(self.shape),
+            'dtype': np.dtype(self.dtype).str,
+            'chunk_frames': self.chunk_frames,
+            'frames': self.frames}
+        tmp_path = os.path.join(self.output_dir, RAW_INDEX_NAME + '.tmp')
+        with open(tmp_path, 'w') as file:
+            json.dump(index, file)
+        os.replace(tmp_path, os.path.join(self.output_dir, RAW_INDEX_NAME))
+
+    def close(self):
+        with self._lock:
+            if self._chunk is not None:
+                self._chunk.flush()
+                self._chunk = None
+            if self.shape is not None:
+                self._write_index()
+
+
+def make_store(output_dir, store='png', chunk_frames=DEFAULT_CHUNK_FRAMES):
+    if store == RAW:
+        return RawFrameStore(output_dir, chunk_frames)
+    if store in IMAGE_FORMATS:
+        return ImageSequenceStore(output_dir, store)
+    raise ValueError('unknown frame store %r' % store)
+
+
+# ==============================================================================
+# -- FrameRecorder -------------------------------------------------------------
+# ==============================================================================
+
+
+class FrameRecorder(object):
+    """Writes frames to a store from background threads through a bounded queue."""
+    def __init__(self, store, queue_size=DEFAULT_QUEUE_SIZE, policy=DROP, writers=DEFAULT_WRITERS):
+        if policy not in POLICIES:
+            raise ValueError('unknown queue policy %r' % policy)
+        self.store = store
+        self.policy = policy
+        self.submitted = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._count_lock = threading.Lock()
+        # A raw store appends in order, so it gets a single writer.
+        writers = 1 if isinstance(store, RawFrameStore) else max(1, writers)
+        self._threads = [
+            threading.Thread(target=self._run, name='FrameRecorder-%d' % n) for n in range(writers)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, frame, array):
+        """Queue a frame; the array must not be modified afterwards.
+
+        Returns False if the frame was dropped because the queue was full.
+        """
+        self.submitted += 1
+        if self.policy == BLOCK:
+            self._queue.put((frame, array))
+            return True
+        try:
+            self._queue.put_nowait((frame, array))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            try:
+                self.store.write(*item)
+                with self._count_lock:
+                    self.written += 1
+            except Exception as error:
+                with self._count_lock:
+                    self.failed += 1
+                print('Warning: cannot record frame %d: %s' % (item[0], error))
+
+    def close(self):
+        """Write what is queued, stop the writers and close the store."""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self.store.close()
+
+    def summary(self):
+        return '%d frames recorded, %d dropped, %d failed' % (self.written, self.dropped, self.failed)
+
+
+# ==============================================================================
+# -- main() --------------------------------------------------------------------
+# ==============================================================================
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description='Export the frames of a raw frame store as images')
+    argparser.add_argument(
+        'store',
+        metavar='DIR',
+        help='raw store folder (holding %s, e.g. _out/recording_000)' % RAW_INDEX_NAME)
+    argparser.add_argument(
+        '--to-images',
+        metavar='FORMAT',
+        default='png',
+        choices=IMAGE_FORMATS,
+        help='image format to write next to the store (default: png)')
+    args = argparser.parse_args()
+
+    images = ImageSequenceStore(args.store, args.to_images)
+    count = 0
+    for frame, array in read_raw_store(args.store):
+        images.write(frame, np.asarray(array))
+        count += 1
+    print('%d frames written to %s' % (count, args.store))
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,962 @@
+#!/usr/bin/env python
+
+"""
+CARLA-free stand-in for the subset of the carla Python API used by
+manual_control.py.
+
+The world is a flat, straight road. Actors move kinematically: a constant
+velocity is given in the actor's local frame, so a vehicle with heading
+theta (yaw) and speed v follows x' = cos(theta) * v, y' = sin(theta) * v as
+in the Plant component of ADSLowAggressive.aadl; target velocities and
+walker controls are given in world coordinates. Spawned actors fall onto the
+ground under gravity, and collision sensors report overlapping oriented
+bounding boxes. There is no rendering: cameras, lidar and radar never
+produce data, and the server only advances on World.tick(), which makes a
+replay run as fast as the CPU allows.
+
+Select it with 'manual_control.py --backend local'.
+"""
+
+import collections
+import enum
+import fnmatch
+import itertools
+import math
+
+
+# ==============================================================================
+# -- Global functions ----------------------------------------------------------
+# ==============================================================================
+
+
+GRAVITY = 9.81
+GROUND_Z = 0.0
+DEFAULT_DELTA_SECONDS = 0.01
+
+# Spawn point of the stand-in road, heading towards -x like the road
+# segment used by manual_control.py (FIX_ROAD_ID / FIX_LANE_ID).
+ROAD_SPAWN = ((100.0, 0.0, 0.3), 180.0)
+
+_actor_ids = itertools.count(1)
+
+
+# ==============================================================================
+# -- Geometry ------------------------------------------------------------------
+# ==============================================================================
+
+
+class Vector3D(object):
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.x = float(x)
+        self.y = float(y)
+        self.z = float(z)
+
+    def __add__(self, other):
+        return type(self)(self.x + other.x, self.y + other.y, self.z + other.z)
+
+    def __sub__(self, other):
+        return type(self)(self.x - other.x, self.y - other.y, self.z - other.z)
+
+    def __mul__(self, k):
+        return type(self)(self.x * k, self.y * k, self.z * k)
+
+    __rmul__ = __mul__
+
+    def __eq__(self, other):
+        return isinstance(other, Vector3D) and (self.x, self.y, self.z) == (other.x, other.y, other.z)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def length(self):
+        return math.sqrt(self.x ** 2 + self.y ** 2 + self.z ** 2)
+
+    def copy(self):
+        return type(self)(self.x, self.y, self.z)
+
+    def __repr__(self):
+        return '%s(x=%f, y=%f, z=%f)' % (type(self).__name__, self.x, self.y, self.z)
+
+
+class Location(Vector3D):
+    def distance(self, other):
+        return (self - other).length()
+
+
+class Rotation(object):
+    def __init__(self, pitch=0.0, yaw=0.0, roll=0.0):
+        self.pitch = float(pitch)
+        self.yaw = float(yaw)
+        self.roll = float(roll)
+
+    def get_forward_vector(self):
+        cy, sy = math.cos(math.radians(self.yaw)), math.sin(math.radians(self.yaw))
+        cp, sp = math.cos(math.radians(self.pitch)), math.sin(math.radians(self.pitch))
+        return Vector3D(cp * cy, cp * sy, sp)
+
+    def copy(self):
+        return Rotation(self.pitch, self.yaw, self.roll)
+
+    def __repr__(self):
+        return 'Rotation(pitch=%f, yaw=%f, roll=%f)' % (self.pitch, self.yaw, self.roll)
+
+
+class Transform(object):
+    def __init__(self, location=None, rotation=None):
+        self.location = location.copy() if location is not None else Location()
+        if not isinstance(self.location, Location):
+            self.location = Location(self.location.x, self.location.y, self.location.z)
+        self.rotation = rotation.copy() if rotation is not None else Rotation()
+
+    def transform(self, point):
+        """Transform point (in place, like carla) from local to world frame."""
+        yaw = math.radians(self.rotation.yaw)
+        x = point.x * math.cos(yaw) - point.y * math.sin(yaw)
+        y = point.x * math.sin(yaw) + point.y * math.cos(yaw)
+        point.x, point.y, point.z = x + self.location.x, y + self.location.y, point.z + self.location.z
+
+    def get_forward_vector(self):
+        return self.rotation.get_forward_vector()
+
+    def copy(self):
+        return Transform(self.location, self.rotation)
+
+    def __repr__(self):
+        return 'Transform(%r, %r)' % (self.location, self.rotation)
+
+
+class BoundingBox(object):
+    def __init__(self, location, extent):
+        self.location = location
+        self.extent = extent
+
+
+class Color(object):
+    def __init__(self, r=0, g=0, b=0, a=255):
+        self.r, self.g, self.b, self.a = r, g, b, a
+
+
+def _rotate_to_world(vector, yaw_degrees):
+    yaw = math.radians(yaw_degrees)
+    return Vector3D(
+        vector.x * math.cos(yaw) - vector.y * math.sin(yaw),
+        vector.x * math.sin(yaw) + vector.y * math.cos(yaw),
+        vector.z)
+
+
+def _corners(transform, extent):
+    yaw = math.radians(transform.rotation.yaw)
+    c, s = math.cos(yaw), math.sin(yaw)
+    x, y = transform.location.x, transform.location.y
+    return [(x + dx * c - dy * s, y + dx * s + dy * c)
+            for dx, dy in ((extent.x, extent.y), (-extent.x, extent.y), (-extent.x, -extent.y), (extent.x, -extent.y))]
+
+
+def boxes_overlap(transform_a, extent_a, transform_b, extent_b):
+    """Separating axis test of two yawed bounding boxes in the x/y plane."""
+    if abs(transform_a.location.z - transform_b.location.z) > extent_a.z + extent_b.z:
+        return False
+    corners_a = _corners(transform_a, extent_a)
+    corners_b = _corners(transform_b, extent_b)
+    for corners in (corners_a, corners_b):
+        for i in range(2):
+            (x0, y0), (x1, y1) = corners[i], corners[i + 1]
+            axis = (y0 - y1, x1 - x0)
+            proj_a = [axis[0] * px + axis[1] * py for px, py in corners_a]
+            proj_b = [axis[0] * px + axis[1] * py for px, py in corners_b]
+            if max(proj_a) < min(proj_b) or max(proj_b) < min(proj_a):
+                return False
+    return True
+
+
+# ==============================================================================
+# -- Enumerations and controls -------------------------------------------------
+# ==============================================================================
+
+
+class VehicleLightState(enum.IntFlag):
+    NONE = 0
+    Position = 0x1
+    LowBeam = 0x2
+    HighBeam = 0x4
+    Brake = 0x8
+    RightBlinker = 0x10
+    LeftBlinker = 0x20
+    Reverse = 0x40
+    Fog = 0x80
+    Interior = 0x100
+    Special1 = 0x200
+    Special2 = 0x400
+    All = 0xFFFFFFF
+
+
+class MapLayer(enum.IntFlag):
+    NONE = 0
+    Buildings = 0x1
+    Decals = 0x2
+    Foliage = 0x4
+    Ground = 0x8
+    ParkedVehicles = 0x10
+    Particles = 0x20
+    Props = 0x40
+    StreetLights = 0x80
+    Walls = 0x100
+    All = 0xFFFF
+
+
+class VehicleDoor(enum.IntEnum):
+    FL = 0
+    FR = 1
+    RL = 2
+    RR = 3
+    All = 6
+
+
+class AttachmentType(enum.IntEnum):
+    Rigid = 0
+    SpringArm = 1
+    SpringArmGhost = 2
+
+
+class ColorConverter(enum.IntEnum):
+    Raw = 0
+    Depth = 1
+    LogarithmicDepth = 2
+    CityScapesPalette = 3
+
+
+class WeatherParameters(object):
+    pass
+
+
+WeatherParameters.ClearNoon = WeatherParameters()
+WeatherParameters.CloudyNoon = WeatherParameters()
+WeatherParameters.WetNoon = WeatherParameters()
+WeatherParameters.HardRainNoon = WeatherParameters()
+
+
+class VehicleControl(object):
+    def __init__(self, throttle=0.0, steer=0.0, brake=0.0, hand_brake=False, reverse=False,
+                 manual_gear_shift=False, gear=0):
+        self.throttle = throttle
+        self.steer = steer
+        self.brake = brake
+        self.hand_brake = hand_brake
+        self.reverse = reverse
+        self.manual_gear_shift = manual_gear_shift
+        self.gear = gear
+
+
+class WalkerControl(object):
+    def __init__(self, direction=None, speed=0.0, jump=False):
+        self.direction = direction if direction is not None else Vector3D(1.0, 0.0, 0.0)
+        self.speed = speed
+        self.jump = jump
+
+
+class VehiclePhysicsControl(object):
+    def __init__(self):
+        self.use_sweep_wheel_collision = False
+        self.mass = 1500.0
+
+
+class WorldSettings(object):
+    def __init__(self, synchronous_mode=True, no_rendering_mode=True,
+                 fixed_delta_seconds=DEFAULT_DELTA_SECONDS):
+        self.synchronous_mode = synchronous_mode
+        self.no_rendering_mode = no_rendering_mode
+        self.fixed_delta_seconds = fixed_delta_seconds
+
+    def copy(self):
+        return WorldSettings(self.synchronous_mode, self.no_rendering_mode, self.fixed_delta_seconds)
+
+
+# ==============================================================================
+# -- Blueprints ----------------------------------------------------------------
+# ==============================================================================
+
+
+class ActorAttribute(object):
+    def __init__(self, value, recommended_values=()):
+        self.value = value
+        self.recommended_values = list(recommended_values)
+
+    def as_float(self):
+        return float(self.value)
+
+    def __str__(self):
+        return str(self.value)
+
+
+class ActorBlueprint(object):
+    def __init__(self, id, extent, attributes=None):
+        self.id = id
+        self.extent = extent
+        self._attributes = dict(
+            (key, ActorAttribute(*value)) for key, value in (attributes or {}).items())
+
+    def has_attribute(self, key):
+        return key in self._attributes
+
+    def get_attribute(self, key):
+        return self._attributes[key]
+
+    def set_attribute(self, key, value):
+        if key in self._attributes:
+            self._attributes[key].value = value
+        else:
+            self._attributes[key] = ActorAttribute(value)
+
+    @property
+    def tags(self):
+        return self.id.split('.')
+
+
+_BLUEPRINTS = [
+    ('vehicle.lincoln.mkz_2017', (2.45, 1.06, 0.76), {'generation': ('2',), 'role_name': ('autopilot',)}),
+    ('vehicle.nissan.micra', (1.85, 0.9, 0.77), {'generation': ('1',), 'role_name': ('autopilot',)}),
+    ('walker.pedestrian.0001', (0.19, 0.19, 0.93),
+        {'generation': ('2',), 'is_invincible': ('true',), 'speed': ('1.4', ('0.0', '1.4', '2.8'))}),
+    ('static.prop.barrel', (0.37, 0.37, 0.5), {}),
+    ('sensor.other.collision', (0.0, 0.0, 0.0), {}),
+    ('sensor.other.lane_invasion', (0.0, 0.0, 0.0), {}),
+    ('sensor.other.gnss', (0.0, 0.0, 0.0), {}),
+    ('sensor.other.imu', (0.0, 0.0, 0.0), {}),
+    ('sensor.other.radar', (0.0, 0.0, 0.0), {'horizontal_fov': ('30',), 'vertical_fov': ('30',)}),
+    ('sensor.camera.rgb', (0.0, 0.0, 0.0), {'image_size_x': ('800',), 'image_size_y': ('600',), 'gamma': ('2.2',)}),
+    ('sensor.camera.depth', (0.0, 0.0, 0.0), {'image_size_x': ('800',), 'image_size_y': ('600',)}),
+    ('sensor.camera.semantic_segmentation', (0.0, 0.0, 0.0), {'image_size_x': ('800',), 'image_size_y': ('600',)}),
+    ('sensor.camera.instance_segmentation', (0.0, 0.0, 0.0), {'image_size_x': ('800',), 'image_size_y': ('600',)}),
+    ('sensor.camera.dvs', (0.0, 0.0, 0.0), {'image_size_x': ('800',), 'image_size_y': ('600',)}),
+    ('sensor.camera.optical_flow', (0.0, 0.0, 0.0), {'image_size_x': ('800',), 'image_size_y': ('600',)}),
+    ('sensor.lidar.ray_cast', (0.0, 0.0, 0.0), {'range': ('10',)}),
+]
+
+
+class BlueprintLibrary(object):
+    def __init__(self, blueprints=None):
+        self._blueprints = blueprints if blueprints is not None else [
+            ActorBlueprint(id, Vector3D(*extent), attributes) for id, extent, attributes in _BLUEPRINTS]
+
+    def filter(self, pattern):
+        return BlueprintLibrary([bp for bp in self._blueprints if fnmatch.fnmatch(bp.id, pattern)])
+
+    def find(self, id):
+        for bp in self._blueprints:
+            if bp.id == id:
+                return ActorBlueprint(bp.id, bp.extent, dict(
+                    (key, (attr.value, attr.recommended_values)) for key, attr in bp._attributes.items()))
+        raise IndexError('blueprint %r not found' % id)
+
+    def __len__(self):
+        return len(self._blueprints)
+
+    def __iter__(self):
+        return iter(self._blueprints)
+
+    def __getitem__(self, idx):
+        return self._blueprints[idx]
+
+
+# ==============================================================================
+# -- Actors --------------------------------------------------------------------
+# ==============================================================================
+
+
+class Actor(object):
+    def __init__(self, world, blueprint, transform, parent=None):
+        self.id = next(_actor_ids)
+        self.type_id = blueprint.id
+        self.attributes = dict((key, str(attr)) for key, attr in blueprint._attributes.items())
+        self.parent = parent
+        self.bounding_box = BoundingBox(Location(), blueprint.extent.copy())
+        self.is_alive = True
+        self._world = world
+        self._transform = transform.copy()
+        self._velocity = Vector3D()
+        self._constant_velocity = None
+        self._simulate_physics = True
+        self._gravity = True
+
+    def get_world(self):
+        return self._world
+
+    def get_transform(self):
+        if self.parent is not None:
+            return self.parent.get_transform()
+        return self._transform.copy()
+
+    def get_location(self):
+        return self.get_transform().location
+
+    def get_velocity(self):
+        return self._velocity.copy()
+
+    def get_angular_velocity(self):
+        return Vector3D()
+
+    def get_acceleration(self):
+        return Vector3D()
+
+    def set_transform(self, transform):
+        self._transform = transform.copy()
+
+    def set_location(self, location):
+        self._transform.location = Location(location.x, location.y, location.z)
+
+    def set_target_velocity(self, velocity):
+        self._velocity = velocity.copy()
+
+    def set_target_angular_velocity(self, velocity):
+        pass
+
+    def enable_constant_velocity(self, velocity):
+        self._constant_velocity = velocity.copy()
+
+    def disable_constant_velocity(self):
+        self._constant_velocity = None
+
+    def set_simulate_physics(self, enabled=True):
+        self._simulate_physics = enabled
+
+    def set_enable_gravity(self, enabled=True):
+        self._gravity = enabled
+
+    def add_impulse(self, impulse):
+        pass
+
+    def destroy(self):
+        if not self.is_alive:
+            return False
+        self.is_alive = False
+        self._world._remove(self)
+        return True
+
+    def _step(self, dt):
+        if self._constant_velocity is not None:
+            velocity = _rotate_to_world(self._constant_velocity, self._transform.rotation.yaw)
+            self._velocity = Vector3D(velocity.x, velocity.y, self._velocity.z)
+        location = self._transform.location
+        if self._simulate_physics and self._gravity and location.z > GROUND_Z:
+            self._velocity.z -= GRAVITY * dt
+        location.x += self._velocity.x * dt
+        location.y += self._velocity.y * dt
+        location.z += self._velocity.z * dt
+        if location.z <= GROUND_Z:
+            location.z = GROUND_Z
+            self._velocity.z = 0.0
+
+    def __repr__(self):
+        return 'Actor(id=%d, type=%s)' % (self.id, self.type_id)
+
+
+class Vehicle(Actor):
+    def __init__(self, world, blueprint, transform, parent=None):
+        super(Vehicle, self).__init__(world, blueprint, transform, parent)
+        self._control = VehicleControl()
+        self._physics_control = VehiclePhysicsControl()
+        self._light_state = VehicleLightState.NONE
+
+    def apply_control(self, control):
+        self._control = control
+
+    def get_control(self):
+        return self._control
+
+    def get_physics_control(self):
+        return self._physics_control
+
+    def apply_physics_control(self, physics_control):
+        self._physics_control = physics_control
+
+    def set_autopilot(self, enabled=True, port=8000):
+        pass
+
+    def set_light_state(self, light_state):
+        self._light_state = VehicleLightState(light_state)
+
+    def get_light_state(self):
+        return self._light_state
+
+    def show_debug_telemetry(self, enabled=True):
+        pass
+
+    def open_door(self, door):
+        pass
+
+    def close_door(self, door):
+        pass
+
+
+class Walker(Actor):
+    def __init__(self, world, blueprint, transform, parent=None):
+        super(Walker, self).__init__(world, blueprint, transform, parent)
+        self._control = WalkerControl(speed=0.0)
+
+    def apply_control(self, control):
+        self._control = control
+
+    def get_control(self):
+        return self._control
+
+    def _step(self, dt):
+        if self._constant_velocity is None:
+            direction = self._control.direction
+            norm = math.sqrt(direction.x ** 2 + direction.y ** 2) or 1.0
+            self._velocity.x = direction.x / norm * self._control.speed
+            self._velocity.y = direction.y / norm * self._control.speed
+        super(Walker, self)._step(dt)
+
+
+class Sensor(Actor):
+    def __init__(self, world, blueprint, transform, parent=None):
+        super(Sensor, self).__init__(world, blueprint, transform, parent)
+        self._callback = None
+
+    @property
+    def is_listening(self):
+        return self._callback is not None
+
+    def listen(self, callback):
+        self._callback = callback
+
+    def stop(self):
+        self._callback = None
+
+    def _step(self, dt):
+        pass
+
+    def _emit(self, data):
+        if self._callback is not None:
+            self._callback(data)
+
+
+class CollisionEvent(object):
+    def __init__(self, frame, timestamp, actor, other_actor, normal_impulse):
+        self.frame = frame
+        self.timestamp = timestamp
+        self.actor = actor
+        self.other_actor = other_actor
+        self.normal_impulse = normal_impulse
+
+
+class ActorList(object):
+    def __init__(self, actors):
+        self._actors = list(actors)
+
+    def filter(self, pattern):
+        return ActorList(actor for actor in self._actors if fnmatch.fnmatch(actor.type_id, pattern))
+
+    def find(self, actor_id):
+        for actor in self._actors:
+            if actor.id == actor_id:
+                return actor
+        return None
+
+    def __len__(self):
+        return len(self._actors)
+
+    def __iter__(self):
+        return iter(self._actors)
+
+    def __getitem__(self, idx):
+        return self._actors[idx]
+
+
+# ==============================================================================
+# -- Snapshots -----------------------------------------------------------------
+# ==============================================================================
+
+
+class Timestamp(object):
+    def __init__(self, frame, elapsed_seconds, delta_seconds):
+        self.frame = frame
+        self.frame_count = frame
+        self.elapsed_seconds = elapsed_seconds
+        self.delta_seconds = delta_seconds
+        self.platform_timestamp = elapsed_seconds
+
+
+class ActorSnapshot(object):
+    def __init__(self, actor):
+        self.id = actor.id
+        self._transform = actor.get_transform()
+        self._velocity = actor.get_velocity()
+
+    def get_transform(self):
+        return self._transform
+
+    def get_velocity(self):
+        return self._velocity
+
+    def get_angular_velocity(self):
+        return Vector3D()
+
+    def get_acceleration(self):
+        return Vector3D()
+
+
+class WorldSnapshot(object):
+    def __init__(self, world):
+        self.id = id(world)
+        self.frame = world._frame
+        self.timestamp = Timestamp(world._frame, world._elapsed, world._settings.fixed_delta_seconds)
+        self.elapsed_seconds = world._elapsed
+        self.delta_seconds = world._settings.fixed_delta_seconds
+        self._actors = collections.OrderedDict(
+            (actor.id, ActorSnapshot(actor)) for actor in world._actors.values())
+
+    def find(self, actor_id):
+        return self._actors.get(actor_id)
+
+    def has_actor(self, actor_id):
+        return actor_id in self._actors
+
+    def __iter__(self):
+        return iter(self._actors.values())
+
+    def __len__(self):
+        return len(self._actors)
+
+
+# ==============================================================================
+# -- World ---------------------------------------------------------------------
+# ==============================================================================
+
+
+class Waypoint(object):
+    def __init__(self, transform, road_id=0, lane_id=0, s=0.0):
+        self.transform = transform
+        self.road_id = road_id
+        self.lane_id = lane_id
+        self.s = s
+
+
+class Map(object):
+    name = 'Local/Straight'
+
+    def __init__(self):
+        location, yaw = ROAD_SPAWN
+        self._spawn = Transform(Location(*location), Rotation(yaw=yaw))
+
+    def get_spawn_points(self):
+        return [self._spawn.copy()]
+
+    def get_waypoint_xodr(self, road_id, lane_id, s):
+        return Waypoint(self._spawn.copy(), road_id, lane_id, s)
+
+    def get_waypoint(self, location, project_to_road=True, lane_type=None):
+        return Waypoint(Transform(location, self._spawn.rotation))
+
+
+class DebugHelper(object):
+    def draw_point(self, location, size=0.1, color=None, life_time=-1.0, persistent_lines=True):
+        pass
+
+    def draw_line(self, begin, end, thickness=0.1, color=None, life_time=-1.0, persistent_lines=True):
+        pass
+
+    def draw_string(self, location, text, draw_shadow=False, color=None, life_time=-1.0, persistent_lines=True):
+        pass
+
+
+class World(object):
+    def __init__(self):
+        self.id = id(self)
+        self.debug = DebugHelper()
+        self._map = Map()
+        self._library = BlueprintLibrary()
+        self._settings = WorldSettings()
+        self._actors = collections.OrderedDict()
+        self._frame = 0
+        self._elapsed = 0.0
+        self._on_tick = dict()
+        self._on_tick_ids = itertools.count(1)
+        self._snapshot = None
+        self._weather = WeatherParameters.ClearNoon
+
+    def get_map(self):
+        return self._map
+
+    def get_blueprint_library(self):
+        return self._library
+
+    def get_settings(self):
+        return self._settings.copy()
+
+    def apply_settings(self, settings):
+        self._settings = settings.copy()
+        if not self._settings.fixed_delta_seconds:
+            self._settings.fixed_delta_seconds = DEFAULT_DELTA_SECONDS
+        return self._frame
+
+    def get_weather(self):
+        return self._weather
+
+    def set_weather(self, weather):
+        self._weather = weather
+
+    def load_map_layer(self, layer):
+        pass
+
+    def unload_map_layer(self, layer):
+        pass
+
+    def on_tick(self, callback):
+        callback_id = next(self._on_tick_ids)
+        self._on_tick[callback_id] = callback
+        return callback_id
+
+    def remove_on_tick(self, callback_id):
+        self._on_tick.pop(callback_id, None)
+
+    def get_actors(self, actor_ids=None):
+        actors = self._actors.values()
+        if actor_ids is not None:
+            actors = [actor for actor in actors if actor.id in actor_ids]
+        return ActorList(actors)
+
+    def get_actor(self, actor_id):
+        return self._actors.get(actor_id)
+
+    def get_snapshot(self):
+        if self._snapshot is None:
+            self._snapshot = WorldSnapshot(self)
+        return self._snapshot
+
+    def spawn_actor(self, blueprint, transform, attach_to=None, attachment_type=AttachmentType.Rigid):
+        actor = self.try_spawn_actor(blueprint, transform, attach_to, attachment_type)
+        if actor is None:
+            raise RuntimeError('Spawn failed because of collision at spawn position')
+        return actor
+
+    def try_spawn_actor(self, blueprint, transform, attach_to=None, attachment_type=AttachmentType.Rigid):
+        if blueprint.id.startswith('vehicle.'):
+            cls = Vehicle
+        elif blueprint.id.startswith('walker.'):
+            cls = Walker
+        elif blueprint.id.startswith('sensor.'):
+            cls = Sensor
+        else:
+            cls = Actor
+        actor = cls(self, blueprint, transform, attach_to)
+        if cls is not Sensor and any(self._collides(actor, other) for other in self._bodies()):
+            return None
+        self._actors[actor.id] = actor
+        self._snapshot = None
+        return actor
+
+    def tick(self, seconds=10.0):
+        dt = self._settings.fixed_delta_seconds or DEFAULT_DELTA_SECONDS
+        for actor in list(self._actors.values()):
+            actor._step(dt)
+        self._frame += 1
+        self._elapsed += dt
+        self._snapshot = None
+        timestamp = Timestamp(self._frame, self._elapsed, dt)
+        self._check_collisions(timestamp)
+        snapshot = self.get_snapshot()
+        for callback in list(self._on_tick.values()):
+            callback(snapshot)
+        return self._frame
+
+    def wait_for_tick(self, seconds=10.0):
+        self.tick(seconds)
+        return self.get_snapshot()
+
+    def _bodies(self):
+        return [actor for actor in self._actors.values() if not isinstance(actor, Sensor)]
+
+    @staticmethod
+    def _collides(actor, other):
+        return other is not actor and boxes_overlap(
+            actor.get_transform(), actor.bounding_box.extent,
+            other.get_transform(), other.bounding_box.extent)
+
+    def _check_collisions(self, timestamp):
+        sensors = [actor for actor in self._actors.values()
+                   if actor.type_id == 'sensor.other.collision' and actor.parent is not None]
+        if not sensors:
+            return
+        bodies = self._bodies()
+        for sensor in sensors:
+            parent = sensor.parent
+            for other in bodies:
+                if other is parent or not self._collides(parent, other):
+                    continue
+                relative = parent.get_velocity() - other.get_velocity()
+                impulse = relative * parent.get_physics_control().mass if isinstance(parent, Vehicle) else relative
+                sensor._emit(CollisionEvent(self._frame, timestamp, parent, other, impulse))
+
+    def _remove(self, actor):
+        self._actors.pop(actor.id, None)
+        self._snapshot = None
+
+
+# ==============================================================================
+# -- Client --------------------------------------------------------------------
+# ==============================================================================
+
+
+# Chained commands of a SpawnActor address the actor it spawns as FutureActor.
+FutureActor = 0
+
+
+class _Command(object):
+    """Batch command calling method on one actor."""
+    method = None
+
+    def __init__(self, actor, *args):
+        self.actor_id = getattr(actor, 'id', actor)
+        self.args = args
+
+    def _apply(self, world, future_id=None):
+        actor_id = future_id if self.actor_id == FutureActor and future_id is not None else self.actor_id
+        actor = world.get_actor(actor_id)
+        if actor is None:
+            return actor_id, 'actor %d not found' % actor_id
+        getattr(actor, self.method)(*self.args)
+        return actor_id, ''
+
+
+class DestroyActor(_Command):
+    method = 'destroy'
+
+
+class ApplyTargetVelocity(_Command):
+    method = 'set_target_velocity'
+
+
+class ApplyTargetAngularVelocity(_Command):
+    method = 'set_target_angular_velocity'
+
+
+class ApplyTransform(_Command):
+    method = 'set_transform'
+
+
+class ApplyVehicleControl(_Command):
+    method = 'apply_control'
+
+
+class ApplyWalkerControl(_Command):
+    method = 'apply_control'
+
+
+class ApplyVehiclePhysicsControl(_Command):
+    method = 'apply_physics_control'
+
+
+class SetSimulatePhysics(_Command):
+    method = 'set_simulate_physics'
+
+
+class SetEnableGravity(_Command):
+    method = 'set_enable_gravity'
+
+
+class SetAutopilot(_Command):
+    method = 'set_autopilot'
+
+
+class SetVehicleLightState(_Command):
+    method = 'set_light_state'
+
+
+class SpawnActor(object):
+    def __init__(self, blueprint, transform, parent=None):
+        self.blueprint = blueprint
+        self.transform = transform
+        self.parent = parent
+        self._then = []
+
+    def then(self, command):
+        self._then.append(command)
+        return self
+
+    def _apply(self, world, future_id=None):
+        parent = world.get_actor(getattr(self.parent, 'id', self.parent)) if self.parent is not None else None
+        actor = world.try_spawn_actor(self.blueprint, self.transform, parent)
+        if actor is None:
+            return 0, 'Spawn failed because of collision at spawn position'
+        for command in self._then:
+            _, error = command._apply(world, actor.id)
+            if error:
+                return actor.id, error
+        return actor.id, ''
+
+
+class command(object):
+    """Namespace mirroring carla.command."""
+    FutureActor = FutureActor
+    DestroyActor = DestroyActor
+    ApplyTargetVelocity = ApplyTargetVelocity
+    ApplyTargetAngularVelocity = ApplyTargetAngularVelocity
+    ApplyTransform = ApplyTransform
+    ApplyVehicleControl = ApplyVehicleControl
+    ApplyWalkerControl = ApplyWalkerControl
+    ApplyVehiclePhysicsControl = ApplyVehiclePhysicsControl
+    SetSimulatePhysics = SetSimulatePhysics
+    SetEnableGravity = SetEnableGravity
+    SetAutopilot = SetAutopilot
+    SetVehicleLightState = SetVehicleLightState
+    SpawnActor = SpawnActor
+
+
+class CommandResponse(object):
+    def __init__(self, actor_id, error=''):
+        self.actor_id = actor_id
+        self.error = error
+
+    def has_error(self):
+        return bool(self.error)
+
+
+class TrafficManager(object):
+    def set_synchronous_mode(self, mode=True):
+        pass
+
+    def get_port(self):
+        return 8000
+
+
+class Client(object):
+    """Stand-in client; every Client shares one in-process World."""
+    _world = None
+
+    def __init__(self, host='127.0.0.1', port=2000, worker_threads=0):
+        self.host = host
+        self.port = port
+        if Client._world is None:
+            Client._world = World()
+
+    def set_timeout(self, seconds):
+        pass
+
+    def get_world(self):
+        return Client._world
+
+    def reload_world(self, reset_settings=True):
+        Client._world = World()
+        return Client._world
+
+    def get_trafficmanager(self, port=8000):
+        return TrafficManager()
+
+    def apply_batch(self, commands, do_tick=False):
+        self.apply_batch_sync(commands, do_tick)
+
+    def apply_batch_sync(self, commands, do_tick=False):
+        responses = [CommandResponse(*cmd._apply(Client._world)) for cmd in commands]
+        if do_tick:
+            Client._world.tick()
+        return responses
+
+    def start_recorder(self, filename, additional_data=False):
+        return filename
+
+    def stop_recorder(self):
+        pass
+
+    def replay_file(self, name, start, duration, follow_id, replay_sensors=False):
+        return ''
@@ -67,8 +67,6 @@ import os
 import sys
 import time
 
-# os.environ["SDL_VIDEODRIVER"] = "dummy"
-
 try:
     sys.path.append(glob.glob('../carla/dist/carla-*%d.%d-%s.egg' % (
         sys.version_info.major,
@@ -83,17 +81,23 @@ except IndexError:
 # ==============================================================================
 
 
-import carla
+try:
+    import carla
 
-from carla import ColorConverter as cc
+    from carla import ColorConverter as cc
+except ImportError:
+    # --backend local replaces both with local_carla.
+    carla = None
+    cc = None
 
 import argparse
-import collections
 import datetime
+import fnmatch
 import logging
 import math
 import random
 import re
+import threading
 import weakref
 
 try:
@@ -145,7 +149,16 @@ try:
 except ImportError:
     raise RuntimeError('cannot import numpy, make sure numpy package is installed')
 
-import csv
+import local_carla
+from divergence import DivergenceMonitor
+from frame_recorder import POLICIES, STORES, FrameRecorder, RawFrameStore, make_store
+from profiler import NULL_PROFILER, PhaseProfiler
+from run_log import RunLog
+from telemetry import TickTelemetry
+from timetable import load_witnesses
+from restricted_areas import TRACE_FRAME, WORLD_FRAME, RestrictedAreaIndex, area_keys
+from trace_store import (
+    TICK_SECONDS, TraceCache, TraceStream, load_trace, off_grid, read_header, stitch_periods)
 
 key_list = ['x_env','v_env','y_env','a_env','staticActorX_env','staticActorY_env','RandomActorX_env','RandomActorY_env',\
         'x_ego','y_ego','a_ego','v_ego','friction','slope','AeroDrag','err','errsample','action','x_envsample','staticActorX_envsample',\
@@ -153,10 +166,12 @@ key_list = ['x_env','v_env','y_env','a_env','staticActorX_env','staticActorY_env
                 'signal_env','frictionsample','slopesample','t','restrictRailCrossAreaXmin_env','restrictRailCrossAreaXmax_env', 'restrictRailCrossAreaYmin_env', 'restrictRailCrossAreaYmax_env','railSignal_env',\
 'restrictParkAreaXmin_env', 'restrictParkAreaXmax_env', 'restrictParkAreaYmin_env', 'restrictParkAreaYmax_env',\
 'restrictUturnAreaXmin_env', 'restrictUturnAreaXmax_env', 'restrictUturnAreaYmin_env', 'restrictUturnAreaYmax_env']
-info = dict()
+info = None
 
-automata_dict = dict()
-automata_name_list = ['state0','state1','state2']
+restricted_areas = None
+
+# Witnesses of TimePath.txt replayed in this session (timetable.Witness).
+witnesses = None
 path = "./video/static-acc=2.8;dec=-2.8/period=1s;acc=2.8,dec=-2.8/option2/"
 
 # ==============================================================================
@@ -175,6 +190,28 @@ CAR_ERROR = 4.847
 STATIC_OBS_ERROR = 3.87
 PEDESTRIAN_ERROR = 2.78
 
+# Frames of collision intensity kept by CollisionSensor.
+COLLISION_HISTORY_FRAMES = 4000
+
+# Setup waits end once every actor rests (see wait_until_settled).
+SETTLE_SPEED = 0.05
+SETTLE_HEIGHT = 1e-3
+SETTLE_TICKS = 3
+# Simulation time the actors get to come to rest after an in-place reset.
+RESET_SETTLE_SECONDS = 2
+# Trace time a replay runs on once the witness and the trace have ended:
+# a counterexample ends at the collision, which the simulator may reach a
+# few steps later.
+END_GRACE_SECONDS = 1.0
+
+# The scenario's actors, in the order of expected_actor_states, as reported
+# by the divergence monitor and the telemetry.
+REPLAY_ACTORS = ('ego', 'npc', 'walker', 'barrel')
+
+# Layout of one carla.RadarDetection in RadarMeasurement.raw_data.
+RADAR_DETECTION_DTYPE = np.dtype([
+    ('velocity', np.float32), ('azimuth', np.float32), ('altitude', np.float32), ('depth', np.float32)])
+
 
 global_config = {}
 def parse_acceleration_config(file_path):
@@ -218,7 +255,10 @@ def find_weather_presets():
 
 
 def get_actor_display_name(actor, truncate=250):
-    name = ' '.join(actor.type_id.replace('_', '.').title().split('.')[1:])
+    return get_type_display_name(actor.type_id, truncate)
+
+def get_type_display_name(type_id, truncate=250):
+    name = ' '.join(type_id.replace('_', '.').title().split('.')[1:])
     return (name[:truncate - 1] + u'\u2026') if len(name) > truncate else name
 
 def get_actor_blueprints(world, filter, generation):
@@ -255,6 +295,7 @@ class World(object):
     def __init__(self, carla_world, hud, args):
         self.world = carla_world
         self.sync = args.sync
+        self.headless = args.headless
         self.actor_role_name = args.rolename
         try:
             self.map = self.world.get_map()
@@ -276,6 +317,15 @@ class World(object):
         self._actor_filter = args.filter
         self._actor_generation = args.generation
         self._gamma = args.gamma
+        self._radar_options = dict(max_points=args.radar_max_points, decimation=args.radar_decimation)
+        self._record_options = dict(
+            output_dir=args.record_dir,
+            store=args.record_format,
+            queue_size=args.record_queue,
+            policy=args.record_policy,
+            writers=args.record_writers,
+            chunk_frames=args.record_chunk_frames)
+        self._record_on_start = args.record
         self.restart()
         self.world.on_tick(hud.on_world_tick)
         self.recording_enabled = False
@@ -305,6 +355,7 @@ class World(object):
         # Keep same camera config if the camera manager exists.
         cam_index = self.camera_manager.index if self.camera_manager is not None else 0
         cam_pos_index = self.camera_manager.transform_index if self.camera_manager is not None else 0
+        cam_recording = self.camera_manager.recording if self.camera_manager is not None else self._record_on_start
         # Get a random blueprint.
         blueprint = random.choice(get_actor_blueprints(self.world, self._actor_filter, self._actor_generation))
         blueprint.set_attribute('role_name', self.actor_role_name)
@@ -352,9 +403,12 @@ class World(object):
         self.lane_invasion_sensor = LaneInvasionSensor(self.player, self.hud)
         self.gnss_sensor = GnssSensor(self.player)
         self.imu_sensor = IMUSensor(self.player)
-        self.camera_manager = CameraManager(self.player, self.hud, self._gamma)
-        self.camera_manager.transform_index = cam_pos_index
-        self.camera_manager.set_sensor(cam_index, notify=False)
+        if not self.headless:
+            self.camera_manager = CameraManager(self.player, self.hud, self._gamma, self._record_options)
+            self.camera_manager.transform_index = cam_pos_index
+            self.camera_manager.set_sensor(cam_index, notify=False)
+            if cam_recording:
+                self.camera_manager.toggle_recording()
         actor_type = get_actor_display_name(self.player)
         self.hud.notification(actor_type)
 
@@ -387,7 +441,7 @@ class World(object):
 
     def toggle_radar(self):
         if self.radar_sensor is None:
-            self.radar_sensor = RadarSensor(self.player)
+            self.radar_sensor = RadarSensor(self.player, **self._radar_options)
         elif self.radar_sensor.sensor is not None:
             self.radar_sensor.sensor.destroy()
             self.radar_sensor = None
@@ -406,6 +460,8 @@ class World(object):
         self.tick_idx += 1
 
     def render(self, display):
+        if self.headless:
+            return
         self.camera_manager.render(display)
         self.hud.render(display)
 
@@ -418,7 +474,7 @@ class World(object):
         if self.radar_sensor is not None:
             self.toggle_radar()
         sensors = [
-            self.camera_manager.sensor,
+            self.camera_manager.sensor if self.camera_manager is not None else None,
             self.collision_sensor.sensor,
             self.lane_invasion_sensor.sensor,
             self.gnss_sensor.sensor,
@@ -427,6 +483,8 @@ class World(object):
             if sensor is not None:
                 sensor.stop()
                 sensor.destroy()
+        if self.camera_manager is not None:
+            self.camera_manager.close_recorder()
         if self.player is not None:
             self.player.destroy()
     
@@ -694,9 +752,75 @@ class KeyboardControl(object):
 # ==============================================================================
 
 
+class ActorSnapshotCache(object):
+    """Type ids and locations of all actors, read from one world snapshot.
+
+    refresh() takes the snapshot's transforms; the server is only asked for
+    the type ids of actors not seen before.
+    """
+    def __init__(self, carla_world):
+        self.world = carla_world
+        self.frame = None
+        self.ids = np.empty(0, dtype=np.int64)
+        self.type_ids = np.empty(0, dtype=object)
+        self.locations = np.empty((0, 3))
+        self._type_ids = dict()
+
+    def refresh(self):
+        snapshot = self.world.get_snapshot()
+        if snapshot.frame == self.frame:
+            return
+        self.frame = snapshot.frame
+        actors = list(snapshot)
+        ids = [actor.id for actor in actors]
+        unknown = [actor_id for actor_id in ids if actor_id not in self._type_ids]
+        if unknown:
+            for actor in self.world.get_actors(unknown):
+                self._type_ids[actor.id] = actor.type_id
+        self.ids = np.array(ids, dtype=np.int64)
+        self.type_ids = np.array([self._type_ids.get(actor_id, '') for actor_id in ids], dtype=object)
+        locations = [actor.get_transform().location for actor in actors]
+        self.locations = np.array([(l.x, l.y, l.z) for l in locations], dtype=np.float64).reshape(-1, 3)
+
+    def select(self, pattern):
+        """Boolean mask of the actors whose type id matches the glob pattern."""
+        return np.array([fnmatch.fnmatchcase(type_id, pattern) for type_id in self.type_ids], dtype=bool)
+
+    def nearby(self, pattern, location, exclude_id=None):
+        """[(distance, type_id), ...] of matching actors, nearest first."""
+        mask = self.select(pattern)
+        if exclude_id is not None:
+            mask &= self.ids != exclude_id
+        distances = np.linalg.norm(self.locations[mask] - (location.x, location.y, location.z), axis=1)
+        order = np.argsort(distances, kind='stable')
+        type_ids = self.type_ids[mask]
+        return [(distances[i], type_ids[i]) for i in order]
+
+
 class HUD(object):
-    def __init__(self, width, height):
+    def __init__(self, width, height, headless=False, refresh_ticks=1):
         self.dim = (width, height)
+        self.headless = headless
+        # Ticks between refreshes of the nearby-actor lists.
+        self.refresh_ticks = max(1, refresh_ticks)
+        self._actors = None
+        self._nearby_text = None
+        self._vehicle_count = 0
+        self._tick_count = 0
+        self.server_fps = 0
+        self.frame = 0
+        self.simulation_time = 0
+        self._info_text = []
+        self._server_clock = pygame.time.Clock()
+        # Trace row shown in the HUD, kept on the row last injected by game_loop.
+        self.idx = 0
+        self.is_collision = False
+        if headless:
+            # Nothing is drawn: no fonts, surfaces or info text.
+            self._show_info = False
+            self._notifications = None
+            self.help = None
+            return
         font = pygame.font.Font(pygame.font.get_default_font(), 20)
         font_name = 'courier' if os.name == 'nt' else 'mono'
         fonts = [x for x in pygame.font.get_fonts() if font_name in x]
@@ -706,16 +830,7 @@ class HUD(object):
         self._font_mono = pygame.font.Font(mono, 12 if os.name == 'nt' else 14)
         self._notifications = FadingText(font, (width, 40), (0, height - 40))
         self.help = HelpText(pygame.font.Font(mono, 16), width, height)
-        self.server_fps = 0
-        self.frame = 0
-        self.simulation_time = 0
         self._show_info = True
-        self._info_text = []
-        self._server_clock = pygame.time.Clock()
-        self.data_length = len(info[key_list[0]])
-        self.idx = 0
-        self.tick_count = 0
-        self.is_collision = False
 
     def on_world_tick(self, timestamp):
         self._server_clock.tick()
@@ -724,6 +839,8 @@ class HUD(object):
         self.simulation_time = timestamp.elapsed_seconds
 
     def tick(self, world, clock, action = 0):
+        if self.headless:
+            return
         self._notifications.tick(world, clock)
         if not self._show_info:
             return
@@ -735,12 +852,14 @@ class HUD(object):
         heading += 'S' if 90.5 < compass < 269.5 else ''
         heading += 'E' if 0.5 < compass < 179.5 else ''
         heading += 'W' if 180.5 < compass < 359.5 else ''
-        colhist = world.collision_sensor.get_collision_history()
-        collision = [colhist[x + self.frame - 200] for x in range(0, 200)]
-        max_col = max(1.0, max(collision))
-        collision = [x / max_col for x in collision]
-        vehicles = world.world.get_actors().filter('vehicle.*')
-        static_obstacle = world.world.get_actors().filter('static.prop.*')
+        collision = world.collision_sensor.get_collision_history(self.frame - 1, 200)
+        collision = collision / max(1.0, collision.max())
+        if self._actors is None or self._actors.world is not world.world:
+            self._actors = ActorSnapshotCache(world.world)
+        if self._nearby_text is None or self._tick_count % self.refresh_ticks == 0:
+            self._actors.refresh()
+            self._nearby_text = self._nearby(world.player.id, t.location)
+        self._tick_count += 1
         self._info_text = [
             'Server:  % 16.0f FPS' % self.server_fps,
             'Client:  % 16.0f FPS' % clock.get_fps(),
@@ -778,49 +897,44 @@ class HUD(object):
             'Collision:',
             collision,
             '',
-            'Number of vehicles: % 8d' % len(vehicles)]
-        self._info_text += ['Nearby static obstacle:']
-        distance = lambda l: math.sqrt((l.x - t.location.x)**2 + (l.y - t.location.y)**2 + (l.z - t.location.z)**2)
-        static_obstacles = [(distance(x.get_location()), x) for x in static_obstacle if x.id != world.player.id]
-        for d, st_obs in sorted(static_obstacles, key=lambda static_obstacles: static_obstacles[0]):
-            self._info_text.append('% .2fm %s' % (d, st_obs.type_id))
-        
-        self._info_text += ['Nearby pedestrians:']
-        pedestrians = world.world.get_actors().filter('walker.pedestrian.*')
-        distance = lambda l: math.sqrt((l.x - t.location.x)**2 + (l.y - t.location.y)**2 + (l.z - t.location.z)**2)
-        pedestrians = [(distance(x.get_location()), x) for x in pedestrians if x.id != world.player.id]
-        for d, pedestrian in sorted(pedestrians, key=lambda pedestrians: pedestrians[0]):
-            self._info_text.append('% .2fm %s' % (d, pedestrian.type_id))
-
-        if len(vehicles) > 1:
-            self._info_text += ['Nearby vehicles:']
-            distance = lambda l: math.sqrt((l.x - t.location.x)**2 + (l.y - t.location.y)**2 + (l.z - t.location.z)**2)
-            vehicles = [(distance(x.get_location()), x) for x in vehicles if x.id != world.player.id]
-            for d, vehicle in sorted(vehicles, key=lambda vehicles: vehicles[0]):
+            'Number of vehicles: % 8d' % self._vehicle_count]
+        self._info_text += self._nearby_text
+
+    def _nearby(self, player_id, location):
+        vehicles = self._actors.nearby('vehicle.*', location, exclude_id=player_id)
+        self._vehicle_count = int(np.count_nonzero(self._actors.select('vehicle.*')))
+        text = ['Nearby static obstacle:']
+        for d, type_id in self._actors.nearby('static.prop.*', location, exclude_id=player_id):
+            text.append('% .2fm %s' % (d, type_id))
+        text += ['Nearby pedestrians:']
+        for d, type_id in self._actors.nearby('walker.pedestrian.*', location, exclude_id=player_id):
+            text.append('% .2fm %s' % (d, type_id))
+        if self._vehicle_count > 1:
+            text += ['Nearby vehicles:']
+            for d, type_id in vehicles:
                 if d > 200.0:
                     break
-                vehicle_type = get_actor_display_name(vehicle, truncate=22)
-                self._info_text.append('% .2fm %s' % (d, vehicle_type))
-                
-        if START_INJECT == 1:
-            self.tick_count += 1
-            if self.tick_count % 10 == 0:
-                self.idx = self.idx + 1
-            if self.idx == self.data_length:
-                self.idx = self.data_length - 1
-        
-        
-        
+                text.append('% .2fm %s' % (d, get_type_display_name(type_id, truncate=22)))
+        return text
+
     def toggle_info(self):
         self._show_info = not self._show_info
 
     def notification(self, text, seconds=2.0):
+        if self.headless:
+            logging.debug(text)
+            return
         self._notifications.set_text(text, seconds=seconds)
 
     def error(self, text):
+        if self.headless:
+            logging.error(text)
+            return
         self._notifications.set_text('Error: %s' % text, (255, 0, 0))
 
     def render(self, display):
+        if self.headless:
+            return
         if self._show_info:
             info_surface = pygame.Surface((220, self.dim[1]))
             info_surface.set_alpha(100)
@@ -831,7 +945,7 @@ class HUD(object):
             for item in self._info_text:
                 if v_offset + 18 > self.dim[1]:
                     break
-                if isinstance(item, list):
+                if isinstance(item, (list, np.ndarray)):
                     if len(item) > 1:
                         points = [(x + 8, v_offset + 8 + (1.0 - y) * 30) for x, y in enumerate(item)]
                         pygame.draw.lines(display, (255, 136, 0), False, points, 2)
@@ -923,10 +1037,62 @@ class HelpText(object):
 # ==============================================================================
 
 
+class CollisionHistory(object):
+    """Collision intensity per frame over the last `window` frames.
+
+    A NumPy ring indexed by frame modulo window, stored twice in a row so
+    that any run of consecutive frames is one contiguous slice: readers get
+    a view, not a copy. Intensities are added in place by the sensor
+    callback, which runs on CARLA's sensor thread.
+    """
+    def __init__(self, window=COLLISION_HISTORY_FRAMES):
+        self.window = window
+        self._buffer = np.zeros(2 * window)
+        self._frame = None
+        self._lock = threading.Lock()
+
+    def _advance(self, frame):
+        # Slots of frames newer than the last one seen still hold old data.
+        if self._frame is None:
+            self._frame = frame
+        elif frame > self._frame:
+            if frame - self._frame >= self.window:
+                self._buffer[:] = 0.0
+            else:
+                slots = np.arange(self._frame + 1, frame + 1) % self.window
+                self._buffer[slots] = 0.0
+                self._buffer[slots + self.window] = 0.0
+            self._frame = frame
+
+    def add(self, frame, intensity):
+        with self._lock:
+            self._advance(frame)
+            if frame <= self._frame - self.window:
+                return
+            slot = frame % self.window
+            self._buffer[slot] += intensity
+            self._buffer[slot + self.window] += intensity
+
+    def clear(self):
+        with self._lock:
+            self._buffer[:] = 0.0
+            self._frame = None
+
+    def view(self, frame, frames):
+        """Read-only view of the intensities of the `frames` frames ending at frame."""
+        frames = min(frames, self.window)
+        with self._lock:
+            self._advance(frame)
+            end = frame % self.window + self.window + 1
+            view = self._buffer[end - frames:end]
+        view.flags.writeable = False
+        return view
+
+
 class CollisionSensor(object):
     def __init__(self, parent_actor, hud):
         self.sensor = None
-        self.history = []
+        self.history = CollisionHistory()
         self._parent = parent_actor
         self.hud = hud
         world = self._parent.get_world()
@@ -937,11 +1103,14 @@ class CollisionSensor(object):
         weak_self = weakref.ref(self)
         self.sensor.listen(lambda event: CollisionSensor._on_collision(weak_self, event))
 
-    def get_collision_history(self):
-        history = collections.defaultdict(int)
-        for frame, intensity in self.history:
-            history[frame] += intensity
-        return history
+    def get_collision_history(self, frame, frames=200):
+        """Intensities of the `frames` frames ending at frame (a NumPy view)."""
+        return self.history.view(frame, frames)
+
+    def reset(self):
+        """Forget past collisions, as a newly attached sensor would."""
+        self.history.clear()
+        self.hud.is_collision = False
 
     @staticmethod
     def _on_collision(weak_self, event):
@@ -953,9 +1122,7 @@ class CollisionSensor(object):
         self.hud.is_collision = True
         impulse = event.normal_impulse
         intensity = math.sqrt(impulse.x**2 + impulse.y**2 + impulse.z**2)
-        self.history.append((event.frame, intensity))
-        if len(self.history) > 4000:
-            self.history.pop(0)
+        self.history.add(event.frame, intensity)
 
 
 # ==============================================================================
@@ -1062,8 +1229,18 @@ class IMUSensor(object):
 
 
 class RadarSensor(object):
-    def __init__(self, parent_actor):
+    """Radar drawn as debug points; the newest frame is kept in detections.
+
+    detections is a structured array (RADAR_DETECTION_DTYPE) of the newest
+    measurement. Only every decimation-th detection is drawn, and at most
+    max_points of them per frame.
+    """
+    def __init__(self, parent_actor, max_points=200, decimation=1):
         self.sensor = None
+        self.detections = None
+        self.frame = None
+        self.max_points = max_points
+        self.decimation = max(1, decimation)
         self._parent = parent_actor
         bound_x = 0.5 + self._parent.bounding_box.extent.x
         bound_y = 0.5 + self._parent.bounding_box.extent.y
@@ -1086,38 +1263,49 @@ class RadarSensor(object):
         self.sensor.listen(
             lambda radar_data: RadarSensor._Radar_callback(weak_self, radar_data))
 
+    def min_time_to_collision(self):
+        """Smallest depth / closing speed over the newest detections, or None."""
+        detections = self.detections
+        if detections is None:
+            return None
+        # Negative velocities move towards the sensor.
+        closing = detections['velocity'] < 0.0
+        if not closing.any():
+            return None
+        return float(np.min(detections['depth'][closing] / -detections['velocity'][closing]))
+
     @staticmethod
     def _Radar_callback(weak_self, radar_data):
         self = weak_self()
         if not self:
             return
-        # To get a numpy [[vel, altitude, azimuth, depth],...[,,,]]:
-        # points = np.frombuffer(radar_data.raw_data, dtype=np.dtype('f4'))
-        # points = np.reshape(points, (len(radar_data), 4))
-
+        detections = np.frombuffer(radar_data.raw_data, dtype=RADAR_DETECTION_DTYPE)
+        self.detections = detections
+        self.frame = radar_data.frame
+
+        points = detections[::self.decimation]
+        if len(points) > self.max_points:
+            points = points[np.linspace(0, len(points) - 1, self.max_points).astype(np.int64)]
+        if not len(points):
+            return
         current_rot = radar_data.transform.rotation
-        for detect in radar_data:
-            azi = math.degrees(detect.azimuth)
-            alt = math.degrees(detect.altitude)
-            # The 0.25 adjusts a bit the distance so the dots can
-            # be properly seen
-            fw_vec = carla.Vector3D(x=detect.depth - 0.25)
-            carla.Transform(
-                carla.Location(),
-                carla.Rotation(
-                    pitch=current_rot.pitch + alt,
-                    yaw=current_rot.yaw + azi,
-                    roll=current_rot.roll)).transform(fw_vec)
-
-            def clamp(min_v, max_v, value):
-                return max(min_v, min(value, max_v))
-
-            norm_velocity = detect.velocity / self.velocity_range # range [-1, 1]
-            r = int(clamp(0.0, 1.0, 1.0 - norm_velocity) * 255.0)
-            g = int(clamp(0.0, 1.0, 1.0 - abs(norm_velocity)) * 255.0)
-            b = int(abs(clamp(- 1.0, 0.0, - 1.0 - norm_velocity)) * 255.0)
+        origin = radar_data.transform.location
+        pitch = math.radians(current_rot.pitch) + points['altitude']
+        yaw = math.radians(current_rot.yaw) + points['azimuth']
+        # The 0.25 adjusts a bit the distance so the dots can
+        # be properly seen
+        depth = points['depth'] - 0.25
+        xs = origin.x + depth * np.cos(pitch) * np.cos(yaw)
+        ys = origin.y + depth * np.cos(pitch) * np.sin(yaw)
+        zs = origin.z + depth * np.sin(pitch)
+
+        norm_velocity = points['velocity'] / self.velocity_range # range [-1, 1]
+        rs = (np.clip(1.0 - norm_velocity, 0.0, 1.0) * 255.0).astype(np.int32)
+        gs = (np.clip(1.0 - np.abs(norm_velocity), 0.0, 1.0) * 255.0).astype(np.int32)
+        bs = (np.clip(1.0 + norm_velocity, 0.0, 1.0) * 255.0).astype(np.int32)
+        for x, y, z, r, g, b in zip(xs.tolist(), ys.tolist(), zs.tolist(), rs.tolist(), gs.tolist(), bs.tolist()):
             self.debug.draw_point(
-                radar_data.transform.location + fw_vec,
+                carla.Location(x, y, z),
                 size=0.075,
                 life_time=0.06,
                 persistent_lines=False,
@@ -1129,12 +1317,22 @@ class RadarSensor(object):
 
 
 class CameraManager(object):
-    def __init__(self, parent_actor, hud, gamma_correction):
+    def __init__(self, parent_actor, hud, gamma_correction, record_options=None):
         self.sensor = None
         self.surface = None
+        # Newest (sensor index, frame) from the sensor thread, not drawn yet.
+        self._pending = None
+        # Keeps the buffer of a surface made with pygame.image.frombuffer alive.
+        self._surface_image = None
+        # Reused for lidar and DVS frames, which are drawn from NumPy arrays.
+        self._array = None
+        self._array_surface = None
         self._parent = parent_actor
         self.hud = hud
         self.recording = False
+        # Frames are written by a FrameRecorder, started on first use.
+        self._record_options = record_options or dict(output_dir='_out')
+        self.recorder = None
         bound_x = 0.5 + self._parent.bounding_box.extent.x
         bound_y = 0.5 + self._parent.bounding_box.extent.y
         bound_z = 0.5 + self._parent.bounding_box.extent.z
@@ -1208,6 +1406,7 @@ class CameraManager(object):
             if self.sensor is not None:
                 self.sensor.destroy()
                 self.surface = None
+                self._pending = None
             self.sensor = self._parent.get_world().spawn_actor(
                 self.sensors[index][-1],
                 self._camera_transforms[self.transform_index][0],
@@ -1225,19 +1424,39 @@ class CameraManager(object):
         self.set_sensor(self.index + 1)
 
     def toggle_recording(self):
+        if not self.recording and self.recorder is None:
+            self.recorder = self._make_recorder()
         self.recording = not self.recording
-        self.hud.notification('Recording %s' % ('On' if self.recording else 'Off'))
+        if self.recording:
+            self.hud.notification('Recording On')
+        else:
+            self.hud.notification('Recording Off (%s)' % self.recorder.summary())
+
+    def _make_recorder(self):
+        options = dict(self._record_options)
+        store = make_store(
+            options.pop('output_dir'), options.pop('store', 'png'), options.pop('chunk_frames', 256))
+        return FrameRecorder(store, **options)
+
+    def close_recorder(self):
+        """Write the frames still queued and stop the recorder."""
+        self.recording = False
+        if self.recorder is not None:
+            self.recorder.close()
+            print('Recording: %s' % self.recorder.summary())
+            self.recorder = None
 
     def render(self, display):
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            self.surface = self._make_surface(*pending)
         if self.surface is not None:
             display.blit(self.surface, (0, 0))
 
-    @staticmethod
-    def _parse_image(weak_self, image):
-        self = weak_self()
-        if not self:
-            return
-        if self.sensors[self.index][0].startswith('sensor.lidar'):
+    def _make_surface(self, index, image, converted=False):
+        """Turn the newest sensor frame into a surface, on the render thread."""
+        sensor_type = self.sensors[index][0]
+        if sensor_type.startswith('sensor.lidar'):
             points = np.frombuffer(image.raw_data, dtype=np.dtype('f4'))
             points = np.reshape(points, (int(points.shape[0] / 4), 4))
             lidar_data = np.array(points[:, :2])
@@ -1246,35 +1465,72 @@ class CameraManager(object):
             lidar_data = np.fabs(lidar_data)  # pylint: disable=E1111
             lidar_data = lidar_data.astype(np.int32)
             lidar_data = np.reshape(lidar_data, (-1, 2))
-            lidar_img_size = (self.hud.dim[0], self.hud.dim[1], 3)
-            lidar_img = np.zeros((lidar_img_size), dtype=np.uint8)
+            lidar_img = self._reuse_array((self.hud.dim[0], self.hud.dim[1], 3))
             lidar_img[tuple(lidar_data.T)] = (255, 255, 255)
-            self.surface = pygame.surfarray.make_surface(lidar_img)
-        elif self.sensors[self.index][0].startswith('sensor.camera.dvs'):
+            return self._blit_array(lidar_img)
+        if sensor_type.startswith('sensor.camera.dvs'):
             # Example of converting the raw_data from a carla.DVSEventArray
             # sensor into a NumPy array and using it as an image
             dvs_events = np.frombuffer(image.raw_data, dtype=np.dtype([
-                ('x', np.uint16), ('y', np.uint16), ('t', np.int64), ('pol', np.bool)]))
-            dvs_img = np.zeros((image.height, image.width, 3), dtype=np.uint8)
+                ('x', np.uint16), ('y', np.uint16), ('t', np.int64), ('pol', np.bool_)]))
+            dvs_img = self._reuse_array((image.width, image.height, 3))
             # Blue is positive, red is negative
-            dvs_img[dvs_events[:]['y'], dvs_events[:]['x'], dvs_events[:]['pol'] * 2] = 255
-            self.surface = pygame.surfarray.make_surface(dvs_img.swapaxes(0, 1))
-        elif self.sensors[self.index][0].startswith('sensor.camera.optical_flow'):
+            dvs_img[dvs_events[:]['x'], dvs_events[:]['y'], dvs_events[:]['pol'] * 2] = 255
+            return self._blit_array(dvs_img)
+        if sensor_type.startswith('sensor.camera.optical_flow'):
             image = image.get_color_coded_flow()
-            array = np.frombuffer(image.raw_data, dtype=np.dtype("uint8"))
-            array = np.reshape(array, (image.height, image.width, 4))
-            array = array[:, :, :3]
-            array = array[:, :, ::-1]
-            self.surface = pygame.surfarray.make_surface(array.swapaxes(0, 1))
+        elif not converted:
+            image.convert(self.sensors[index][1])
+        # CARLA images are BGRA already: wrap the buffer instead of copying it.
+        self._surface_image = image
+        return pygame.image.frombuffer(image.raw_data, (image.width, image.height), 'BGRA')
+
+    def _reuse_array(self, shape):
+        if self._array is None or self._array.shape != shape:
+            self._array = np.zeros(shape, dtype=np.uint8)
+            self._array_surface = pygame.Surface(shape[:2])
         else:
-            image.convert(self.sensors[self.index][1])
-            array = np.frombuffer(image.raw_data, dtype=np.dtype("uint8"))
-            array = np.reshape(array, (image.height, image.width, 4))
-            array = array[:, :, :3]
-            array = array[:, :, ::-1]
-            self.surface = pygame.surfarray.make_surface(array.swapaxes(0, 1))
-        if self.recording:
-            image.save_to_disk('_out/%08d' % image.frame)
+            self._array.fill(0)
+        return self._array
+
+    def _blit_array(self, array):
+        pygame.surfarray.blit_array(self._array_surface, array)
+        return self._array_surface
+
+    @staticmethod
+    def _parse_image(weak_self, image):
+        self = weak_self()
+        if not self:
+            return
+        converted = self.recording and self._record(self.index, image)
+        # Only the newest frame gets converted, by render(); older ones are dropped.
+        self._pending = (self.index, image, converted)
+
+    def _record(self, index, image):
+        """Hand a copy of the frame to the recorder; True if image was converted in place.
+
+        Encoding and writing happen on the recorder's threads, so the sensor
+        callback only pays for the copy.
+        """
+        sensor_type, color_converter = self.sensors[index][:2]
+        converted = False
+        if sensor_type.startswith('sensor.camera.optical_flow'):
+            flow = image.get_color_coded_flow()
+            data = np.frombuffer(flow.raw_data, dtype=np.uint8).reshape((flow.height, flow.width, 4))
+        elif sensor_type.startswith('sensor.camera') and not sensor_type.startswith('sensor.camera.dvs'):
+            image.convert(color_converter)
+            converted = True
+            data = np.frombuffer(image.raw_data, dtype=np.uint8).reshape((image.height, image.width, 4))
+        elif isinstance(self.recorder.store, RawFrameStore):
+            # Lidar points and DVS events vary in size from frame to frame.
+            return converted
+        elif sensor_type.startswith('sensor.lidar'):
+            data = np.frombuffer(image.raw_data, dtype=np.dtype('f4')).reshape((-1, 4))
+        else:
+            data = np.frombuffer(image.raw_data, dtype=np.dtype([
+                ('x', np.uint16), ('y', np.uint16), ('t', np.int64), ('pol', np.bool_)]))
+        self.recorder.submit(image.frame, data.copy())
+        return converted
 
 
 # ==============================================================================
@@ -1282,76 +1538,169 @@ class CameraManager(object):
 # ==============================================================================
 
 
-def game_loop(args):
-    pygame.init()
-    pygame.font.init()
-    world = None
-    original_settings = None
-
-    try:
-        client = carla.Client(args.host, args.port)
-        client.set_timeout(20.0)
-
-        sim_world = client.get_world()
-        if args.sync:
-            original_settings = sim_world.get_settings()
-            settings = sim_world.get_settings()
-            if not settings.synchronous_mode:
-                settings.synchronous_mode = True
-                settings.fixed_delta_seconds = 0.05
-            sim_world.apply_settings(settings)
+class FixedStepScheduler(object):
+    """Replay clock counting fixed simulation steps since the scenario started.
 
-            traffic_manager = client.get_trafficmanager()
-            traffic_manager.set_synchronous_mode(True)
+    The world runs in synchronous mode with fixed_delta_seconds equal to the
+    engine's logging grid (TICK_SECONDS), so step n is simulation time
+    n * delta however fast or slow the client runs. Steps are read from the
+    world snapshot's frame.
+    """
+    def __init__(self, sim_world, delta):
+        self.world = sim_world
+        self.delta = delta
+        self.steps_per_second = int(round(1.0 / delta))
+        self.step = 0
+        self._start_frame = None
+
+    def start(self):
+        self._start_frame = self.world.get_snapshot().frame
+        self.step = 0
+
+    def advance(self):
+        """Step reached by the last world tick."""
+        self.step = self.world.get_snapshot().frame - self._start_frame
+        return self.step
+
+    @property
+    def time(self):
+        return self.step * self.delta
+
+    def step_at(self, seconds):
+        """Step at which simulation time reaches seconds."""
+        return int(round(seconds / self.delta))
+
+
+class CommandBatch(object):
+    """Actor commands of one tick, sent to the server in a single batch.
+
+    CARLA has no batch command for constant velocity, so set_velocity()
+    calls enable_constant_velocity() directly, but only when the velocity
+    differs from the last one sent to that actor. A target velocity would be
+    overridden by the constant one, so none is queued: an actor whose speed
+    changes every tick, like the ego once a_ego != 0, still costs one RPC
+    per tick.
+    """
+    def __init__(self, client, sync):
+        self.client = client
+        self.sync = sync
+        self._commands = []
+        self._constant_velocity = dict()
+
+    def set_velocity(self, actor, velocity):
+        key = (velocity.x, velocity.y, velocity.z)
+        if self._constant_velocity.get(actor.id) != key:
+            actor.enable_constant_velocity(velocity)
+            self._constant_velocity[actor.id] = key
+
+    def apply_control(self, actor, control):
+        if isinstance(control, carla.WalkerControl):
+            self._commands.append(carla.command.ApplyWalkerControl(actor.id, control))
+        else:
+            self._commands.append(carla.command.ApplyVehicleControl(actor.id, control))
 
-        if args.autopilot and not sim_world.get_settings().synchronous_mode:
-            print("WARNING: You are currently in asynchronous mode and could "
-                  "experience some issues with the traffic simulation")
+    def flush(self):
+        """Send the queued commands; in sync mode also tick the world."""
+        commands, self._commands = self._commands, []
+        if self.sync:
+            for response in self.client.apply_batch_sync(commands, True):
+                if response.error:
+                    logging.debug('command for actor %d failed: %s', response.actor_id, response.error)
+        elif commands:
+            self.client.apply_batch(commands)
 
-        display = pygame.display.set_mode(
-            (args.width, args.height),
-            pygame.HWSURFACE | pygame.DOUBLEBUF)
-        display.fill((0,0,0))
-        pygame.display.flip()
 
-        hud = HUD(args.width, args.height)
-        world = World(sim_world, hud, args)
-        controller = KeyboardControl(world, args.autopilot)
+def wait_until_settled(args, sim_world, actors, max_seconds):
+    """Advance the world until actors rest, for at most max_seconds of simulation time.
 
-        five_secs_tick = 0
-        Npc_data_idx = FIRST_EFFECTIVE_DATA_IDX
-        global START_INJECT
-        current_state = automata_name_list[0]
-        action = 0
+    An actor rests once its speed and its height change per tick stay below
+    SETTLE_SPEED and SETTLE_HEIGHT for SETTLE_TICKS ticks in a row. The state
+    is read from each tick's world snapshot, so waiting costs no extra queries.
+    Returns the number of ticks waited.
+    """
+    actor_ids = [actor.id for actor in actors if actor is not None]
+    heights = dict()
+    start = None
+    still = 0
+    ticks = 0
+    while True:
         if args.sync:
             sim_world.tick()
         else:
             sim_world.wait_for_tick()
-        ego_vehicle = world.player
-        time.sleep(1)
+        ticks += 1
+        snapshot = sim_world.get_snapshot()
+        if start is None:
+            start = snapshot.timestamp.elapsed_seconds
+        settled = True
+        for actor_id in actor_ids:
+            actor = snapshot.find(actor_id)
+            if actor is None:
+                continue
+            z = actor.get_transform().location.z
+            v = actor.get_velocity()
+            if math.sqrt(v.x**2 + v.y**2 + v.z**2) > SETTLE_SPEED or \
+                    abs(z - heights.get(actor_id, z + 1.0)) > SETTLE_HEIGHT:
+                settled = False
+            heights[actor_id] = z
+        still = still + 1 if settled else 0
+        if still >= SETTLE_TICKS:
+            return ticks
+        if snapshot.timestamp.elapsed_seconds - start >= max_seconds:
+            logging.warning('actors still moving after %.1f s of settling', max_seconds)
+            return ticks
+
+
+class ReplaySession(object):
+    """The scenario of one CARLA session, replayed for witness after witness.
+
+    spawn() places the NPC car, the barrel and the walker relative to the
+    ego and lets everything settle; the transforms the actors come to rest
+    in are where every witness starts. Between witnesses reset() puts the
+    actors back in place (teleported with set_transform, velocities zeroed,
+    collision state cleared) instead of destroying and respawning them, so
+    blueprint lookup, spawning, sensor attachment and settling are paid once
+    per session rather than once per witness.
+    """
+    def __init__(self, args, client, sim_world, world, controller, display, profiler, witnesses):
+        self.args = args
+        self.client = client
+        self.sim_world = sim_world
+        self.world = world
+        self.controller = controller
+        self.display = display
+        self.profiler = profiler
+        # timetable.Witness objects replayed in this session, in order.
+        self.witnesses = list(witnesses)
+        # In the order of REPLAY_ACTORS: ego, NPC car, walker, barrel.
+        self.actors = (None, None, None, None)
+        self.init_location = None
+        self.init_transform = None
+        self._rest = []
+
+    def spawn(self):
+        """Spawn the scenario's actors next to the ego and let them settle."""
+        args, sim_world = self.args, self.sim_world
+        if args.sync:
+            sim_world.tick()
+        else:
+            sim_world.wait_for_tick()
+        ego_vehicle = self.world.player
+        wait_until_settled(args, sim_world, [ego_vehicle], 1)
         zero_velocity_vector = carla.Vector3D(0,0,0)
         ego_vehicle.set_target_velocity(zero_velocity_vector)
         ego_vehicle.enable_constant_velocity(zero_velocity_vector)
 
-        dy_velocity_vector = carla.Vector3D(5.6,0,0)
-        velocity_vector = carla.Vector3D(10,0,0)
-        npc_velocity_vector = carla.Vector3D(5,0,0)
-
-        normal_vehicle = sim_world.get_blueprint_library().filter("vehicle.nissan.micra")
-        print(ego_vehicle.get_transform())
+        logging.debug('ego at %s', ego_vehicle.get_transform())
         init_location = ego_vehicle.get_location()
         init_transform = ego_vehicle.get_transform()
         next_location = init_location
         next_location.x = next_location.x - 50 - CAR_ERROR
         next_location.z = next_location.z + 3
         npc_spawn_point = carla.Transform(next_location,init_transform.rotation)
-        print(npc_spawn_point)
-        ret = sim_world.try_spawn_actor(random.choice(normal_vehicle), npc_spawn_point)
-        time.sleep(1)
-        if ret == None:
-            print("spawn npc car false")
-        else:
-            print("spawn npc car true")
+        logging.debug('npc car spawn point %s', npc_spawn_point)
+        ret, static_obs, dynamic_car = spawn_obstacles(self.client, sim_world, npc_spawn_point, ego_vehicle.get_transform())
+        if ret is not None:
             # ret.set_enable_gravity(True)
             # ret.set_simulate_physics(True)
             ret.set_target_velocity(zero_velocity_vector)
@@ -1359,139 +1708,352 @@ def game_loop(args):
             physics_control.use_sweep_wheel_collision = True
             ret.apply_physics_control(physics_control)
             ret.enable_constant_velocity(zero_velocity_vector)
-            
-        static_obs = set_static_obstacle(ego_vehicle,sim_world)
-        dynamic_car = set_dynamic_obstacle(ego_vehicle,sim_world)
-        time.sleep(1)
-        clock = pygame.time.Clock()
-        
+        wait_until_settled(args, sim_world, [ret, static_obs, dynamic_car], 2)
+
         ego_vehicle.set_target_velocity(zero_velocity_vector)
         ego_vehicle.enable_constant_velocity(zero_velocity_vector)
-        
+
         dynamic_car.apply_control(carla.WalkerControl(carla.Vector3D(-1.0,0,0), 0, False))
         # dynamic_car.set_target_velocity(zero_velocity_vector)
         # dynamic_car.enable_constant_velocity(zero_velocity_vector)
         # ego_vehicle.set_enable_gravity(True)
         # ego_vehicle.set_simulate_physics(True)
-        
-        #world.tick(clock)
-        time.sleep(4)
-        
-        
-        ego_vehicle.set_target_velocity(velocity_vector)
-        ego_vehicle.enable_constant_velocity(velocity_vector)
-        ret.set_target_velocity(npc_velocity_vector)
-        ret.enable_constant_velocity(npc_velocity_vector)
-        dynamic_velocity = set_dynamic_obstacle_velocity(1)
-        print('dynamic_velocity = ', dynamic_velocity)
-        dynamic_car.apply_control(carla.WalkerControl(carla.Vector3D(-1.0,0,0), dynamic_velocity.x, False))
-        # dynamic_car.set_target_velocity(set_dynamic_obstacle_velocity(1))
-        # dynamic_car.enable_constant_velocity(set_dynamic_obstacle_velocity(1))
-        
-        #time.sleep(4)
-        #
-        total_sample_time = len(automata_dict['state1'])
-        print(f'total_sample_time = {total_sample_time}')
-        sample_idx = 0
-
-        a_ego = 0
-        while True:
-            if args.sync:
-                sim_world.tick()
-            
-            
-            clock.tick_busy_loop(100)
-            if controller.parse_events(client, world, clock, args.sync):
-                return
-            world.tick(clock, action)
-            world.render(display)
-            pygame.display.flip()
-            tick_time = world.get_tick_time()
-            # print(tick_time)
-            # print('sample_idx = ', sample_idx)
-            new_ego_velocity = velocity_vector.x + a_ego * 0.01
-            # print(velocity_vector.x, a_ego, time_interval, new_ego_velocity)
-            velocity_vector = carla.Vector3D(new_ego_velocity,0,0)
-            new_ego_velocity_vector = carla.Vector3D(new_ego_velocity,0,0)
-            ego_vehicle.set_target_velocity(new_ego_velocity_vector)
-            ego_vehicle.enable_constant_velocity(new_ego_velocity_vector)
-
-            if sample_idx < total_sample_time:
-                if tick_time == automata_dict['state0'][sample_idx] * 100:
-                    next_state = automata_name_list[1]
-                    print(f'-----------------TRANS FROM {current_state} TO {next_state}-----------------:{tick_time}')
-                    
-                    current_state = next_state
-                    sample_frame_idx = 0
-                    for time_idx in range(len(info['t'])):
-                        if info['t'][time_idx] == automata_dict['state0'][sample_idx]:
-                            sample_frame_idx = time_idx
-                            break
-                    print('-----------------FINISH SAMPLING-----------------')
-
-            if tick_time == round(automata_dict['state1'][sample_idx] * 100, 0):
-                next_state = automata_name_list[2]
-                print(f'-----------------TRANS FROM {current_state} TO {next_state}-----------------:{tick_time}')
-                print(f'sample_frame_idx = {sample_frame_idx}')
-                dd = calculate_dd(sample_frame_idx)
-                danger = compute_danger(sample_frame_idx, init_location, ego_vehicle.get_location(), \
-                                        static_obs.get_location(), dynamic_car.get_location())
-                print(f'dd = {dd}, danger = {danger}')
-                a_ego = calculate_acceleration(danger, sample_frame_idx, dd)
-                print(f'a_ego = {a_ego}')
-                action = calculate_action(a_ego)
-                current_state = next_state
-            
-            if tick_time == round(automata_dict['state2'][sample_idx] * 100, 0):
-                next_state = automata_name_list[0]
-                print(f'-----------------TRANS FROM {current_state} TO {next_state}-----------------')
-                current_state = next_state
-
-            if START_INJECT == True:
-                for time_idx in range(len(info['t'])):
-                    if round(float(info['t'][time_idx]) * 100, 0) == tick_time:
+
+        self.actors = (ego_vehicle, ret, dynamic_car, static_obs)
+        settle_ticks = wait_until_settled(args, sim_world, self.actors, 4)
+        logging.debug('scenario settled after %d ticks', settle_ticks)
+        self.init_location = init_location
+        self.init_transform = init_transform
+        self._rest = [actor.get_transform() if actor is not None else None for actor in self.actors]
+
+    def reset(self):
+        """Put the actors back where spawn() left them, at rest and without collisions."""
+        zero_velocity_vector = carla.Vector3D(0,0,0)
+        ego_vehicle, ret, dynamic_car, static_obs = self.actors
+        for actor, transform in zip(self.actors, self._rest):
+            if actor is None:
+                continue
+            actor.set_transform(transform)
+            actor.set_target_velocity(zero_velocity_vector)
+            actor.set_target_angular_velocity(zero_velocity_vector)
+        ego_vehicle.enable_constant_velocity(zero_velocity_vector)
+        if ret is not None:
+            ret.enable_constant_velocity(zero_velocity_vector)
+        if dynamic_car is not None:
+            # A collision leaves the walker at a constant zero velocity,
+            # which would override its walker control from now on.
+            dynamic_car.disable_constant_velocity()
+            dynamic_car.apply_control(carla.WalkerControl(carla.Vector3D(-1.0,0,0), 0, False))
+        settle_ticks = wait_until_settled(self.args, self.sim_world, self.actors, RESET_SETTLE_SECONDS)
+        logging.debug('scenario reset after %d ticks', settle_ticks)
+        # Cleared once settled, so that late events of the last collision are dropped too.
+        self.world.collision_sensor.reset()
+        self.world.hud.idx = 0
+        info.rewind()
+
+    def output_path(self, file_path, witness):
+        """file_path, or with several witnesses replayed, file_path with .w<N> before its extension."""
+        if file_path is None or len(self.witnesses) == 1:
+            return file_path
+        root, ext = os.path.splitext(file_path)
+        return '%s.w%d%s' % (root, witness.number, ext)
+
+    def replay(self, witness):
+        """Replay witness from the scenario's rest state; returns the outcome."""
+        args, client, sim_world, world = self.args, self.client, self.sim_world, self.world
+        controller, display, profiler = self.controller, self.display, self.profiler
+        outcome = {'witness': witness.number, 'collision': False, 'collision_time': None, 'ticks': 0,
+                   'finished': False}
+        run_log = RunLog(self.output_path(args.run_log, witness), echo_events(args), witness.locations,
+                         meta={'case': args.case, 'witness': witness.number})
+        telemetry = None
+        telemetry_path = self.output_path(args.telemetry, witness)
+
+        try:
+            mode = 0
+            action = 0
+            zero_velocity_vector = carla.Vector3D(0,0,0)
+            velocity_vector = carla.Vector3D(10,0,0)
+            npc_velocity_vector = carla.Vector3D(5,0,0)
+            ego_vehicle, ret, dynamic_car, static_obs = self.actors
+            init_location, init_transform = self.init_location, self.init_transform
+            clock = pygame.time.Clock()
+            commands = CommandBatch(client, args.sync)
+            scheduler = FixedStepScheduler(sim_world, args.time_step)
+
+            ego_vehicle.set_target_velocity(velocity_vector)
+            ego_vehicle.enable_constant_velocity(velocity_vector)
+            ret.set_target_velocity(npc_velocity_vector)
+            ret.enable_constant_velocity(npc_velocity_vector)
+            dynamic_velocity = set_dynamic_obstacle_velocity(0)
+            logging.debug('dynamic_velocity = %s', dynamic_velocity)
+            dynamic_car.apply_control(carla.WalkerControl(carla.Vector3D(-1.0,0,0), dynamic_velocity.x, False))
+            # dynamic_car.set_target_velocity(set_dynamic_obstacle_velocity(0))
+            # dynamic_car.enable_constant_velocity(set_dynamic_obstacle_velocity(0))
+
+            #time.sleep(4)
+            #
+            events = witness.events()
+            if run_log.echo:
+                print(f'witness No{witness.number}: {len(witness.locations)} locations, {len(events)} transitions')
+            next_event = 0
+            sample_frame_idx = 0
+            sample_pending = False
+
+            a_ego = 0
+            dd = danger = float('nan')
+            npc_command = npc_velocity_vector.x
+            if telemetry_path:
+                capacity = args.max_time / args.time_step + 2 if args.max_time is not None else 4096
+                telemetry = TickTelemetry(REPLAY_ACTORS, witness.locations, capacity)
+            divergence = DivergenceMonitor(REPLAY_ACTORS, args.divergence_limit, args.divergence_speed_limit)
+            replay_actors = self.actors
+            scheduler.start()
+            while True:
+                profiler.begin()
+                # Sends the previous tick's actor commands and, in sync mode, ticks.
+                commands.flush()
+                tick_time = scheduler.advance()
+                profiler.lap('sim_tick')
+
+                if args.realtime:
+                    clock.tick(scheduler.steps_per_second)
+                else:
+                    clock.tick()
+                profiler.lap('clock')
+                if not args.headless:
+                    if controller.parse_events(client, world, clock, args.sync):
+                        return outcome
+                    profiler.lap('parse_events')
+                world.tick(clock, action)
+                profiler.lap('hud')
+                if not args.headless:
+                    world.render(display)
+                    profiler.lap('render')
+                    pygame.display.flip()
+                    profiler.lap('flip')
+                # print(tick_time)
+                new_ego_velocity = velocity_vector.x + a_ego * scheduler.delta
+                # print(velocity_vector.x, a_ego, time_interval, new_ego_velocity)
+                velocity_vector = carla.Vector3D(new_ego_velocity,0,0)
+                new_ego_velocity_vector = carla.Vector3D(new_ego_velocity,0,0)
+                commands.set_velocity(ego_vehicle, new_ego_velocity_vector)
+
+                # Transitions of the witness whose firing time has been reached.
+                while next_event < len(events) and scheduler.step_at(events[next_event].time) <= tick_time:
+                    event = events[next_event]
+                    next_event += 1
+                    run_log.transition(scheduler.time, tick_time,
+                                       witness.location_index[event.source], witness.location_index[event.target])
+                    mode = event.target
+
+                    if event.edge == args.sample_edge:
+                        sample_row = info.row_at_time(event.time)
+                        if sample_row is None:
+                            logging.warning('no trace row at t = %g, keeping row %d', event.time, sample_frame_idx)
+                        else:
+                            sample_frame_idx = sample_row
+                        sample_pending = True
+                        run_log.sample(scheduler.time, tick_time, sample_frame_idx)
+
+                    elif event.edge == args.control_edge:
+                        profiler.hold('transitions')
+                        dd = calculate_dd(sample_frame_idx)
+                        danger = compute_danger(sample_frame_idx, init_location, ego_vehicle.get_location(), \
+                                                static_obs.get_location(), dynamic_car.get_location())
+                        acc_terms = acceleration_terms(danger, sample_frame_idx, dd)
+                        a_ego = sum(acc_terms)
+                        action = calculate_action(a_ego)
+                        sample_pending = False
+                        run_log.control(scheduler.time, tick_time, sample_frame_idx, dd, danger, *acc_terms, a_ego, action)
+                        profiler.lap('compute_danger')
+                profiler.lap('transitions')
+
+                if START_INJECT == True:
+                    time_idx = info.row_at_tick(tick_time, scheduler.delta)
+                    if time_idx is not None:
                         # print(f'set_ego_v and dynamic_v, {tick_time}')
-                        if dynamic_car is not None and time_idx < len(info['RandomActorX_env']) - 1:
+                        if dynamic_car is not None and info.has_row(time_idx + 1):
                             dynamic_velocity = set_dynamic_obstacle_velocity(time_idx)
-                            
+
                             last_dynamic_velocity = dynamic_velocity
                         else:
                             dynamic_velocity = last_dynamic_velocity
                         # print('dynamic_velocity = ', dynamic_velocity)
-                        
-                        dynamic_car.apply_control(carla.WalkerControl(carla.Vector3D(-1.0,0,0), dynamic_velocity.x, False))
+
+                        commands.apply_control(dynamic_car, carla.WalkerControl(carla.Vector3D(-1.0,0,0), dynamic_velocity.x, False))
 
 
                         # print('ego_velocity = ', new_ego_velocity)
 
                         new_npc_velocity = float(info['v_env'][time_idx])
+                        npc_command = new_npc_velocity
                         new_npc_velocity_vector = carla.Vector3D(new_npc_velocity,0,0)
-                        ret.set_target_velocity(new_npc_velocity_vector)
-                        ret.enable_constant_velocity(new_npc_velocity_vector)
-                        break
-
-
-            if world.hud.is_collision == True:
-                ego_vehicle.enable_constant_velocity(zero_velocity_vector)
-                ret.enable_constant_velocity(zero_velocity_vector)
-                if dynamic_car is not None:
-                    dynamic_car.enable_constant_velocity(zero_velocity_vector)
-                print(ego_vehicle.get_location())
-                print(dynamic_car.get_location())
-                print(ret.get_location())
-                time.sleep(3)
+                        commands.set_velocity(ret, new_npc_velocity_vector)
+                        world.hud.idx = time_idx
+                        divergence.update(
+                            scheduler.time,
+                            expected_actor_states(time_idx, init_transform.location, abs(dynamic_velocity.x)),
+                            actual_actor_states(sim_world.get_snapshot(), replay_actors))
+                    # The sampled row is only needed until the controller has used it.
+                    held_idx = sample_frame_idx if sample_pending else world.hud.idx
+                    info.release(min(world.hud.idx, held_idx))
+                profiler.lap('injection')
+
+                if telemetry is not None:
+                    telemetry.add(
+                        scheduler.time, tick_time, witness.location_index[mode],
+                        danger, dd, a_ego, action, sim_world.get_snapshot(), replay_actors,
+                        (new_ego_velocity, npc_command, dynamic_velocity.x, float('nan')))
+                    profiler.lap('telemetry')
+
+                if world.hud.is_collision == True:
+                    outcome['collision'] = True
+                    outcome['collision_time'] = scheduler.time
+                    outcome['collision_intensity'] = float(world.collision_sensor.get_collision_history(
+                        sim_world.get_snapshot().frame, scheduler.step + 1).max())
+                    outcome['finished'] = True
+                    ego_vehicle.enable_constant_velocity(zero_velocity_vector)
+                    ret.enable_constant_velocity(zero_velocity_vector)
+                    if dynamic_car is not None:
+                        dynamic_car.enable_constant_velocity(zero_velocity_vector)
+                    run_log.collision(scheduler.time, tick_time, outcome['collision_intensity'],
+                                      ego_vehicle.get_location(), dynamic_car.get_location(), ret.get_location())
+                    wait_until_settled(args, sim_world, [ego_vehicle, ret, dynamic_car], 3)
+                    break
+
+                if divergence.exceeded is not None:
+                    actor, kind, error, at = divergence.exceeded
+                    logging.warning('%s %s error %.3f exceeds the divergence limit at %.2f s, aborting the replay',
+                                    actor, kind, error, at)
+                    logging.warning('divergence from the trace:\n%s', divergence.format())
+                    outcome['diverged'] = True
+                    break
+
+                if args.max_time is not None and scheduler.time >= args.max_time:
+                    if run_log.echo:
+                        print(f'-----------------NO COLLISION WITHIN {args.max_time} s-----------------:{tick_time}')
+                    outcome['finished'] = True
+                    break
+
+                # Nothing is left to replay once the witness has reached its last
+                # location and the trace has ended, END_GRACE_SECONDS ago.
+                if scheduler.time >= witness.duration + END_GRACE_SECONDS and \
+                        info.ended(scheduler.time - END_GRACE_SECONDS):
+                    if run_log.echo:
+                        print(f'-----------------NO COLLISION BY THE END OF THE WITNESS AND TRACE-----------------:{tick_time}')
+                    outcome['finished'] = True
+                    break
+
+            outcome['ticks'] = scheduler.step
+            outcome['divergence'] = divergence.summary()
+            if run_log.echo and not outcome.get('diverged'):
+                print(divergence.format())
+            outcome['positions'] = dict(
+                (name, (actor.get_location().x, actor.get_location().y) if actor is not None else None)
+                for name, actor in (('ego', ego_vehicle), ('npc', ret), ('walker', dynamic_car), ('barrel', static_obs)))
+            return outcome
+
+        finally:
+            run_log.close()
+            if telemetry is not None:
+                telemetry.save(telemetry_path)
+                outcome['telemetry'] = telemetry_path
+
+
+def echo_events(args):
+    """Whether replay events and summaries are printed (--echo-events)."""
+    return args.echo_events == 'on' or (args.echo_events == 'auto' and not args.headless)
+
+
+def game_loop(args):
+    """Replay the witnesses in one session; returns one outcome per witness replayed.
+
+    The scenario is spawned once; from the second witness on it is reset in
+    place. The session ends early when the window is closed.
+    """
+    if args.headless:
+        # pygame still provides the clock; give SDL a display it will not open.
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.init()
+    pygame.font.init()
+    world = None
+    original_settings = None
+    display = None
+    outcomes = []
+    profiler = PhaseProfiler(args.profile, args.profile_interval) if args.profile else NULL_PROFILER
+
+    try:
+        client = carla.Client(args.host, args.port)
+        client.set_timeout(20.0)
+
+        sim_world = client.get_world()
+        if args.sync:
+            # One fixed step per trace time step, whatever the client's frame rate.
+            original_settings = sim_world.get_settings()
+            settings = sim_world.get_settings()
+            settings.synchronous_mode = True
+            settings.fixed_delta_seconds = args.time_step
+            sim_world.apply_settings(settings)
+
+            traffic_manager = client.get_trafficmanager()
+            traffic_manager.set_synchronous_mode(True)
+
+        if args.headless:
+            if original_settings is None:
+                original_settings = sim_world.get_settings()
+            settings = sim_world.get_settings()
+            settings.no_rendering_mode = True
+            sim_world.apply_settings(settings)
+
+        if args.autopilot and not sim_world.get_settings().synchronous_mode:
+            print("WARNING: You are currently in asynchronous mode and could "
+                  "experience some issues with the traffic simulation")
+
+        if not args.headless:
+            display = pygame.display.set_mode(
+                (args.width, args.height),
+                pygame.HWSURFACE | pygame.DOUBLEBUF)
+            display.fill((0,0,0))
+            pygame.display.flip()
+
+        hud = HUD(args.width, args.height, args.headless, args.hud_refresh)
+        world = World(sim_world, hud, args)
+        controller = KeyboardControl(world, args.autopilot)
+        session = ReplaySession(args, client, sim_world, world, controller, display, profiler, witnesses)
+
+        for n, witness in enumerate(session.witnesses):
+            setup_start = time.time()
+            if n == 0:
+                session.spawn()
+            else:
+                session.reset()
+            setup_seconds = time.time() - setup_start
+            outcome = session.replay(witness)
+            outcome['setup_seconds'] = setup_seconds
+            outcomes.append(outcome)
+            if not (outcome['finished'] or outcome.get('diverged')):
+                # The window was closed.
                 break
+        return outcomes
 
     finally:
+        if profiler:
+            profiler.export()
+            for outcome in outcomes:
+                outcome['profile'] = profiler.summary()
+            if echo_events(args):
+                print(profiler.format())
+
         danger_car_list = sim_world.get_actors().filter("vehicle.nissan.micra")
         dynamic_car_list = sim_world.get_actors().filter("walker.pedestrian.0001")
         static_obstacle_list = sim_world.get_actors().filter("static.prop.barrel")
-        
-        
+
+
         client.apply_batch([carla.command.DestroyActor(x) for x in danger_car_list])
         client.apply_batch([carla.command.DestroyActor(x) for x in dynamic_car_list])
         client.apply_batch([carla.command.DestroyActor(x) for x in static_obstacle_list])
-        
+
         if original_settings:
             sim_world.apply_settings(original_settings)
 
@@ -1505,86 +2067,116 @@ def game_loop(args):
 
 
 def set_dynamic_obstacle_velocity(time_idx):
-    current_dx = float(info['RandomActorX_env'][time_idx])
-    next_dx = float(info['RandomActorX_env'][time_idx + 1])
-    time_interval = float(info['t'][time_idx + 1]) - float(info['t'][time_idx])
+    current_dx = info['RandomActorX_env'][time_idx]
+    next_dx = info['RandomActorX_env'][time_idx + 1]
+    time_interval = info['t'][time_idx + 1] - info['t'][time_idx]
     new_velocity = (next_dx - current_dx) / time_interval
-    return carla.Vector3D(new_velocity,0,0)
-
-def set_dynamic_obstacle(ego_vehicle,world):
-    x_offset = float(info['RandomActorX_env'][1])
-    y_offset = float(info['RandomActorY_env'][1])
-    # print(x_offset)
-    # print(y_offset)
-    init_location = ego_vehicle.get_location()
-    init_transform = ego_vehicle.get_transform()
-    
-    dynamic_obs_location = init_location
-    dynamic_obs_location.x = dynamic_obs_location.x - x_offset - PEDESTRIAN_ERROR ### here changes, according to different situation
-    dynamic_obs_location.y = dynamic_obs_location.y + y_offset
-    dynamic_obs_location.z = dynamic_obs_location.z + 4
+    return carla.Vector3D(float(new_velocity),0,0)
+
+def expected_actor_states(time_idx, origin, walker_speed):
+    """(x, y, speed) of ego, NPC, walker and barrel at trace row time_idx, in the world.
+
+    Trace positions are placed as the spawn points do: along -x from the
+    ego's spawn location origin, less each actor's reference offset.
+    """
+    def state(x_key, y_key, offset, speed):
+        return (origin.x - float(info[x_key][time_idx]) - offset,
+                origin.y + float(info[y_key][time_idx]),
+                speed)
+    return np.array([
+        state('x_ego', 'y_ego', 0.0, float(info['v_ego'][time_idx])),
+        state('x_env', 'y_env', CAR_ERROR, float(info['v_env'][time_idx])),
+        state('RandomActorX_env', 'RandomActorY_env', PEDESTRIAN_ERROR, walker_speed),
+        state('staticActorX_env', 'staticActorY_env', STATIC_OBS_ERROR, 0.0)])
+
+
+def actual_actor_states(snapshot, actors):
+    """(x, y, ground speed) of actors in a world snapshot; NaN for missing ones."""
+    states = np.full((len(actors), 3), np.nan)
+    for n, actor in enumerate(actors):
+        actor_snapshot = snapshot.find(actor.id) if actor is not None else None
+        if actor_snapshot is not None:
+            location = actor_snapshot.get_transform().location
+            v = actor_snapshot.get_velocity()
+            states[n] = location.x, location.y, math.sqrt(v.x**2 + v.y**2)
+    return states
+
+
+def dynamic_obstacle_spawn_point(init_transform):
+    x_offset = float(info.first('RandomActorX_env'))
+    y_offset = float(info.first('RandomActorY_env'))
+    dynamic_obs_location = carla.Location(
+        init_transform.location.x - x_offset - PEDESTRIAN_ERROR, ### here changes, according to different situation
+        init_transform.location.y + y_offset,
+        init_transform.location.z + 4)
     dynamic_obs_rotation = init_transform.rotation
     # dynamic_obs_rotation.yaw = dynamic_obs_rotation.yaw + 90
-    dynamic_obs_spawn_point = carla.Transform(dynamic_obs_location,dynamic_obs_rotation)
-        
-    dynamic_obstacle = world.get_blueprint_library().filter("walker.pedestrian.0001")
-    
-    bp = random.choice(dynamic_obstacle)
-    bp.set_attribute('is_invincible', 'false')
-    dynamic_ret = world.try_spawn_actor(bp, dynamic_obs_spawn_point)
-    if dynamic_ret == None:
-        print("spawn dynamic obs false")
-        return None
-    else:
-        dynamic_ret.set_enable_gravity(True)
-        dynamic_ret.set_simulate_physics(True)
-        print("spawn dynamic obs true")
-        print(dynamic_obs_spawn_point)
-        return dynamic_ret
-    
+    return carla.Transform(dynamic_obs_location,dynamic_obs_rotation)
 
-def set_static_obstacle(ego_vehicle,world):
-    x_offset = float(info['staticActorX_env'][1])
-    y_offset = float(info['staticActorY_env'][1])
 
-    
-    init_location = ego_vehicle.get_location()
-    init_transform = ego_vehicle.get_transform()
-    static_obs_location = init_location
+def static_obstacle_spawn_point(init_transform):
+    x_offset = float(info.first('staticActorX_env'))
+    y_offset = float(info.first('staticActorY_env'))
+    static_obs_location = carla.Location(
+        init_transform.location.x - x_offset - STATIC_OBS_ERROR,
+        init_transform.location.y + y_offset,
+        init_transform.location.z + 2)
+    return carla.Transform(static_obs_location,init_transform.rotation)
+
+
+def spawn_obstacles(client, world, npc_spawn_point, init_transform):
+    """Spawn the NPC car, the static obstacle and the pedestrian in one batch.
+
+    Returns the three actors, None for each one that could not be spawned.
+    """
+    blueprints = world.get_blueprint_library()
+    npc_bp = random.choice(blueprints.filter("vehicle.nissan.micra"))
+    static_bp = random.choice(blueprints.filter("static.prop.barrel"))
+    dynamic_bp = random.choice(blueprints.filter("walker.pedestrian.0001"))
+    dynamic_bp.set_attribute('is_invincible', 'false')
+    static_obs_spawn_point = static_obstacle_spawn_point(init_transform)
+    dynamic_obs_spawn_point = dynamic_obstacle_spawn_point(init_transform)
+
+    SpawnActor = carla.command.SpawnActor
+    SetEnableGravity = carla.command.SetEnableGravity
+    SetSimulatePhysics = carla.command.SetSimulatePhysics
+    FutureActor = carla.command.FutureActor
+    batch = [
+        SpawnActor(npc_bp, npc_spawn_point),
+        SpawnActor(static_bp, static_obs_spawn_point)
+            .then(SetEnableGravity(FutureActor, True))
+            .then(SetSimulatePhysics(FutureActor, True)),
+        SpawnActor(dynamic_bp, dynamic_obs_spawn_point)
+            .then(SetEnableGravity(FutureActor, True))
+            .then(SetSimulatePhysics(FutureActor, True))]
+    names = ['npc car', 'static obstacle', 'dynamic obs']
+    actor_ids = []
+    for name, response in zip(names, client.apply_batch_sync(batch, False)):
+        if response.error:
+            logging.warning('spawn %s false: %s', name, response.error)
+            actor_ids.append(None)
+        else:
+            logging.debug('spawn %s true', name)
+            actor_ids.append(response.actor_id)
+    logging.debug('static obstacle spawn point %s', static_obs_spawn_point)
+    logging.debug('dynamic obs spawn point %s', dynamic_obs_spawn_point)
+    actors = world.get_actors([actor_id for actor_id in actor_ids if actor_id is not None])
+    return [actors.find(actor_id) if actor_id is not None else None for actor_id in actor_ids]
 
-    
-    static_obs_location.x = static_obs_location.x - x_offset - STATIC_OBS_ERROR
-
-    static_obs_location.y = static_obs_location.y + y_offset
-    static_obs_location.z = static_obs_location.z + 2
-    static_obs_spawn_point = carla.Transform(static_obs_location,init_transform.rotation)
-        
-    static_obstacle = world.get_blueprint_library().filter("static.prop.barrel")
-    static_ret = world.try_spawn_actor(random.choice(static_obstacle), static_obs_spawn_point)
-    if static_ret == None:
-        print("spawn static obstacle false")
-    else:
-        static_ret.set_enable_gravity(True)
-        static_ret.set_simulate_physics(True)
-        print("spawn staic obstacle true")
-    print(static_obs_spawn_point)
-    return static_ret
 
 def modify_signal_env():
-    info['signal_env'] = list()
-    info['signal_env'].append(-1)
-    info['signal_env'].append(1)
+    info['signal_env'][0] = 1
 
 def calculate_dd(sample_frame_idx):
-    return float(info['x_env'][sample_frame_idx]) - float(info['x_ego'][sample_frame_idx]) + \
-        float(info['err'][sample_frame_idx])
+    return info['x_env'][sample_frame_idx] - info['x_ego'][sample_frame_idx] + \
+        info['err'][sample_frame_idx]
 
 
 def calculate_static_danger(sample_frame_idx):
     x_danger = DANGER_LIMIT - \
-        abs(float(info['staticActorX_env'][sample_frame_idx]) - float(info['x_ego'][sample_frame_idx]))
+        abs(info['staticActorX_env'][sample_frame_idx] - info['x_ego'][sample_frame_idx])
     y_danger = DANGER_LIMIT - \
-        abs(float(info['staticActorY_env'][sample_frame_idx]) - float(info['y_ego'][sample_frame_idx]))
+        abs(info['staticActorY_env'][sample_frame_idx] - info['y_ego'][sample_frame_idx])
     lhs = 0
     rhs = 0
     if x_danger > 0:    
@@ -1599,9 +2191,9 @@ def calculate_static_danger(sample_frame_idx):
     
 def calculate_dynamic_danger(sample_frame_idx):
     x_danger = DANGER_LIMIT - \
-        abs(float(info['RandomActorX_env'][sample_frame_idx]) - float(info['x_ego'][sample_frame_idx]))
+        abs(info['RandomActorX_env'][sample_frame_idx] - info['x_ego'][sample_frame_idx])
     y_danger = DANGER_LIMIT - \
-        abs(float(info['RandomActorY_env'][sample_frame_idx]) - float(info['y_ego'][sample_frame_idx]))
+        abs(info['RandomActorY_env'][sample_frame_idx] - info['y_ego'][sample_frame_idx])
     lhs = 0
     rhs = 0
     if x_danger > 0:    
@@ -1619,8 +2211,8 @@ def calculate_signal_danger(sample_frame_idx):
     # y_danger = 0.5 - abs(info['RandomActorY_env'][SAMPLE_FRAME_IDX] - info['y_ego'][SAMPLE_FRAME_IDX])
  
     x_danger = DANGER_LIMIT - \
-        abs(float(info['restrictSignalAreaX_envsample'][sample_frame_idx]) - float(info['x_ego'][sample_frame_idx]))
-    y_danger = float(info['signal_envsample'][sample_frame_idx]) - 0.5
+        abs(info['restrictSignalAreaX_envsample'][sample_frame_idx] - info['x_ego'][sample_frame_idx])
+    y_danger = info['signal_envsample'][sample_frame_idx] - 0.5
     lhs = 0
     rhs = 0
     if x_danger > 0:    
@@ -1640,13 +2232,13 @@ danger:=((sign(0.5 - (abs staticActorX_envsample - x_egosample)) * sign((0.5) -
 """
 
 
-def check_isexistence(key):
-    def val(key):
-        return float(info[key][1])
-    if val(key) == 0:
-        return False
-    else:
-        return True 
+def get_restricted_areas(init_ego_pos):
+    """Restricted area index of the scenario, built once per ego spawn point."""
+    global restricted_areas
+    key = (id(info), init_ego_pos.x, init_ego_pos.y)
+    if restricted_areas is None or restricted_areas[0] != key:
+        restricted_areas = (key, RestrictedAreaIndex.from_trace(info, init_ego_pos))
+    return restricted_areas[1]
 
 def sign(a):
     return 1 if a > 0 else 0
@@ -1656,7 +2248,7 @@ def signeq(a):
 
 def compute_danger(sample_frame_idx, init_ego_pos, ego_pos, static_obs_pos, random_actor_pos):
     def val(key):
-        return float(info[key][sample_frame_idx])
+        return info[key][sample_frame_idx]
     """
     t =0.04 , sample , x_env -> x_envsample
 
@@ -1672,89 +2264,26 @@ def compute_danger(sample_frame_idx, init_ego_pos, ego_pos, static_obs_pos, rand
     B = sign(0.5 - abs(random_actor_pos.x - ego_pos.x)) * \
         sign(0.5 - abs(random_actor_pos.y - ego_pos.y))
 
-    C = sign(0.5 - abs((init_ego_pos.x - val('restrictSignalAreaX_env')) - ego_pos.x)) * \
-        sign(val('signal_env') - 0.5)
-
     # A = sign(0.5 - abs(val('staticActorX_env') - val('x_ego'))) * \
     #     sign(0.5 - abs(val('staticActorY_env') - val('y_ego')))
 
     # B = sign(0.5 - abs(val('RandomActorX_env') - val('x_ego'))) * \
     #     sign(0.5 - abs(val('RandomActorY_env') - val('y_ego')))
 
-    # C = sign(0.5 - abs(val('restrictSignalAreaX_env') - val('x_ego'))) * \
-    #     sign(val('signal_env') - 0.5)
-
-    if not check_isexistence('restrictRailCrossAreaXmin_env') and not check_isexistence('restrictRailCrossAreaXmax_env') and \
-        not check_isexistence('restrictRailCrossAreaYmin_env') and not check_isexistence('restrictRailCrossAreaYmax_env'):
-        D = sign(
-            sign(
-                sign(
-                    sign(0.5 - abs(val('restrictRailCrossAreaXmin_env') - val('x_ego'))) +
-                    sign(0.5 - abs(val('restrictRailCrossAreaXmax_env') - val('x_ego')))
-                ) +
-                sign(0.5 - abs(val('restrictRailCrossAreaYmin_env') - val('y_ego')))
-            ) +
-            sign(0.5 - abs(val('restrictRailCrossAreaYmax_env') - val('y_ego')))
-        ) * sign(val('railSignal_env') - 0.5)
-    else:
-        D = sign(
-            sign(
-                sign(
-                    sign(0.5 - abs((init_ego_pos.x - val('restrictRailCrossAreaXmin_env')) - ego_pos.x)) +
-                    sign(0.5 - abs((init_ego_pos.x - val('restrictRailCrossAreaXmax_env')) - ego_pos.x))
-                ) +
-                sign(0.5 - abs((init_ego_pos.y - val('restrictRailCrossAreaYmin_env')) - ego_pos.y))
-            ) +
-            sign(0.5 - abs((init_ego_pos.y - val('restrictRailCrossAreaYmax_env')) - ego_pos.y))
-        ) * sign(val('railSignal_env') - 0.5)
-
-    if not check_isexistence('restrictParkAreaXmin_env') and not check_isexistence('restrictParkAreaXmax_env') and \
-        not check_isexistence('restrictParkAreaYmin_env') and not check_isexistence('restrictParkAreaYmax_env'):
-        E = sign(
-            sign(
-                sign(
-                    sign(0.5 - abs(val('restrictParkAreaXmin_env') - val('x_ego'))) +
-                    sign(0.5 - abs(val('restrictParkAreaXmax_env') - val('x_ego')))
-                ) +
-                sign(0.5 - abs(val('restrictParkAreaYmin_env') - val('y_ego')))
-            ) +
-            sign(0.5 - abs(val('restrictParkAreaYmax_env') - val('y_ego')))
-        )
-    else:
-        E = sign(
-            sign(
-                sign(
-                    sign(0.5 - abs((init_ego_pos.x - val('restrictParkAreaXmin_env')) - ego_pos.x)) +
-                    sign(0.5 - abs((init_ego_pos.x - val('restrictParkAreaXmax_env')) - ego_pos.x))
-                ) +
-                sign(0.5 - abs((init_ego_pos.y - val('restrictParkAreaYmin_env')) - ego_pos.y))
-            ) +
-            sign(0.5 - abs((init_ego_pos.y - val('restrictParkAreaYmax_env')) - ego_pos.y))
-        )
-
-    if not check_isexistence('restrictUturnAreaXmin_env') and not check_isexistence('restrictUturnAreaXmax_env') and \
-        not check_isexistence('restrictUturnAreaYmin_env') and not check_isexistence('restrictUturnAreaYmax_env'):
-        F = sign(
-            sign(
-                sign(
-                    sign(0.5 - abs(val('restrictUturnAreaXmin_env') - val('x_ego'))) +
-                    sign(0.5 - abs(val('restrictUturnAreaXmax_env') - val('x_ego')))
-                ) +
-                sign(0.5 - abs(val('restrictUturnAreaYmin_env') - val('y_ego')))
-            ) +
-            sign(0.5 - abs(val('restrictUturnAreaYmax_env') - val('y_ego')))
-        )
-    else:
-        F = sign(
-            sign(
-                sign(
-                    sign(0.5 - abs((init_ego_pos.x - val('restrictUturnAreaXmin_env')) - ego_pos.x)) +
-                    sign(0.5 - abs((init_ego_pos.x - val('restrictUturnAreaXmax_env')) - ego_pos.x))
-                ) +
-                sign(0.5 - abs((init_ego_pos.y - val('restrictUturnAreaYmin_env')) - ego_pos.y))
-            ) +
-            sign(0.5 - abs((init_ego_pos.y - val('restrictUturnAreaYmax_env')) - ego_pos.y))
-        )
+    # Areas missing from the scenario (all bounds 0) are checked against the
+    # trace's ego position, existing ones against the CARLA ego location.
+    areas = get_restricted_areas(init_ego_pos)
+    positions = {
+        WORLD_FRAME: (ego_pos.x, ego_pos.y),
+        TRACE_FRAME: (val('x_ego'), val('y_ego'))}
+
+    C = areas.near('Signal', positions) * sign(val('signal_env') - 0.5)
+
+    D = areas.near('RailCross', positions) * sign(val('railSignal_env') - 0.5)
+
+    E = areas.near('Park', positions)
+
+    F = areas.near('Uturn', positions)
 
     danger = (
         A +
@@ -1770,24 +2299,23 @@ def compute_danger(sample_frame_idx, init_ego_pos, ego_pos, static_obs_pos, rand
 def calculate_neg_five_acc(danger,sample_frame_idx):
     if danger > 0:
         standard_acc = get_config_value("Deacceleration", -3)
-        print(f'standard_acc = {standard_acc}')
-        modify_acc = 10 * 0.01 * float(info['friction'][sample_frame_idx]) * \
-            math.cos(float(info['slope'][sample_frame_idx]))
+        modify_acc = 10 * 0.01 * info['friction'][sample_frame_idx] * \
+            math.cos(info['slope'][sample_frame_idx])
         return standard_acc - modify_acc
     else:
         return 0
 
 def calculate_pos_two_acc(danger,dd,sample_frame_idx):
     standard_acc = get_config_value("Acceleration", 3)
-    modify_acc = 10 * 0.01 * float(info['frictionsample'][sample_frame_idx]) * \
-        math.cos(float(info['slopesample'][sample_frame_idx]))
+    modify_acc = 10 * 0.01 * info['frictionsample'][sample_frame_idx] * \
+        math.cos(info['slopesample'][sample_frame_idx])
     return (signeq(-(sign(danger)))* sign(dd - SAFETY_DISTANCE)) * (standard_acc - modify_acc)
 
 
 def calculate_neg_two_acc(danger,dd,sample_frame_idx):
     standard_acc = get_config_value("Deacceleration", -3)
-    modify_acc = 10 * 0.01 * float(info['frictionsample'][sample_frame_idx]) * \
-        math.cos(float(info['slopesample'][sample_frame_idx]))
+    modify_acc = 10 * 0.01 * info['frictionsample'][sample_frame_idx] * \
+        math.cos(info['slopesample'][sample_frame_idx])
             
     return (signeq(-(sign(danger))) * signeq(-sign(dd - SAFETY_DISTANCE))) * (standard_acc - modify_acc)
 
@@ -1807,12 +2335,15 @@ contl_aego:=(sign(danger - 0)) * (-3 - 10 * 0.01 * frictionsample * cos_slope) \
 (signEq(-(sign((danger) - (0)))) * signEq(-(sign((dd) - (30))))) * (-3 - 10 * 0.01 * frictionsample * cos_slope)
 (signEq(-(sign(danger))) * signEq(-(sign(dd - 30)))) * (-3 - 10 * 0.01 * frictionsample * cos_slope)
 """
-def calculate_acceleration(danger,sample_frame_idx,dd):
+def acceleration_terms(danger,sample_frame_idx,dd):
+    """The controller's brake, accelerate and decelerate terms; a_ego is their sum."""
     neg_five_acceleration = calculate_neg_five_acc(danger,sample_frame_idx)
     two_acceleration = calculate_pos_two_acc(danger, dd,sample_frame_idx)
     neg_two_acceleration = calculate_neg_two_acc(danger,dd,sample_frame_idx)
-    print(f'neg_five_acceleration = {neg_five_acceleration}, two_acceleration = {two_acceleration}, neg_two_acceleration = {neg_two_acceleration}')
-    total_acc = neg_five_acceleration + two_acceleration + neg_two_acceleration
+    return neg_five_acceleration, two_acceleration, neg_two_acceleration
+
+def calculate_acceleration(danger,sample_frame_idx,dd):
+    total_acc = sum(acceleration_terms(danger, sample_frame_idx, dd))
     return total_acc
 
 def calculate_action(ego_acc):
@@ -1827,9 +2358,9 @@ def calculate_forbidden_state(cycle_frame_idx,action):
     if action != 1:
         print("not in forbidden state")
     else:
-        distance_to_tl = abs(float(info['restrictSignalAreaX_env'][cycle_frame_idx]) - \
-            float(info['x_ego'][cycle_frame_idx]))
-        tl_color = float(info['signal_env'][cycle_frame_idx])
+        distance_to_tl = abs(info['restrictSignalAreaX_env'][cycle_frame_idx] - \
+            info['x_ego'][cycle_frame_idx])
+        tl_color = info['signal_env'][cycle_frame_idx]
         if distance_to_tl < 0.05 and tl_color > 0.5:
             print('in forbidden state')
         else:
@@ -1841,7 +2372,7 @@ def calculate_forbidden_state(cycle_frame_idx,action):
 # ==============================================================================
 
 
-def main():
+def parse_args(argv=None):
     argparser = argparse.ArgumentParser(
         description='CARLA Manual Control Client')
     argparser.add_argument(
@@ -1892,81 +2423,247 @@ def main():
     argparser.add_argument(
         '--sync',
         action='store_true',
-        help='Activate synchronous mode execution')
-    args = argparser.parse_args()
+        help='Activate synchronous mode execution (always on for replays, '
+             'which step the world on the engine\'s 0.01 s grid)')
+    argparser.add_argument(
+        '--realtime',
+        action='store_true',
+        help='pace the replay to wall-clock time instead of running as fast as the server allows')
+    argparser.add_argument(
+        '--case',
+        metavar='DIR',
+        default=path,
+        help='case folder holding result.csv, TimePath.txt and acceleration_config.txt (default: %s)' % path)
+    argparser.add_argument(
+        '--witness',
+        metavar='N[,N...]|all',
+        default='0',
+        help='witnesses of TimePath.txt to replay, numbered in file order; several '
+             'witnesses replay one after the other in the same session, the actors '
+             'reset in place between them (default: 0)')
+    argparser.add_argument(
+        '--sample-edge',
+        metavar='LABEL',
+        default='sample',
+        help='witness transition at which the controller samples the trace (default: sample)')
+    argparser.add_argument(
+        '--control-edge',
+        metavar='LABEL',
+        default='response',
+        help='witness transition at which the controller computes a_ego (default: response)')
+    argparser.add_argument(
+        '--max-time',
+        metavar='SECONDS',
+        default=None,
+        type=float,
+        help='end the replay after SECONDS of trace time without a collision '
+             '(default: run until a collision, until %g s after the witness and the '
+             'trace have both ended, or until the window is closed)' % END_GRACE_SECONDS)
+    argparser.add_argument(
+        '--hud-refresh',
+        metavar='N',
+        default=1,
+        type=int,
+        help='refresh the HUD\'s nearby-actor lists every N ticks (default: 1)')
+    argparser.add_argument(
+        '--headless',
+        action='store_true',
+        help='run without a window, camera or HUD and with server rendering disabled')
+    argparser.add_argument(
+        '--backend',
+        default='carla',
+        choices=['carla', 'local'],
+        help='simulator to replay in: a CARLA server at --host/--port, or the '
+             'CARLA-free kinematic stand-in of local_carla.py (default: carla)')
+    argparser.add_argument(
+        '--radar-max-points',
+        metavar='N',
+        default=200,
+        type=int,
+        help='radar detections drawn per frame at most (default: 200)')
+    argparser.add_argument(
+        '--radar-decimation',
+        metavar='N',
+        default=1,
+        type=int,
+        help='draw every N-th radar detection (default: 1)')
+    argparser.add_argument(
+        '--divergence-limit',
+        metavar='METERS',
+        default=None,
+        type=float,
+        help='abort the replay once an actor is further than METERS from its '
+             'trace position (default: only report the divergence)')
+    argparser.add_argument(
+        '--divergence-speed-limit',
+        metavar='M/S',
+        default=None,
+        type=float,
+        help='abort the replay once an actor\'s speed differs from the trace by more than M/S')
+    argparser.add_argument(
+        '--run-log',
+        metavar='FILE',
+        default=None,
+        help='write transitions, samples, controller decisions and collisions as '
+             'typed records to FILE, readable with run_log.py')
+    argparser.add_argument(
+        '--echo-events',
+        default='auto',
+        choices=['auto', 'on', 'off'],
+        help='print the replay events as they happen, and the divergence and profile '
+             'summaries; auto prints them unless --headless (default: auto)')
+    argparser.add_argument(
+        '--telemetry',
+        metavar='FILE',
+        default=None,
+        help='save every actor\'s per-tick location, velocity and commanded speed, with '
+             'the controller state, to the compressed NumPy archive FILE (.npz)')
+    argparser.add_argument(
+        '--profile',
+        metavar='FILE',
+        default=None,
+        help='time each phase of the replay loop and write p50/p95/p99 per phase '
+             'to FILE, as CSV for a .csv name and JSON otherwise')
+    argparser.add_argument(
+        '--profile-interval',
+        metavar='SECONDS',
+        default=None,
+        type=float,
+        help='also rewrite the --profile file every SECONDS of wall-clock time')
+    argparser.add_argument(
+        '--record',
+        action='store_true',
+        help='record camera frames from the start, as the R key does')
+    argparser.add_argument(
+        '--record-dir',
+        metavar='DIR',
+        default='_out',
+        help='folder recorded frames are written to (default: _out)')
+    argparser.add_argument(
+        '--record-format',
+        default='png',
+        choices=STORES,
+        help='one compressed image per frame, or \'raw\' for a chunked memory-mapped '
+             'frame store per recording (DIR/recording_<n>), readable with '
+             'frame_recorder.read_raw_store (default: png)')
+    argparser.add_argument(
+        '--record-queue',
+        metavar='N',
+        default=64,
+        type=int,
+        help='frames waiting for the recorder\'s writers (default: 64)')
+    argparser.add_argument(
+        '--record-policy',
+        default='drop',
+        choices=POLICIES,
+        help='when the queue is full, drop the frame or block the sensor thread '
+             'until a writer catches up (default: drop)')
+    argparser.add_argument(
+        '--record-writers',
+        metavar='N',
+        default=2,
+        type=int,
+        help='writer threads encoding recorded images (default: 2)')
+    argparser.add_argument(
+        '--record-chunk-frames',
+        metavar='N',
+        default=256,
+        type=int,
+        help='frames per file of a raw frame store (default: 256)')
+    argparser.add_argument(
+        '--trace-dtype',
+        default='float64',
+        choices=['float64', 'float32'],
+        help='precision of the trace columns loaded from result.csv (default: float64)')
+    argparser.add_argument(
+        '--no-trace-cache',
+        action='store_true',
+        help='always parse result.csv instead of using the binary cache')
+    argparser.add_argument(
+        '--stream-trace',
+        action='store_true',
+        help='read result.csv in chunks while replaying instead of loading it whole')
+    argparser.add_argument(
+        '--stream-chunk-rows',
+        metavar='N',
+        default=65536,
+        type=int,
+        help='rows per chunk read when streaming the trace (default: 65536)')
+    args = argparser.parse_args(argv)
 
     args.width, args.height = [int(x) for x in args.res.split('x')]
+    return args
+
+
+def replay_case(args):
+    """Load the case folder args.case and replay its witnesses; returns game_loop's outcomes."""
+    global carla, cc
+    if args.backend == 'local':
+        carla = local_carla
+        cc = local_carla.ColorConverter
+    elif carla is None:
+        raise RuntimeError('cannot import carla, use --backend local to replay without a CARLA server')
+
+    if args.backend == 'local':
+        logging.info('replaying in the local kinematic backend')
+    else:
+        logging.info('listening to server %s:%s', args.host, args.port)
+
+    global info, path, restricted_areas, witnesses
+    path = os.path.join(args.case, '')
+    restricted_areas = None
+    time_path = load_witnesses(path + 'TimePath.txt')
+    if args.witness == 'all':
+        numbers = range(len(time_path))
+    else:
+        numbers = [int(number) for number in args.witness.split(',') if number.strip()]
+        if len(set(numbers)) != len(numbers):
+            # Their run logs and telemetry would overwrite each other.
+            raise ValueError('--witness %s names a witness more than once' % args.witness)
+    for number in numbers:
+        if not 0 <= number < len(time_path):
+            raise ValueError('%sTimePath.txt holds %d witness(es), cannot replay witness %d' % (
+                path, len(time_path), number))
+    witnesses = [time_path[number] for number in numbers]
+    for witness in witnesses:
+        # A transition off the grid would fire at a different step than the falsifier's.
+        rows = off_grid(witness.exit_times)
+        if rows.size:
+            raise ValueError('%sTimePath.txt: witness No%d leaves location %r at t = %r, off the %g s grid' % (
+                path, witness.number, witness.modes[rows[0]], float(witness.exit_times[rows[0]]), TICK_SECONDS))
+    trace_dtype = np.dtype(args.trace_dtype)
+    # Numbered restricted areas (restrictParkArea2Xmin_env, ...) ride along.
+    trace_keys = key_list + [key for key in area_keys(read_header(path + 'result.csv')) if key not in key_list]
+    if args.stream_trace:
+        info = TraceStream(path + 'result.csv', trace_keys, dtype=trace_dtype, chunk_rows=args.stream_chunk_rows)
+    elif args.no_trace_cache:
+        info = load_trace(path + 'result.csv', trace_keys, dtype=trace_dtype)
+        info['t'] = stitch_periods(info['t'])
+    else:
+        cache = TraceCache(path)
+        info = cache.load_trace(path + 'result.csv', trace_keys, dtype=trace_dtype)
+        info['t'] = stitch_periods(info['t'])
+    parse_acceleration_config(path + 'acceleration_config.txt')
+    # Replays are deterministic only when the world steps on the engine's grid.
+    args.sync = True
+    args.time_step = TICK_SECONDS
+    info.check_grid(path + 'result.csv')
+    logging.info('replaying in synchronous mode, %g s per step', args.time_step)
+    return game_loop(args)
+
+
+def main():
+    args = parse_args()
 
     log_level = logging.DEBUG if args.debug else logging.INFO
     logging.basicConfig(format='%(levelname)s: %(message)s', level=log_level)
 
-    logging.info('listening to server %s:%s', args.host, args.port)
+    if not args.headless:
+        print(__doc__)
 
-    print(__doc__)
-
-    for key in key_list:
-        info[key] = list()
-    idx = 0
-    row_idx = 0
-    with open(path + 'result.csv', 'r') as file:
-        reader = csv.reader(file)
-        for row in reader:
-            data = row[0]
-            if idx == 0:
-                
-                data_info = data.split("\t")
-                for word in data_info:
-                    for key in key_list:
-                        if key == word:
-                            info[key].append(row_idx)
-                    row_idx += 1
-            else:
-                data_info = data.split("\t")
-                for key in key_list:
-                    info[key].append(data_info[info[key][0]])
-            idx += 1
-    file.close()
-    
-    t_list = list()
-    modify_t_idx = 0
-    for key in key_list:
-        if key == 't':
-            for data in info[key]:
-                t_list.append(float(data) + modify_t_idx * 3)
-                if float(data) == 3:
-                    modify_t_idx += 1
-            break
-    info['t'] = t_list
-    
-    for name in automata_name_list:
-        automata_dict[name] = list()
-    line_idx = 0
-    timestep_info = open(path + 'TimePath.txt', 'r')
-    for line in timestep_info:
-        if line_idx == 1:
-            line_info = line.split('\n')[0].split(' ')
-            data_idx = 0
-            accumulate_time = 0
-            for time_stay in line_info:
-                if time_stay == '' or time_stay == '0':
-                    continue
-                float_time_stay = float(time_stay)
-                accumulate_time += float_time_stay
-                if data_idx % len(automata_name_list) == 0:
-                    automata_dict[automata_name_list[0]].append(accumulate_time)
-                elif data_idx % len(automata_name_list) == 1:
-                    automata_dict[automata_name_list[1]].append(accumulate_time)
-                elif data_idx % len(automata_name_list) == 2:
-                    automata_dict[automata_name_list[2]].append(accumulate_time)
-                
-                data_idx += 1
-        line_idx += 1
-        if line_idx == 2: break
-    timestep_info.close()
-    parse_acceleration_config(path + 'acceleration_config.txt')
     try:
 
-        game_loop(args)
+        replay_case(args)
 
     except KeyboardInterrupt:
         print('\nCancelled by user. Bye!')
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+
+"""
+Per-phase timing of the replay loop of manual_control.py.
+
+The loop calls begin() once per tick and lap(phase) after each phase; lap
+records the time since the previous call under that phase. Durations go to
+fixed log-scale histograms (about 2% resolution from 1 us to 100 s), so a
+sample is a few arithmetic operations and memory does not grow with the
+length of the replay. Percentiles are read from the histograms on export.
+
+When profiling is off the loop uses NULL_PROFILER, whose methods do nothing.
+
+Exports are JSON or CSV, chosen by file extension:
+
+    python manual_control.py --profile profile.json
+    python manual_control.py --profile profile.csv --profile-interval 10
+"""
+
+from __future__ import print_function
+
+import collections
+import csv
+import json
+import math
+import os
+import time
+
+
+# ==============================================================================
+# -- Global functions ----------------------------------------------------------
+# ==============================================================================
+
+
+PERCENTILES = (50, 95, 99)
+TICK_PHASE = 'tick'
+
+_MIN_SECONDS = 1e-6
+_BINS_PER_DECADE = 120
+_DECADES = 8
+
+
+def _bin_of(seconds):
+    if seconds <= _MIN_SECONDS:
+        return 0
+    return min(int(math.log10(seconds / _MIN_SECONDS) * _BINS_PER_DECADE) + 1,
+               _BINS_PER_DECADE * _DECADES)
+
+
+def _seconds_of(bin_index):
+    """Upper edge of a bin."""
+    return _MIN_SECONDS * 10.0 ** (bin_index / float(_BINS_PER_DECADE))
+
+
+# ==============================================================================
+# -- Histogram -----------------------------------------------------------------
+# ==============================================================================
+
+
+class Histogram(object):
+    """Log-scale histogram of durations in seconds."""
+    def __init__(self):
+        self.counts = [0] * (_BINS_PER_DECADE * _DECADES + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[_bin_of(seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """Upper edge of the bin holding the q-th percentile, capped at max."""
+        if not self.count:
+            return 0.0
+        rank = max(1, int(math.ceil(self.count * q / 100.0)))
+        seen = 0
+        for bin_index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(_seconds_of(bin_index), self.max)
+        return self.max
+
+    def summary(self):
+        stats = collections.OrderedDict()
+        stats['count'] = self.count
+        stats['total_s'] = self.total
+        stats['mean_ms'] = 1e3 * self.total / self.count if self.count else 0.0
+        for q in PERCENTILES:
+            stats['p%d_ms' % q] = 1e3 * self.percentile(q)
+        stats['max_ms'] = 1e3 * self.max
+        return stats
+
+
+# ==============================================================================
+# -- PhaseProfiler -------------------------------------------------------------
+# ==============================================================================
+
+
+class PhaseProfiler(object):
+    """Histograms of the time spent per phase of each tick.
+
+    With output_path and interval set, the summary is also written every
+    interval seconds of wall-clock time, from begin().
+    """
+    def __init__(self, output_path=None, interval=None):
+        self.output_path = output_path
+        self.interval = interval
+        self.phases = collections.OrderedDict()
+        self._clock = time.perf_counter
+        self._tick_start = None
+        self._last = None
+        self._held = dict()
+        self._next_export = None if interval is None else self._clock() + interval
+
+    def __bool__(self):
+        return True
+
+    __nonzero__ = __bool__
+
+    def _histogram(self, phase):
+        histogram = self.phases.get(phase)
+        if histogram is None:
+            histogram = self.phases[phase] = Histogram()
+        return histogram
+
+    def begin(self):
+        """Start a tick; the previous one is recorded as TICK_PHASE."""
+        now = self._clock()
+        if self._tick_start is not None:
+            self._histogram(TICK_PHASE).add(now - self._tick_start)
+        self._tick_start = self._last = now
+        self._held.clear()
+        if self._next_export is not None and now >= self._next_export:
+            self._next_export = now + self.interval
+            self.export()
+
+    def lap(self, phase):
+        """Record the time since the previous begin() or lap() under phase.
+
+        Time set aside for phase with hold() in the same tick is added in.
+        """
+        now = self._clock()
+        self._histogram(phase).add(now - self._last + self._held.pop(phase, 0.0))
+        self._last = now
+
+    def hold(self, phase):
+        """Set the time since the previous begin() or lap() aside for the next lap(phase).
+
+        Lets a phase be interrupted by another one and still count as one
+        sample per tick.
+        """
+        now = self._clock()
+        self._held[phase] = self._held.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    def skip(self):
+        """Leave the time since the previous begin() or lap() unrecorded."""
+        self._last = self._clock()
+
+    def summary(self):
+        return collections.OrderedDict(
+            (phase, histogram.summary()) for phase, histogram in self.phases.items())
+
+    def export(self, output_path=None):
+        """Write the summary as JSON, or CSV for a .csv path."""
+        output_path = output_path or self.output_path
+        if output_path is None:
+            return
+        summary = self.summary()
+        tmp_path = output_path + '.tmp'
+        if output_path.endswith('.csv'):
+            with open(tmp_path, 'w', newline='') as file:
+                writer = None
+                for phase, stats in summary.items():
+                    if writer is None:
+                        writer = csv.DictWriter(file, fieldnames=['phase'] + list(stats))
+                        writer.writeheader()
+                    row = dict(stats)
+                    row['phase'] = phase
+                    writer.writerow(row)
+        else:
+            with open(tmp_path, 'w') as file:
+                json.dump(summary, file, indent=2)
+        os.replace(tmp_path, output_path)
+
+    def format(self):
+        lines = ['%-16s %8s %10s %10s %10s %10s %10s' % (
+            'phase', 'count', 'mean [ms]', 'p50 [ms]', 'p95 [ms]', 'p99 [ms]', 'max [ms]')]
+        for phase, stats in self.summary().items():
+            lines.append('%-16s %8d %10.3f %10.3f %10.3f %10.3f %10.3f' % (
+                phase, stats['count'], stats['mean_ms'], stats['p50_ms'],
+                stats['p95_ms'], stats['p99_ms'], stats['max_ms']))
+        return '\n'.join(lines)
+
+
+class NullProfiler(object):
+    """Stand-in for PhaseProfiler when profiling is off."""
+    def __bool__(self):
+        return False
+
+    __nonzero__ = __bool__
+
+    def begin(self):
+        pass
+
+    def lap(self, phase):
+        pass
+
+    def hold(self, phase):
+        pass
+
+    def skip(self):
+        pass
+
+    def summary(self):
+        return collections.OrderedDict()
+
+    def export(self, output_path=None):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
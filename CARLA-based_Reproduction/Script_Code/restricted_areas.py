@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""
+Precompiled geometry of the restricted areas (traffic signal, rail crossing,
+parking and U-turn areas) used by the danger evaluation of manual_control.py.
+
+The controller treats the ego as inside an area's danger zone when it is
+closer than DANGER_RADIUS to any of the area's boundary lines. The boundary
+coordinates are static for a scenario, so they are read once from the first
+trace row and kept as one sorted array per axis; a query is then two binary
+searches, however many areas the map defines.
+
+Besides the single restrict<Kind>Area<Bound>_env columns of the EnvAADL
+models, numbered copies (restrictSignalArea2X_env, restrictParkArea3Xmin_env,
+...) are picked up as additional areas of the same kind.
+"""
+
+import collections
+import re
+
+import numpy as np
+
+
+# ==============================================================================
+# -- Global functions ----------------------------------------------------------
+# ==============================================================================
+
+
+DANGER_RADIUS = 0.5
+AREA_KINDS = ('Signal', 'RailCross', 'Park', 'Uturn')
+AREA_KEY_RE = re.compile(r'^restrict(%s)Area(\d*)(X|Xmin|Xmax|Ymin|Ymax)_env$' % '|'.join(AREA_KINDS))
+
+# Areas whose bounds are all zero do not exist in the scenario; the model
+# still evaluates them against the trace's own ego position ('trace' frame).
+# Existing areas are placed in the CARLA world relative to the ego's spawn
+# point ('world' frame). The signal area is always placed in the world.
+TRACE_FRAME = 'trace'
+WORLD_FRAME = 'world'
+
+
+def area_keys(keys):
+    """Restricted area columns among keys."""
+    return [key for key in keys if AREA_KEY_RE.match(key)]
+
+
+def areas_from_trace(trace):
+    """Read the restricted areas of a scenario from the first row of a trace."""
+    bounds = collections.OrderedDict()
+    for key in area_keys(trace.keys()):
+        kind, number, bound = AREA_KEY_RE.match(key).groups()
+        bounds.setdefault((kind, number), dict())[bound] = float(trace.first(key))
+    areas = []
+    for (kind, number), area in bounds.items():
+        xs = [area[b] for b in ('X', 'Xmin', 'Xmax') if b in area]
+        ys = [area[b] for b in ('Ymin', 'Ymax') if b in area]
+        if kind == 'Signal':
+            frame = WORLD_FRAME
+        else:
+            frame = WORLD_FRAME if any(value != 0 for value in xs + ys) else TRACE_FRAME
+        areas.append(RestrictedArea(kind, kind + number, xs, ys, frame))
+    return areas
+
+
+# ==============================================================================
+# -- RestrictedArea ------------------------------------------------------------
+# ==============================================================================
+
+
+class RestrictedArea(object):
+    def __init__(self, kind, name, xs, ys, frame):
+        self.kind = kind
+        self.name = name
+        self.xs = list(xs)
+        self.ys = list(ys)
+        self.frame = frame
+
+
+class _AxisIndex(object):
+    """Sorted boundary coordinates along one axis."""
+    def __init__(self, coords):
+        self.coords = np.sort(np.asarray(coords, dtype=np.float64))
+
+    def any_near(self, value, radius):
+        lo = np.searchsorted(self.coords, value - radius, side='right')
+        hi = np.searchsorted(self.coords, value + radius, side='left')
+        return hi > lo
+
+
+# ==============================================================================
+# -- RestrictedAreaIndex -------------------------------------------------------
+# ==============================================================================
+
+
+class RestrictedAreaIndex(object):
+    """Boundary lines of all restricted areas, indexed per kind, frame and axis.
+
+    origin is the ego spawn location: world-frame boundaries sit at
+    origin - bound, as in the trace-to-CARLA mapping of manual_control.py.
+    """
+    def __init__(self, areas, origin, radius=DANGER_RADIUS):
+        self.areas = list(areas)
+        self.radius = radius
+        coords = collections.defaultdict(lambda: ([], []))
+        for area in self.areas:
+            xs, ys = coords[(area.kind, area.frame)]
+            if area.frame == WORLD_FRAME:
+                xs.extend(origin.x - x for x in area.xs)
+                ys.extend(origin.y - y for y in area.ys)
+            else:
+                xs.extend(area.xs)
+                ys.extend(area.ys)
+        self._index = dict(
+            (key, (_AxisIndex(xs), _AxisIndex(ys))) for key, (xs, ys) in coords.items())
+
+    @classmethod
+    def from_trace(cls, trace, origin, radius=DANGER_RADIUS):
+        return cls(areas_from_trace(trace), origin, radius)
+
+    def near(self, kind, positions):
+        """1 if the ego is within radius of a boundary of any area of kind, else 0.
+
+        positions maps each frame to the ego (x, y) in that frame.
+        """
+        for frame, (x, y) in positions.items():
+            index = self._index.get((kind, frame))
+            if index is None:
+                continue
+            if index[0].any_near(x, self.radius) or index[1].any_near(y, self.radius):
+                return 1
+        return 0
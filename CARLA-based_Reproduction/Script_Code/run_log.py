@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+
+"""
+Typed event log of a replay of manual_control.py.
+
+The replay loop records its events (state transitions, trace samples,
+controller decisions, collisions) as typed records instead of printing them.
+Records are buffered per type in preallocated NumPy arrays and appended to
+the log file as columnar blocks when a buffer fills up, every flush_seconds
+and on close(). Printing each record as a readable line is optional.
+
+File layout, all little-endian:
+
+    b'RUNLOG1\\n'
+    uint32 n, n bytes of JSON header: record types and their fields, state names
+    blocks: uint8 type index, uint32 count, then one column after the other
+
+Read a log back with read_run_log(), or from the command line:
+
+    python run_log.py replay.runlog
+    python run_log.py replay.runlog --csv out/
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import csv
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+
+# ==============================================================================
+# -- Global functions ----------------------------------------------------------
+# ==============================================================================
+
+
+MAGIC = b'RUNLOG1\n'
+_BLOCK = struct.Struct('<BI')
+_LENGTH = struct.Struct('<I')
+
+RECORD_TYPES = collections.OrderedDict([
+    ('transition', [('time', '<f8'), ('tick', '<i8'), ('from_state', '<i4'), ('to_state', '<i4')]),
+    ('sample', [('time', '<f8'), ('tick', '<i8'), ('row', '<i8')]),
+    ('control', [
+        ('time', '<f8'), ('tick', '<i8'), ('row', '<i8'), ('dd', '<f8'), ('danger', '<f8'),
+        ('acc_brake', '<f8'), ('acc_accelerate', '<f8'), ('acc_decelerate', '<f8'),
+        ('a_ego', '<f8'), ('action', '<i4')]),
+    ('collision', [
+        ('time', '<f8'), ('tick', '<i8'), ('intensity', '<f8'), ('ego_x', '<f8'), ('ego_y', '<f8'),
+        ('walker_x', '<f8'), ('walker_y', '<f8'), ('npc_x', '<f8'), ('npc_y', '<f8')]),
+])
+
+
+def format_record(kind, record, state_names=()):
+    """One readable line for a record (a mapping or structured array element)."""
+    if kind == 'transition':
+        names = list(state_names)
+        from_state, to_state = int(record['from_state']), int(record['to_state'])
+        return '-----------------TRANS FROM %s TO %s-----------------:%d' % (
+            names[from_state] if from_state < len(names) else from_state,
+            names[to_state] if to_state < len(names) else to_state,
+            record['tick'])
+    if kind == 'sample':
+        return '-----------------FINISH SAMPLING----------------- row %d' % record['row']
+    if kind == 'control':
+        return ('sample_frame_idx = %d, dd = %s, danger = %s, acc = %s + %s + %s, a_ego = %s' % (
+            record['row'], record['dd'], record['danger'], record['acc_brake'],
+            record['acc_accelerate'], record['acc_decelerate'], record['a_ego']))
+    if kind == 'collision':
+        return ('collision at %.2f s, intensity %.1f, ego (%.3f, %.3f), walker (%.3f, %.3f), npc (%.3f, %.3f)' % (
+            record['time'], record['intensity'], record['ego_x'], record['ego_y'],
+            record['walker_x'], record['walker_y'], record['npc_x'], record['npc_y']))
+    return '%s %s' % (kind, record)
+
+
+def read_run_log(file_path):
+    """Return (header, {record type: structured array}) of a run log file."""
+    with open(file_path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a run log' % file_path)
+        (length,) = _LENGTH.unpack(file.read(_LENGTH.size))
+        header = json.loads(file.read(length).decode('utf-8'))
+        kinds = list(header['types'])
+        dtypes = [np.dtype([tuple(field) for field in header['types'][kind]]) for kind in kinds]
+        blocks = collections.defaultdict(list)
+        while True:
+            head = file.read(_BLOCK.size)
+            if len(head) < _BLOCK.size:
+                break
+            index, count = _BLOCK.unpack(head)
+            dtype = dtypes[index]
+            block = np.empty(count, dtype=dtype)
+            for name in dtype.names:
+                column = dtype.fields[name][0]
+                data = file.read(count * column.itemsize)
+                if len(data) < count * column.itemsize:
+                    # Truncated by a crash: keep the complete blocks only.
+                    return header, _concatenate(kinds, dtypes, blocks)
+                block[name] = np.frombuffer(data, dtype=column)
+            blocks[kinds[index]].append(block)
+    return header, _concatenate(kinds, dtypes, blocks)
+
+
+def _concatenate(kinds, dtypes, blocks):
+    return collections.OrderedDict(
+        (kind, np.concatenate(blocks[kind]) if blocks[kind] else np.empty(0, dtype=dtype))
+        for kind, dtype in zip(kinds, dtypes))
+
+
+# ==============================================================================
+# -- RunLog --------------------------------------------------------------------
+# ==============================================================================
+
+
+class RunLog(object):
+    """Buffered writer of typed replay records.
+
+    Without file_path records are only echoed (if echo is set) and dropped.
+    """
+    def __init__(self, file_path=None, echo=False, state_names=(), buffer_records=4096,
+                 flush_seconds=5.0, meta=None):
+        self.file_path = file_path
+        self.echo = echo
+        self.state_names = list(state_names)
+        self.flush_seconds = flush_seconds
+        self._kinds = list(RECORD_TYPES)
+        self._dtypes = dict((kind, np.dtype(fields)) for kind, fields in RECORD_TYPES.items())
+        self._buffers = dict(
+            (kind, np.empty(buffer_records, dtype=dtype)) for kind, dtype in self._dtypes.items())
+        self._counts = dict((kind, 0) for kind in self._kinds)
+        self._file = None
+        self._next_flush = time.monotonic() + flush_seconds
+        if file_path is not None:
+            header = json.dumps({
+                'types': RECORD_TYPES,
+                'states': self.state_names,
+                'meta': meta or {}}).encode('utf-8')
+            self._file = open(file_path, 'wb')
+            self._file.write(MAGIC + _LENGTH.pack(len(header)) + header)
+
+    def record(self, kind, *values):
+        """Add a record; values in the order of RECORD_TYPES[kind]."""
+        if self.echo:
+            print(format_record(kind, dict(zip(self._dtypes[kind].names, values)), self.state_names))
+        if self._file is None:
+            return
+        count = self._counts[kind]
+        buffer = self._buffers[kind]
+        buffer[count] = values
+        self._counts[kind] = count + 1
+        if count + 1 == len(buffer):
+            self._write(kind)
+        if time.monotonic() >= self._next_flush:
+            self.flush()
+
+    def transition(self, time, tick, from_state, to_state):
+        self.record('transition', time, tick, from_state, to_state)
+
+    def sample(self, time, tick, row):
+        self.record('sample', time, tick, row)
+
+    def control(self, time, tick, row, dd, danger, acc_brake, acc_accelerate, acc_decelerate, a_ego, action):
+        self.record('control', time, tick, row, dd, danger, acc_brake, acc_accelerate, acc_decelerate, a_ego, action)
+
+    def collision(self, time, tick, intensity, ego, walker, npc):
+        """ego, walker and npc are locations with x and y."""
+        self.record('collision', time, tick, intensity, ego.x, ego.y, walker.x, walker.y, npc.x, npc.y)
+
+    def _write(self, kind):
+        count = self._counts[kind]
+        if not count:
+            return
+        block = self._buffers[kind][:count]
+        self._file.write(_BLOCK.pack(self._kinds.index(kind), count))
+        for name in block.dtype.names:
+            self._file.write(np.ascontiguousarray(block[name]).tobytes())
+        self._counts[kind] = 0
+
+    def flush(self):
+        self._next_flush = time.monotonic() + self.flush_seconds
+        if self._file is None:
+            return
+        for kind in self._kinds:
+            self._write(kind)
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+
+# ==============================================================================
+# -- main() --------------------------------------------------------------------
+# ==============================================================================
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description='Print a replay run log, or export it as one CSV file per record type')
+    argparser.add_argument(
+        'log',
+        metavar='FILE',
+        help='run log written with manual_control.py --run-log')
+    argparser.add_argument(
+        '--csv',
+        metavar='DIR',
+        default=None,
+        help='write DIR/<record type>.csv instead of printing the records')
+    args = argparser.parse_args()
+
+    header, records = read_run_log(args.log)
+    if args.csv is None:
+        events = sorted(
+            ((record['time'], kind, record) for kind, array in records.items() for record in array),
+            key=lambda event: event[0])
+        for _, kind, record in events:
+            print(format_record(kind, record, header['states']))
+        return
+    if not os.path.isdir(args.csv):
+        os.makedirs(args.csv)
+    for kind, array in records.items():
+        with open(os.path.join(args.csv, kind + '.csv'), 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(array.dtype.names)
+            writer.writerows(array.tolist())
+        print('%d %s records written to %s' % (len(array), kind, os.path.join(args.csv, kind + '.csv')))
+
+
+if __name__ == '__main__':
+
+    main()
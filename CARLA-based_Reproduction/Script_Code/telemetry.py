@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""
+Per-tick state of a replay of manual_control.py, saved as a compressed .npz.
+
+Every tick adds one row: time, tick, automaton state, the controller's
+danger, dd, a_ego and action, and for each actor its location, velocity and
+commanded speed. Rows go to preallocated NumPy arrays, a fixed number of
+bytes per tick; the arrays double when full. save() writes the filled part
+with np.savez_compressed, one array per column:
+
+    time (n,)  tick (n,)  state (n,)  danger (n,)  dd (n,)  a_ego (n,)  action (n,)
+    location (n, actors, 3)  velocity (n, actors, 3)  command (n, actors)
+    actors (actors,)  states (names of the state indices)
+
+Load it with np.load(); NaN marks values not known at a tick (an actor that
+was not spawned, the controller before its first decision).
+"""
+
+import numpy as np
+
+
+# ==============================================================================
+# -- TickTelemetry -------------------------------------------------------------
+# ==============================================================================
+
+
+class TickTelemetry(object):
+    def __init__(self, actors, state_names=(), capacity=4096):
+        self.actors = list(actors)
+        self.state_names = list(state_names)
+        self.count = 0
+        n = len(self.actors)
+        capacity = max(1, int(capacity))
+        self.columns = {
+            'time': np.empty(capacity, dtype=np.float64),
+            'tick': np.empty(capacity, dtype=np.int64),
+            'state': np.empty(capacity, dtype=np.int32),
+            'danger': np.empty(capacity, dtype=np.float64),
+            'dd': np.empty(capacity, dtype=np.float64),
+            'a_ego': np.empty(capacity, dtype=np.float64),
+            'action': np.empty(capacity, dtype=np.int8),
+            'location': np.empty((capacity, n, 3), dtype=np.float32),
+            'velocity': np.empty((capacity, n, 3), dtype=np.float32),
+            'command': np.empty((capacity, n), dtype=np.float32)}
+
+    def _grow(self):
+        for name, column in self.columns.items():
+            grown = np.empty((2 * column.shape[0],) + column.shape[1:], dtype=column.dtype)
+            grown[:self.count] = column[:self.count]
+            self.columns[name] = grown
+
+    def add(self, time, tick, state, danger, dd, a_ego, action, snapshot, actors, commands):
+        """Add one tick; actors are in the order of self.actors, None if missing.
+
+        commands holds each actor's commanded speed (NaN for none).
+        """
+        if self.count == self.columns['time'].shape[0]:
+            self._grow()
+        row = self.count
+        columns = self.columns
+        columns['time'][row] = time
+        columns['tick'][row] = tick
+        columns['state'][row] = state
+        columns['danger'][row] = danger
+        columns['dd'][row] = dd
+        columns['a_ego'][row] = a_ego
+        columns['action'][row] = action
+        location = columns['location'][row]
+        velocity = columns['velocity'][row]
+        for n, actor in enumerate(actors):
+            actor_snapshot = snapshot.find(actor.id) if actor is not None else None
+            if actor_snapshot is None:
+                location[n] = np.nan
+                velocity[n] = np.nan
+                continue
+            l = actor_snapshot.get_transform().location
+            v = actor_snapshot.get_velocity()
+            location[n] = l.x, l.y, l.z
+            velocity[n] = v.x, v.y, v.z
+        columns['command'][row] = commands
+        self.count = row + 1
+
+    def arrays(self):
+        """The recorded columns, trimmed to the ticks added."""
+        arrays = dict((name, column[:self.count]) for name, column in self.columns.items())
+        arrays['actors'] = np.array(self.actors)
+        arrays['states'] = np.array(self.state_names)
+        return arrays
+
+    def save(self, file_path):
+        np.savez_compressed(file_path, **self.arrays())
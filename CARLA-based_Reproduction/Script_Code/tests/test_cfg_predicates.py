@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+
+from cfg_predicates import check_case, compile_predicate, violation_intervals
+
+
+def trace(**columns):
+    return dict((key, np.asarray(values, dtype=np.float64)) for key, values in columns.items())
+
+
+def test_arithmetic_precedence():
+    data = trace(a=[1.0, 2.0], b=[3.0, 4.0], c=[2.0, 1.0])
+    # a + b * c, not (a + b) * c; a - b - c is left associative.
+    assert compile_predicate('a + b * c == 7').variables == {'a', 'b', 'c'}
+    assert compile_predicate('a + b * c == 7')(data).tolist() == [True, False]
+    assert compile_predicate('a - b - c == -4')(data).tolist() == [True, False]
+    assert compile_predicate('-a * 2 == -2')(data).tolist() == [True, False]
+    assert compile_predicate('(a + b) * c == 8')(data).tolist() == [True, False]
+
+
+def test_and_binds_tighter_than_or():
+    data = trace(x=[0.0, 1.0, 1.0, 0.0], y=[0.0, 0.0, 1.0, 1.0])
+    assert compile_predicate('x > 0 | x < 1 & y > 0')(data).tolist() == [False, True, True, True]
+    assert compile_predicate('(x > 0 | x < 1) & y > 0')(data).tolist() == [False, False, True, True]
+    assert compile_predicate('!x > 0 & y > 0')(data).tolist() == [False, False, False, True]
+    assert compile_predicate('x > 0 && y > 0 || !(x > 0)')(data).tolist() == [True, False, True, True]
+
+
+def test_chained_comparison():
+    data = trace(s=[-1.0, 0.0, 50.0, 100.0, 150.0])
+    assert compile_predicate('0.0<s<100.0')(data).tolist() == [False, False, True, False, False]
+    assert compile_predicate('0.0<=s<=100.0')(data).tolist() == [False, True, True, True, False]
+
+
+def test_equality_uses_tolerance_and_functions():
+    data = trace(x=[0.1 + 0.2, 0.31], y=[-3.0, 3.0])
+    assert compile_predicate('x == 0.3')(data).tolist() == [True, False]
+    assert compile_predicate('x != 0.3')(data).tolist() == [False, True]
+    assert compile_predicate('abs(y) == 3 & max(x, 0.305) > 0.305')(data).tolist() == [False, True]
+
+
+def test_loc_clause_with_and_without_locations():
+    data = trace(action=[-1.0, -1.0, 0.0])
+    loc = ['Actuate,Environment,Plant', 'init', 'Actuate,Environment,Plant']
+    predicate = compile_predicate('loc()==Actuate,Environment,Plant & action==-1')
+    assert predicate.locations == {'Actuate,Environment,Plant'}
+    assert predicate(data, loc).tolist() == [True, False, False]
+    # Without a location array loc() does not constrain the rows.
+    assert predicate(data).tolist() == [True, True, False]
+    assert compile_predicate('loc()!=init & action==-1')(data, loc).tolist() == [True, False, False]
+
+
+@pytest.mark.parametrize('text', ['a <', 'loc() < x', 'foo(a)', '(a > 1', 'a > 1 )', 'a $ b'])
+def test_syntax_errors(text):
+    with pytest.raises(SyntaxError):
+        compile_predicate(text)
+
+
+def test_violation_intervals():
+    assert violation_intervals([]) == []
+    assert violation_intervals([True, True, False, True, False, False, True]) == [(0, 2), (3, 4), (6, 7)]
+
+
+def test_check_case_reports_first_frame_and_intervals(tmp_path):
+    rows = [(0.0, 0.0, 5.0), (0.01, -1.0, 0.05), (0.04, -1.0, 0.02), (0.14, 0.0, 0.01), (0.24, -1.0, 0.0)]
+    with open(str(tmp_path / 'result.csv'), 'w') as file:
+        file.write('\tt\taction\tgap\n')
+        for t, action, gap in rows:
+            file.write('*t* = %g\t%g\t%g\t%g\n' % (t, t, action, gap))
+    with open(str(tmp_path / 'case.cfg'), 'w') as file:
+        file.write('initial = "loc()==init & action==0.0 & t==0"\n')
+        file.write('forbidden = "action==-1 & abs(gap) < 0.1"\n')
+    report = check_case(str(tmp_path))
+    assert report['first_forbidden'] == 1
+    assert report['intervals'] == [(1, 3), (4, 5)]
+    assert report['forbidden'].tolist() == [False, True, True, False, True]
+    assert report['initial'] is True
+
+
+def test_loc_only_predicate_takes_rows_from_trace():
+    predicate = compile_predicate('loc()==init')
+    assert predicate.variables == set()
+    assert predicate(trace(t=[0.0, 0.01, 0.02])).tolist() == [True, True, True]
+    assert predicate(trace(t=[0.0, 0.01]), ['init', 'sample']).tolist() == [True, False]
+    with pytest.raises(ValueError):
+        predicate(trace())
+
+
+def write_case(case_dir, rows, forbidden, time_path=None):
+    with open(str(case_dir / 'result.csv'), 'w') as file:
+        file.write('\tt\taction\n')
+        for t, action in rows:
+            file.write('*t* = %g\t%g\t%g\n' % (t, t, action))
+    with open(str(case_dir / 'case.cfg'), 'w') as file:
+        file.write('forbidden = "%s"\n' % forbidden)
+    if time_path is not None:
+        with open(str(case_dir / 'TimePath.txt'), 'w') as file:
+            file.write(time_path)
+
+
+def test_check_case_takes_locations_from_time_path(tmp_path, capsys):
+    rows = [(0.0, 0.0), (0.01, -1.0), (0.04, -1.0), (0.14, 0.0), (0.24, -1.0)]
+    time_path = (
+        'path staying time:\n  0  0.04  0.2  0\n'
+        'Witness:\n\tNo0. :[system_init]^system_t0^[init]^response^[Act]^target_transition^[target]\n')
+    write_case(tmp_path, rows, 'loc()==Act & action==-1', time_path)
+    report = check_case(str(tmp_path))
+    # Row 1 is still in init; the last row, at the end of the path, is in Act.
+    assert report['forbidden'].tolist() == [False, False, True, False, True]
+    assert capsys.readouterr().out == ''
+
+
+def test_check_case_warns_without_time_path(tmp_path, capsys):
+    rows = [(0.0, 0.0), (0.01, -1.0)]
+    write_case(tmp_path, rows, 'loc()==Act & action==-1')
+    report = check_case(str(tmp_path))
+    assert report['forbidden'].tolist() == [False, True]
+    assert 'loc() terms are not checked' in capsys.readouterr().out
@@ -0,0 +1,44 @@
+import pytest
+
+pytest.importorskip('pygame')
+
+from manual_control import CollisionHistory
+
+
+def test_ring_wraps_around():
+    history = CollisionHistory(window=4)
+    for frame in range(1, 7):
+        history.add(frame, float(frame))
+    history.add(6, 0.5)
+    assert history.view(6, 4).tolist() == [3.0, 4.0, 5.0, 6.5]
+    assert history.view(6, 10).tolist() == [3.0, 4.0, 5.0, 6.5]
+    assert history.view(5, 2).tolist() == [4.0, 5.0]
+    # Frames that already left the window are dropped.
+    history.add(2, 100.0)
+    assert history.view(6, 4).tolist() == [3.0, 4.0, 5.0, 6.5]
+
+
+def test_advancing_clears_stale_slots():
+    history = CollisionHistory(window=4)
+    history.add(1, 1.0)
+    history.add(2, 2.0)
+    assert history.view(4, 4).tolist() == [1.0, 2.0, 0.0, 0.0]
+    assert history.view(5, 4).tolist() == [2.0, 0.0, 0.0, 0.0]
+    assert history.view(20, 4).tolist() == [0.0, 0.0, 0.0, 0.0]
+
+
+def test_view_is_read_only():
+    history = CollisionHistory(window=4)
+    history.add(3, 1.0)
+    view = history.view(3, 2)
+    with pytest.raises(ValueError):
+        view[0] = 1.0
+
+
+def test_clear_forgets_frames():
+    history = CollisionHistory(window=4)
+    history.add(10, 1.0)
+    history.clear()
+    # A new replay may start again from an earlier frame.
+    history.add(1, 2.0)
+    assert history.view(1, 4).tolist() == [0.0, 0.0, 0.0, 2.0]
@@ -0,0 +1,19 @@
+import glob
+import os
+
+import pytest
+
+from controller_model import OUTPUT_KEYS, compare_with_engine, evaluate_case
+
+
+CASES = sorted(glob.glob(os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'Case*')))
+
+
+@pytest.mark.parametrize('case_dir', CASES, ids=os.path.basename)
+def test_model_matches_engine(case_dir):
+    trace, result = evaluate_case(case_dir)
+    report = compare_with_engine(trace, result)
+    assert sorted(report) == sorted(OUTPUT_KEYS)
+    for key, (error, mismatches) in report.items():
+        assert mismatches == 0, '%s: max error %g' % (key, error)
@@ -0,0 +1,45 @@
+import math
+
+import numpy as np
+import pytest
+
+from divergence import POSITION, DivergenceMonitor
+
+
+ACTORS = ('ego', 'walker')
+
+
+def test_running_max_and_rms():
+    monitor = DivergenceMonitor(ACTORS)
+    expected = np.array([[0.0, 0.0, 10.0], [5.0, 5.0, 1.0]])
+    assert not monitor.update(0.01, expected, [[3.0, 4.0, 10.5], [5.0, 5.0, 1.0]])
+    assert not monitor.update(0.02, expected, [[0.0, 0.0, 10.0], [5.0, 6.0, 1.0]])
+    summary = monitor.summary()
+    assert summary['ego']['samples'] == 2
+    assert summary['ego']['position_max'] == pytest.approx(5.0)
+    assert summary['ego']['position_max_time'] == pytest.approx(0.01)
+    assert summary['ego']['position_rms'] == pytest.approx(math.sqrt(25.0 / 2))
+    assert summary['ego']['speed_max'] == pytest.approx(0.5)
+    assert summary['walker']['position_max'] == pytest.approx(1.0)
+    assert summary['walker']['position_max_time'] == pytest.approx(0.02)
+    assert monitor.exceeded is None
+
+
+def test_missing_actors_are_skipped():
+    monitor = DivergenceMonitor(ACTORS)
+    monitor.update(0.01, [[0.0, 0.0, 0.0], [1.0, 1.0, 1.0]], [[1.0, 0.0, 0.0], [np.nan] * 3])
+    summary = monitor.summary()
+    assert summary['walker']['samples'] == 0
+    assert summary['walker']['position_rms'] == 0.0
+    assert summary['ego']['samples'] == 1
+
+
+def test_first_exceeded_limit_is_kept():
+    monitor = DivergenceMonitor(ACTORS, position_limit=1.0, speed_limit=2.0)
+    expected = [[0.0, 0.0, 0.0], [0.0, 0.0, 0.0]]
+    assert not monitor.update(0.01, expected, [[0.5, 0.0, 1.0], [0.0, 0.0, 0.0]])
+    assert monitor.update(0.02, expected, [[1.5, 0.0, 0.0], [0.0, 3.0, 3.0]])
+    # Of the actors over the position limit the worst one is reported.
+    assert monitor.exceeded == ('walker', POSITION, pytest.approx(3.0), 0.02)
+    monitor.update(0.03, expected, [[9.0, 0.0, 9.0], [0.0, 0.0, 0.0]])
+    assert monitor.exceeded[3] == 0.02
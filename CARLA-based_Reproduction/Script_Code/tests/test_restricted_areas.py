@@ -0,0 +1,72 @@
+import collections
+
+import numpy as np
+import pytest
+
+from restricted_areas import TRACE_FRAME, WORLD_FRAME, RestrictedAreaIndex
+from trace_store import TraceStore
+
+
+Location = collections.namedtuple('Location', 'x y')
+
+AREAS = collections.OrderedDict([
+    ('restrictSignalAreaX_env', 50.0),
+    ('restrictRailCrossAreaXmin_env', 20.0),
+    ('restrictRailCrossAreaXmax_env', 30.0),
+    ('restrictRailCrossAreaYmin_env', -2.0),
+    ('restrictRailCrossAreaYmax_env', 2.0),
+    ('restrictParkAreaXmin_env', 0.0),
+    ('restrictParkAreaXmax_env', 0.0),
+    ('restrictParkAreaYmin_env', 0.0),
+    ('restrictParkAreaYmax_env', 0.0)])
+
+
+def sign(a):
+    return 1 if a > 0 else 0
+
+
+def any_of(*terms):
+    # The controller's sign(sign(sign(a + b) + c) + d) chain.
+    result = 0
+    for term in terms:
+        result = sign(result + term)
+    return result
+
+
+def baseline(init, ego, trace_ego):
+    """Danger terms C, D and E of compute_danger before the spatial index."""
+    def world_x(key):
+        return sign(0.5 - abs((init.x - AREAS[key]) - ego.x))
+
+    def world_y(key):
+        return sign(0.5 - abs((init.y - AREAS[key]) - ego.y))
+
+    def trace_x(key):
+        return sign(0.5 - abs(AREAS[key] - trace_ego.x))
+
+    def trace_y(key):
+        return sign(0.5 - abs(AREAS[key] - trace_ego.y))
+
+    signal = world_x('restrictSignalAreaX_env')
+    rail = any_of(
+        world_x('restrictRailCrossAreaXmin_env'), world_x('restrictRailCrossAreaXmax_env'),
+        world_y('restrictRailCrossAreaYmin_env'), world_y('restrictRailCrossAreaYmax_env'))
+    park = any_of(
+        trace_x('restrictParkAreaXmin_env'), trace_x('restrictParkAreaXmax_env'),
+        trace_y('restrictParkAreaYmin_env'), trace_y('restrictParkAreaYmax_env'))
+    return signal, rail, park
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_index_matches_baseline_formulas(seed):
+    trace = TraceStore(list(AREAS), np.array([list(AREAS.values())]))
+    init = Location(100.0, 3.0)
+    index = RestrictedAreaIndex.from_trace(trace, init)
+    rng = np.random.RandomState(seed)
+    for _ in range(500):
+        ego = Location(*rng.uniform([0.0, -2.0], [110.0, 8.0]))
+        trace_ego = Location(*rng.uniform([-1.0, -1.0], [60.0, 1.0]))
+        positions = {WORLD_FRAME: ego, TRACE_FRAME: trace_ego}
+        expected = baseline(init, ego, trace_ego)
+        actual = tuple(index.near(kind, positions) for kind in ('Signal', 'RailCross', 'Park'))
+        assert actual == expected, (ego, trace_ego)
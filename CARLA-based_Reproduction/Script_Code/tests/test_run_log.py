@@ -0,0 +1,53 @@
+import collections
+
+import pytest
+
+from run_log import RunLog, format_record, read_run_log
+
+
+Location = collections.namedtuple('Location', 'x y')
+
+
+def test_round_trip(tmp_path):
+    file_path = str(tmp_path / 'replay.runlog')
+    log = RunLog(file_path, state_names=['init', 'sample'], buffer_records=2, meta={'case': 'Case1'})
+    log.transition(0.0, 0, 0, 1)
+    for tick in range(5):
+        log.sample(tick * 0.01, tick, tick // 2)
+    log.collision(1.01, 101, 8683.9, Location(1.0, 2.0), Location(3.0, 4.0), Location(5.0, 6.0))
+    log.close()
+
+    header, records = read_run_log(file_path)
+    assert header['states'] == ['init', 'sample']
+    assert header['meta'] == {'case': 'Case1'}
+    assert list(records) == ['transition', 'sample', 'control', 'collision']
+    # Five samples through a two-record buffer: two full blocks and one flushed on close.
+    assert records['sample']['tick'].tolist() == [0, 1, 2, 3, 4]
+    assert records['sample']['row'].tolist() == [0, 0, 1, 1, 2]
+    assert len(records['control']) == 0
+    collision = records['collision'][0]
+    assert collision['intensity'] == pytest.approx(8683.9)
+    assert (collision['walker_x'], collision['npc_y']) == (3.0, 6.0)
+    assert format_record('transition', records['transition'][0], header['states']).startswith(
+        '-----------------TRANS FROM init TO sample')
+
+
+def test_truncated_log_keeps_complete_blocks(tmp_path):
+    file_path = str(tmp_path / 'replay.runlog')
+    log = RunLog(file_path, buffer_records=2)
+    for tick in range(3):
+        log.sample(tick * 0.01, tick, tick)
+    log.close()
+    with open(file_path, 'rb') as file:
+        data = file.read()
+    with open(file_path, 'wb') as file:
+        file.write(data[:-4])
+    _, records = read_run_log(file_path)
+    assert records['sample']['tick'].tolist() == [0, 1]
+
+
+def test_without_file_records_are_dropped(capsys):
+    log = RunLog(echo=True)
+    log.sample(0.0, 0, 3)
+    log.close()
+    assert 'FINISH SAMPLING' in capsys.readouterr().out
@@ -0,0 +1,56 @@
+import collections
+
+import numpy as np
+
+from telemetry import TickTelemetry
+
+
+Vector = collections.namedtuple('Vector', 'x y z')
+Transform = collections.namedtuple('Transform', 'location')
+Actor = collections.namedtuple('Actor', 'id')
+
+
+class ActorSnapshot(object):
+    def __init__(self, tick):
+        self._tick = tick
+
+    def get_transform(self):
+        return Transform(Vector(float(self._tick), 1.0, 0.0))
+
+    def get_velocity(self):
+        return Vector(10.0, 0.0, 0.0)
+
+
+class Snapshot(object):
+    """Holds only the ego (actor 1)."""
+    def __init__(self, tick):
+        self._tick = tick
+
+    def find(self, actor_id):
+        return ActorSnapshot(self._tick) if actor_id == 1 else None
+
+
+def test_grows_and_round_trips(tmp_path):
+    telemetry = TickTelemetry(['ego', 'walker', 'barrel'], state_names=['init', 'sample'], capacity=2)
+    actors = [Actor(1), Actor(2), None]
+    for tick in range(5):
+        telemetry.add(
+            tick * 0.01, tick, tick % 2, 0.0, 1.5, -2.8, -1, Snapshot(tick), actors, [10.0, 1.2, np.nan])
+    assert telemetry.count == 5
+    assert telemetry.columns['time'].shape[0] == 8
+
+    file_path = str(tmp_path / 'telemetry.npz')
+    telemetry.save(file_path)
+    data = np.load(file_path)
+    assert data['tick'].tolist() == [0, 1, 2, 3, 4]
+    assert data['state'].dtype == np.int32
+    assert data['state'].tolist() == [0, 1, 0, 1, 0]
+    assert data['actors'].tolist() == ['ego', 'walker', 'barrel']
+    assert data['states'].tolist() == ['init', 'sample']
+    assert data['location'].shape == (5, 3, 3)
+    assert data['location'][:, 0, 0].tolist() == [0.0, 1.0, 2.0, 3.0, 4.0]
+    assert data['velocity'][3, 0].tolist() == [10.0, 0.0, 0.0]
+    # An actor missing from the snapshot and one never spawned are NaN.
+    assert np.isnan(data['location'][:, 1:]).all()
+    assert np.isnan(data['command'][:, 2]).all()
+    assert data['command'][:, 1].tolist() == [np.float32(1.2)] * 5
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from timetable import Witness, load_witnesses, parse_path
+
+
+PATH = ('[system_init]^system_t0^[init]^sample^[WaitControl,Environment,Plant]^response^'
+        '[Actuate,Environment,Plant]^next_period^[init]^sample^[WaitControl,Environment,Plant]')
+
+
+def test_parse_path():
+    modes, edges = parse_path('[a]^e^[b,c]^f^[a]')
+    assert modes == ['a', 'b,c', 'a']
+    assert edges == ['e', 'f']
+    with pytest.raises(ValueError):
+        parse_path('[a]^e')
+    with pytest.raises(ValueError):
+        parse_path('[a]^e^b')
+
+
+def test_witness_timetable():
+    witness = Witness(*parse_path(PATH), stay=[0, 0.01, 0.03, 0.96, 0.01, 0.5])
+    assert witness.locations == [
+        'system_init', 'init', 'WaitControl,Environment,Plant', 'Actuate,Environment,Plant']
+    assert witness.location_index.tolist() == [0, 1, 2, 3, 1, 2]
+    assert np.allclose(witness.exit_times, [0, 0.01, 0.04, 1.0, 1.01, 1.51])
+    assert witness.duration == pytest.approx(1.51)
+    assert [(event.edge, event.source, event.target) for event in witness.events()] == [
+        ('system_t0', 0, 1), ('sample', 1, 2), ('response', 2, 3), ('next_period', 3, 4), ('sample', 4, 5)]
+    assert np.allclose(witness.edge_times('sample'), [0.01, 1.01])
+    # A location is left at its exit time; after the path ends the last one holds.
+    assert witness.location_at(0.0) == 'init'
+    assert witness.location_at(0.02) == 'WaitControl,Environment,Plant'
+    assert witness.location_at(0.04) == 'Actuate,Environment,Plant'
+    assert witness.mode_at(1.005) == 4
+    assert witness.location_at(10.0) == 'WaitControl,Environment,Plant'
+
+
+def test_witness_checks_lengths():
+    with pytest.raises(ValueError):
+        Witness(['a', 'b'], ['e'], [0.1])
+    with pytest.raises(ValueError):
+        Witness(['a', 'b'], [], [0.1, 0.2])
+
+
+def test_load_witnesses_pairs_staying_times(tmp_path):
+    file_path = str(tmp_path / 'TimePath.txt')
+    with open(file_path, 'w') as file:
+        file.write('path staying time: \n  0  0.01  0.03  0.96  0  \nWitness: \n'
+                   '\tNo0. :[system_init]^system_t0^[init]^sample^[Wait]^response^[Act]^target^[end]\n'
+                   'path staying time: \n  0  0.02  0.05  0.93  0  \nWitness: \n'
+                   '\tNo1. :[system_init]^system_t0^[init]^sample^[Wait]^response^[Act]^target^[end]\n')
+    first, second = load_witnesses(file_path)
+    assert (first.number, second.number) == (0, 1)
+    assert np.allclose(first.edge_times('response'), [0.04])
+    assert np.allclose(second.edge_times('response'), [0.07])
+
+
+def test_load_witnesses_rejects_unpaired_lines(tmp_path):
+    file_path = str(tmp_path / 'TimePath.txt')
+    with open(file_path, 'w') as file:
+        file.write('path staying time: \n  0  0.01  0\n')
+    with pytest.raises(ValueError):
+        load_witnesses(file_path)
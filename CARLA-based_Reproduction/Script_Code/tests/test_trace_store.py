@@ -0,0 +1,147 @@
+import os
+
+import numpy as np
+import pytest
+
+from trace_store import TraceCache, TraceStream, load_trace, off_grid, stitch_periods
+
+
+TIMES = [0.0, 0.01, 0.04, 0.14, 0.24, 3.0, 0.01, 0.11]
+STITCHED = [0.0, 0.01, 0.04, 0.14, 0.24, 3.0, 3.01, 3.11]
+
+
+@pytest.fixture
+def result_csv(tmp_path):
+    file_path = str(tmp_path / 'result.csv')
+    with open(file_path, 'w') as file:
+        file.write('\tt\tx_ego\tv_ego\n')
+        for n, t in enumerate(TIMES):
+            file.write('*t* = %g\t%g\t%g\t%g\n' % (t, t, n * 1.5, 10.0 - n))
+    return file_path
+
+
+def test_stitch_periods():
+    assert np.allclose(stitch_periods(TIMES), STITCHED)
+
+
+def test_load_trace_selects_columns(result_csv):
+    trace = load_trace(result_csv, ['v_ego', 't'])
+    assert trace.keys() == ['v_ego', 't']
+    assert len(trace) == len(TIMES)
+    assert trace['v_ego'][2] == 8.0
+    assert trace.first('t') == 0.0
+    with pytest.raises(ValueError):
+        load_trace(result_csv, ['missing'])
+
+
+def test_row_at_time(result_csv):
+    trace = load_trace(result_csv)
+    trace['t'] = stitch_periods(trace['t'])
+    assert trace.row_at_time(0.04) == 2
+    assert trace.row_at_time(3.01) == 6
+    assert trace.row_at_time(0.05) is None
+
+
+def test_cache_reuses_entry_after_mtime_change(result_csv, tmp_path):
+    cache = TraceCache(str(tmp_path))
+    first = cache.load_trace(result_csv, ['t', 'x_ego'])
+    os.utime(result_csv, (1, 1))
+    cached = cache.load_trace(result_csv, ['t', 'x_ego'])
+    assert isinstance(cached.data, np.memmap) or isinstance(cached.data.base, np.memmap)
+    assert np.array_equal(cached.data, first.data)
+    with open(result_csv, 'a') as file:
+        file.write('*t* = 0.21\t0.21\t99\t0\n')
+    assert len(cache.load_trace(result_csv, ['t', 'x_ego'])) == len(TIMES) + 1
+
+
+def test_cache_survives_read_only_meta(result_csv, tmp_path, monkeypatch):
+    cache = TraceCache(str(tmp_path))
+    cache.load_trace(result_csv, ['t'])
+    os.utime(result_csv, (1, 1))
+
+    def read_only(entry, meta):
+        raise OSError(30, 'Read-only file system')
+    monkeypatch.setattr(TraceCache, '_write_meta', staticmethod(read_only))
+    assert len(cache.load_trace(result_csv, ['t'])) == len(TIMES)
+
+
+def test_stream_matches_store(result_csv):
+    store = load_trace(result_csv)
+    store['t'] = stitch_periods(store['t'])
+    stream = TraceStream(result_csv, chunk_rows=3)
+    for row in range(len(TIMES)):
+        assert stream['x_ego'][row] == store['x_ego'][row]
+        assert stream['t'][row] == pytest.approx(store['t'][row])
+    assert not stream.has_row(len(TIMES))
+    assert stream.row_at_time(3.11) == 7
+
+
+def test_stream_release(result_csv):
+    stream = TraceStream(result_csv, chunk_rows=3)
+    assert stream.row_at_time(3.01) == 6
+    stream.release(6)
+    with pytest.raises(IndexError):
+        stream['x_ego'][0]
+    assert stream['x_ego'][6] == 9.0
+
+
+def test_row_at_tick(result_csv):
+    trace = load_trace(result_csv)
+    trace['t'] = stitch_periods(trace['t'])
+    stream = TraceStream(result_csv, chunk_rows=3)
+    for lookup in (trace, stream):
+        assert lookup.row_at_tick(0) == 0
+        assert lookup.row_at_tick(301) == 6
+        assert lookup.row_at_tick(311) == 7
+        assert lookup.row_at_tick(302) is None
+
+
+def test_ended(result_csv):
+    trace = load_trace(result_csv)
+    trace['t'] = stitch_periods(trace['t'])
+    stream = TraceStream(result_csv, chunk_rows=3)
+    for lookup in (trace, stream):
+        assert not lookup.ended(3.10)
+        assert lookup.ended(3.11)
+
+
+def test_off_grid():
+    assert off_grid(STITCHED).tolist() == []
+    # A few microseconds of jitter stay on the grid, a millisecond does not.
+    assert off_grid([0.0, 0.010003, 0.041, 1.0]).tolist() == [2]
+
+
+def test_stream_checks_grid_as_it_reads(tmp_path):
+    file_path = str(tmp_path / 'result.csv')
+    with open(file_path, 'w') as file:
+        file.write('\tt\n')
+        for t in [0.0, 0.01, 0.02, 0.035, 0.05, 0.065]:
+            file.write('*t* = %g\t%g\n' % (t, t))
+    stream = TraceStream(file_path, chunk_rows=2)
+    assert stream.check_grid() == 0
+    assert stream.has_row(5)
+    assert stream.off_grid_rows == 2
+
+
+def test_stream_rewind(result_csv):
+    stream = TraceStream(result_csv, chunk_rows=3)
+    assert stream.row_at_time(3.01) == 6
+    stream.release(6)
+    stream.rewind()
+    assert stream['x_ego'][0] == 0.0
+    assert stream.row_at_time(3.01) == 6
+    assert stream.off_grid_rows == 0
+
+
+def test_rewind_does_not_recount_off_grid_rows(tmp_path):
+    file_path = str(tmp_path / 'result.csv')
+    with open(file_path, 'w') as file:
+        file.write('\tt\n')
+        for t in [0.0, 0.01, 0.035, 0.05]:
+            file.write('*t* = %g\t%g\n' % (t, t))
+    stream = TraceStream(file_path, chunk_rows=2)
+    stream.check_grid()
+    assert stream.has_row(3)
+    stream.rewind()
+    assert stream.has_row(3)
+    assert stream.off_grid_rows == 1
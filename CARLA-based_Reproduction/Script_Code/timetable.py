@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+"""
+Mode-sequence timetables of the falsifier's witnesses (TimePath.txt).
+
+A TimePath.txt holds, per witness, how long the path stays in each location
+and the path itself, locations in brackets joined by the transition labels:
+
+    path staying time:
+      0  0.01  0.03  0.96  0
+    Witness:
+    	No0. :[system_init]^system_t0^[init]^sample^[WaitControl,Environment,Plant]^...
+
+Several witnesses are paired in order with several 'path staying time'
+lines. A Witness turns this into a sorted timetable: the time each
+transition fires (the cumulative staying time of its source location), and
+binary-search queries for the location at a given time. Nothing depends on
+the number or names of the automaton's locations.
+"""
+
+import collections
+import re
+
+import numpy as np
+
+
+# ==============================================================================
+# -- Global functions ----------------------------------------------------------
+# ==============================================================================
+
+
+STAYING_TIME_HEADER = 'path staying time:'
+WITNESS_HEADER = 'Witness:'
+WITNESS_RE = re.compile(r'^\s*No\s*(\d+)\s*\.\s*:\s*(.*?)\s*$')
+
+# One transition of a witness: it fires at time, leaving path position
+# source for source + 1, which are both locations of the witness.
+TransitionEvent = collections.namedtuple('TransitionEvent', 'time edge source target')
+
+
+def parse_path(path):
+    """Split '[a]^e^[b]^f^[c]' into (['a', 'b', 'c'], ['e', 'f'])."""
+    parts = path.split('^')
+    if len(parts) % 2 == 0:
+        raise ValueError('witness path must alternate locations and transitions: %r' % path)
+    modes = []
+    for part in parts[0::2]:
+        part = part.strip()
+        if not (part.startswith('[') and part.endswith(']')):
+            raise ValueError('witness location %r is not in brackets' % part)
+        modes.append(part[1:-1])
+    return modes, [part.strip() for part in parts[1::2]]
+
+
+def load_witnesses(file_path):
+    """Return the witnesses of a TimePath.txt file, in file order."""
+    staying_times = []
+    paths = []
+    with open(file_path, 'r') as file:
+        lines = iter(file)
+        for line in lines:
+            if line.strip().startswith(STAYING_TIME_HEADER):
+                staying_times.append([float(value) for value in next(lines, '').split()])
+                continue
+            match = WITNESS_RE.match(line)
+            if match:
+                paths.append((int(match.group(1)), match.group(2)))
+    if not paths:
+        raise ValueError('%s holds no witness' % file_path)
+    if len(paths) != len(staying_times):
+        raise ValueError('%s holds %d witnesses but %d staying time lines' % (
+            file_path, len(paths), len(staying_times)))
+    witnesses = []
+    for (number, path), stay in zip(paths, staying_times):
+        modes, edges = parse_path(path)
+        witnesses.append(Witness(modes, edges, stay, number))
+    return witnesses
+
+
+# ==============================================================================
+# -- Witness -------------------------------------------------------------------
+# ==============================================================================
+
+
+class Witness(object):
+    """Locations visited by a witness path, with their staying times.
+
+    modes holds the location of every path position, locations the distinct
+    ones in order of first visit; location_index maps the first onto the
+    second.
+    """
+    def __init__(self, modes, edges, stay, number=0):
+        if len(edges) != len(modes) - 1:
+            raise ValueError('a path of %d locations has %d transitions, got %d' % (
+                len(modes), len(modes) - 1, len(edges)))
+        if len(stay) != len(modes):
+            raise ValueError('witness No%d has %d locations but %d staying times' % (
+                number, len(modes), len(stay)))
+        self.number = number
+        self.modes = list(modes)
+        self.edges = list(edges)
+        self.stay = np.asarray(stay, dtype=np.float64)
+        # Path position i is occupied during [exit_times[i - 1], exit_times[i]).
+        self.exit_times = np.cumsum(self.stay)
+        self.locations = list(collections.OrderedDict.fromkeys(self.modes))
+        self.location_index = np.array([self.locations.index(mode) for mode in self.modes], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.modes)
+
+    @property
+    def duration(self):
+        return float(self.exit_times[-1]) if len(self.exit_times) else 0.0
+
+    def mode_at(self, t):
+        """Path position occupied at time t; the last one from the end of the path on."""
+        return min(int(np.searchsorted(self.exit_times, t, side='right')), len(self.modes) - 1)
+
+    def location_at(self, t):
+        return self.modes[self.mode_at(t)]
+
+    def events(self):
+        """The transitions in firing order."""
+        return [
+            TransitionEvent(float(self.exit_times[n]), edge, n, n + 1)
+            for n, edge in enumerate(self.edges)]
+
+    def edge_times(self, edge):
+        """Firing times of every transition labelled edge."""
+        return np.array(
+            [self.exit_times[n] for n, label in enumerate(self.edges) if label == edge], dtype=np.float64)
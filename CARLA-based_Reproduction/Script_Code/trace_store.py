@@ -0,0 +1,438 @@
+#!/usr/bin/env python
+
+"""
+Columnar storage for the falsifier traces replayed by manual_control.py.
+
+result.csv is a tab separated table: the first line holds the variable names
+(with an empty first cell) and every following line starts with a '*t* = ...'
+label followed by one value per variable. The trace is parsed once into NumPy
+columns so the replay loop never converts strings again.
+
+Parsed traces can also be kept as binary sidecar files in the case folder,
+see TraceCache. Traces too long to hold in memory are read chunk by chunk
+through TraceStream.
+"""
+
+import collections
+import hashlib
+import itertools
+import json
+import logging
+import os
+
+import numpy as np
+
+
+# ==============================================================================
+# -- Global functions ----------------------------------------------------------
+# ==============================================================================
+
+
+T_WRAP = 3.0
+CACHE_DIR_NAME = '.trace_cache'
+DEFAULT_CHUNK_ROWS = 65536
+# Replay clock period: the engine logs on a fixed 0.01 s grid (skipping
+# steps where nothing happens) and the replay steps on the same grid. The
+# tolerance is used when matching a timetable instant against the 't' column.
+TICK_SECONDS = 0.01
+TIME_TOLERANCE = 1e-6
+# Times further than this from the nearest multiple of TICK_SECONDS are off the grid.
+GRID_TOLERANCE = 1e-4
+
+
+def read_header(file_path):
+    """Return the list of variable names of a result.csv file."""
+    with open(file_path, 'r') as file:
+        header = file.readline()
+    return header.rstrip('\r\n').split('\t')
+
+
+def select_columns(file_path, header, keys=None):
+    """Return (keys, positions in the file) for the requested trace variables."""
+    positions = dict()
+    for position, word in enumerate(header):
+        if word and word not in positions:
+            positions[word] = position
+    if keys is None:
+        keys = [word for word in header if word]
+    missing = [key for key in keys if key not in positions]
+    if missing:
+        raise ValueError('%s has no column(s): %s' % (file_path, ', '.join(missing)))
+    return list(keys), [positions[key] for key in keys]
+
+
+def load_trace(file_path, keys=None, dtype=np.float64):
+    """Parse result.csv into a TraceStore, keeping only the columns in keys."""
+    keys, usecols = select_columns(file_path, read_header(file_path), keys)
+    data = np.loadtxt(
+        file_path,
+        delimiter='\t',
+        skiprows=1,
+        usecols=usecols,
+        dtype=dtype,
+        ndmin=2)
+    return TraceStore(keys, data)
+
+
+def iter_trace_chunks(file_path, keys=None, dtype=np.float64, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Yield result.csv as consecutive TraceStore chunks of at most chunk_rows rows."""
+    with open(file_path, 'r') as file:
+        header = file.readline().rstrip('\r\n').split('\t')
+        keys, usecols = select_columns(file_path, header, keys)
+        while True:
+            lines = [line for line in itertools.islice(file, chunk_rows) if line.strip()]
+            if not lines:
+                return
+            data = np.loadtxt(lines, delimiter='\t', usecols=usecols, dtype=dtype, ndmin=2)
+            yield TraceStore(keys, data)
+
+
+def stitch_periods(t, wrap=T_WRAP):
+    """Turn the per-period clock of the trace into a monotonic time column.
+
+    The falsifier restarts 't' after it reaches 'wrap', every row following
+    such a reset is shifted by 'wrap' seconds per reset seen so far.
+    """
+    return PeriodStitcher(wrap)(t)
+
+
+class PeriodStitcher(object):
+    """Incremental stitch_periods, carrying the reset count across chunks."""
+    def __init__(self, wrap=T_WRAP):
+        self.wrap = wrap
+        self.resets = 0
+
+    def __call__(self, t):
+        t = np.asarray(t)
+        if t.size == 0:
+            return t
+        resets = np.cumsum(t == self.wrap)
+        offsets = np.empty_like(t)
+        offsets[0] = self.resets
+        offsets[1:] = self.resets + resets[:-1]
+        self.resets += int(resets[-1])
+        return t + offsets * self.wrap
+
+
+def off_grid(times, step=TICK_SECONDS, tolerance=GRID_TOLERANCE):
+    """Indices of the times that are not a multiple of step (within tolerance)."""
+    times = np.asarray(times, dtype=np.float64)
+    return np.flatnonzero(np.abs(times - np.round(times / step) * step) > tolerance)
+
+
+def check_grid(times, what, step=TICK_SECONDS, first_row=0):
+    """Warn about rows of a time column that are off the step grid; returns their number.
+
+    The replay matches such rows to the nearest step.
+    """
+    rows = off_grid(times, step)
+    if rows.size:
+        logging.warning('%s: %d row(s) off the %g s grid, first row %d at t = %r; '
+                        'they are replayed at the nearest step', what, rows.size, step,
+                        first_row + int(rows[0]), float(np.asarray(times)[rows[0]]))
+    return int(rows.size)
+
+
+# ==============================================================================
+# -- TraceStore ----------------------------------------------------------------
+# ==============================================================================
+
+
+class TraceStore(object):
+    """Trace variables stored as NumPy columns, indexed by name."""
+    def __init__(self, keys, data, time_key='t'):
+        self.columns = dict((key, idx) for idx, key in enumerate(keys))
+        # Column-major so every variable is one contiguous array.
+        self.data = np.asfortranarray(data)
+        self.time_key = time_key
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    def keys(self):
+        return list(self.columns)
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def __contains__(self, key):
+        return key in self.columns
+
+    def __getitem__(self, key):
+        return self.data[:, self.columns[key]]
+
+    def __setitem__(self, key, values):
+        values = np.asarray(values, dtype=self.data.dtype)
+        if values.shape != (len(self),):
+            raise ValueError('column %r must have %d rows, got shape %s' % (key, len(self), values.shape))
+        if key not in self.columns:
+            self.columns[key] = self.data.shape[1]
+            self.data = np.asfortranarray(np.column_stack((self.data, values)))
+        else:
+            self.data[:, self.columns[key]] = values
+
+    def row(self, idx):
+        """Return row idx as a {name: value} dictionary."""
+        values = self.data[idx]
+        return dict((key, values[col]) for key, col in self.columns.items())
+
+    def first(self, key):
+        return self.data[0, self.columns[key]]
+
+    def has_row(self, idx):
+        return 0 <= idx < self.data.shape[0]
+
+    def release(self, row):
+        """Rows are all kept in memory, nothing to release."""
+        pass
+
+    def rewind(self):
+        """Rows are all kept in memory, nothing to reread."""
+        pass
+
+    def row_at_time(self, t, tolerance=TIME_TOLERANCE):
+        """First row whose time lies within tolerance of t, or None.
+
+        Binary search on the (stitched, non-decreasing) time column.
+        """
+        times = self[self.time_key]
+        idx = int(np.searchsorted(times, t - tolerance, side='left'))
+        if idx < len(times) and times[idx] <= t + tolerance:
+            return idx
+        return None
+
+    def row_at_tick(self, tick, tick_seconds=TICK_SECONDS):
+        """First row whose time rounds to the given replay tick, or None."""
+        return self.row_at_time(tick * tick_seconds, 0.5 * tick_seconds)
+
+    def ended(self, t, tolerance=TIME_TOLERANCE):
+        """True when no row lies after time t."""
+        times = self[self.time_key]
+        return not len(times) or times[-1] <= t + tolerance
+
+    def check_grid(self, what='trace', step=TICK_SECONDS):
+        return check_grid(self[self.time_key], what, step)
+
+
+# ==============================================================================
+# -- TraceStream ---------------------------------------------------------------
+# ==============================================================================
+
+
+class TraceStream(object):
+    """Forward-only, bounded-memory view of result.csv.
+
+    Offers the same row access as TraceStore ('trace[key][row]', first,
+    has_row) but only keeps the chunks between the oldest row still needed
+    and the furthest row read so far. The replay loop calls release() with
+    the oldest row it can still look at; chunks entirely before it are
+    dropped, so memory stays flat however long the trace is. The 't' column
+    is stitched across periods while reading. rewind() starts reading over
+    from the first row.
+    """
+    def __init__(self, file_path, keys=None, dtype=np.float64, chunk_rows=DEFAULT_CHUNK_ROWS, stitch_key='t'):
+        if keys is not None and stitch_key not in keys:
+            keys = list(keys) + [stitch_key]
+        self._source = (file_path, keys, dtype, chunk_rows)
+        self._stitch_key = stitch_key
+        self._grid_check = None
+        self._checked_end = 0
+        self.off_grid_rows = 0
+        self.columns = None
+        self._first = None
+        self.rewind()
+        if self.columns is None:
+            raise ValueError('%s holds no trace rows' % file_path)
+        self._first = self._window[0][1].data[0].copy()
+
+    def keys(self):
+        return list(self.columns)
+
+    def __contains__(self, key):
+        return key in self.columns
+
+    def __getitem__(self, key):
+        return _StreamColumn(self, self.columns[key])
+
+    def first(self, key):
+        return self._first[self.columns[key]]
+
+    def has_row(self, idx):
+        while idx >= self._end and not self.exhausted:
+            self._read_chunk()
+        return 0 <= idx < self._end
+
+    def rewind(self):
+        """Start over from the first row, for another replay of the trace."""
+        self._chunks = iter_trace_chunks(*self._source)
+        self._stitcher = PeriodStitcher()
+        self._window = collections.deque()
+        self._end = 0
+        self.exhausted = False
+        self._read_chunk()
+
+    def release(self, row):
+        while len(self._window) > 1:
+            start, chunk = self._window[0]
+            if start + len(chunk) > row:
+                break
+            self._window.popleft()
+
+    def row_at_time(self, t, tolerance=TIME_TOLERANCE):
+        """Same as TraceStore.row_at_time, over the rows not released yet."""
+        while not self.exhausted and self._window[-1][1][self._stitch_key][-1] <= t + tolerance:
+            self._read_chunk()
+        for start, chunk in self._window:
+            idx = chunk.row_at_time(t, tolerance)
+            if idx is not None:
+                return start + idx
+        return None
+
+    def row_at_tick(self, tick, tick_seconds=TICK_SECONDS):
+        return self.row_at_time(tick * tick_seconds, 0.5 * tick_seconds)
+
+    def ended(self, t, tolerance=TIME_TOLERANCE):
+        """True when no row lies after time t; reads on until a row does or the file ends."""
+        while not self.exhausted and self._window[-1][1][self._stitch_key][-1] <= t + tolerance:
+            self._read_chunk()
+        return self._window[-1][1][self._stitch_key][-1] <= t + tolerance
+
+    def check_grid(self, what='trace', step=TICK_SECONDS):
+        """Check the rows read so far; the following ones are checked as they are read.
+
+        Returns the number of off-grid rows found so far.
+        """
+        self._grid_check = (what, step)
+        for start, chunk in self._window:
+            self._check_chunk(start, chunk)
+        return self.off_grid_rows
+
+    def _check_chunk(self, start, chunk):
+        # Rereads after rewind() were checked on the first pass.
+        if self._grid_check is None or start < self._checked_end:
+            return
+        self.off_grid_rows += check_grid(chunk[self._stitch_key], self._grid_check[0], self._grid_check[1], start)
+        self._checked_end = start + len(chunk)
+
+    def value(self, idx, col):
+        if not self.has_row(idx):
+            raise IndexError('trace row %d is past the end of the trace' % idx)
+        for start, chunk in reversed(self._window):
+            if idx >= start:
+                return chunk.data[idx - start, col]
+        raise IndexError('trace row %d was already released' % idx)
+
+    def _read_chunk(self):
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self.exhausted = True
+            return
+        if self.columns is None:
+            self.columns = dict(chunk.columns)
+        if self._stitch_key in chunk:
+            chunk[self._stitch_key] = self._stitcher(chunk[self._stitch_key])
+            self._check_chunk(self._end, chunk)
+        self._window.append((self._end, chunk))
+        self._end += len(chunk)
+
+
+class _StreamColumn(object):
+    def __init__(self, stream, col):
+        self._stream = stream
+        self._col = col
+
+    def __getitem__(self, idx):
+        return self._stream.value(idx, self._col)
+
+
+# ==============================================================================
+# -- TraceCache ----------------------------------------------------------------
+# ==============================================================================
+
+
+def content_hash(file_path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class TraceCache(object):
+    """Binary sidecar files for parsed traces.
+
+    Every entry is stored with the size, mtime and SHA-1 of the text file it
+    was built from. An entry is reused when size and mtime still match, or
+    when only the mtime changed but the content hash is the same; otherwise
+    it is rebuilt. Trace entries are .npy files opened memory-mapped
+    (copy-on-write), so a warm start neither parses nor reads the whole trace.
+    """
+    def __init__(self, case_dir, cache_dir=None):
+        self.cache_dir = cache_dir if cache_dir is not None else os.path.join(case_dir, CACHE_DIR_NAME)
+
+    def load_trace(self, file_path, keys=None, dtype=np.float64):
+        dtype = np.dtype(dtype)
+        tag = {'keys': list(keys) if keys is not None else None, 'dtype': dtype.str}
+        entry = self._entry(file_path, tag, '.npy')
+        meta = self._valid_meta(file_path, entry, tag)
+        if meta is not None:
+            data = np.load(entry, mmap_mode='c')
+            return TraceStore(meta['keys'], data)
+        trace = load_trace(file_path, keys, dtype)
+        self._write(entry, lambda tmp: np.save(tmp, trace.data), file_path, tag, trace.keys())
+        return trace
+
+    def _entry(self, file_path, tag, ext):
+        tag_digest = hashlib.sha1(json.dumps(tag, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.cache_dir, '%s.%s%s' % (os.path.basename(file_path), tag_digest, ext))
+
+    def _valid_meta(self, file_path, entry, tag):
+        try:
+            with open(entry + '.json', 'r') as file:
+                meta = json.load(file)
+        except (IOError, OSError, ValueError):
+            return None
+        if not os.path.exists(entry) or meta.get('tag') != tag:
+            return None
+        stat = os.stat(file_path)
+        if meta['size'] != stat.st_size:
+            return None
+        if meta['mtime_ns'] != stat.st_mtime_ns:
+            if meta['sha1'] != content_hash(file_path):
+                return None
+            meta['mtime_ns'] = stat.st_mtime_ns
+            # Only saves rehashing next time: the entry is valid even if this fails.
+            try:
+                self._write_meta(entry, meta)
+            except (IOError, OSError) as error:
+                print('Warning: cannot update trace cache %s (%s)' % (entry + '.json', error))
+        return meta
+
+    def _write(self, entry, save, file_path, tag, keys=None):
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            stat = os.stat(file_path)
+            meta = {
+                'source': os.path.basename(file_path),
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'sha1': content_hash(file_path),
+                'tag': tag,
+                'keys': keys}
+            # np.save appends its extension to names without one.
+            tmp = entry + '.tmp' + os.path.splitext(entry)[1]
+            save(tmp)
+            os.replace(tmp, entry)
+            self._write_meta(entry, meta)
+        except (IOError, OSError) as error:
+            print('Warning: cannot write trace cache %s (%s)' % (entry, error))
+
+    @staticmethod
+    def _write_meta(entry, meta):
+        tmp = entry + '.json.tmp'
+        with open(tmp, 'w') as file:
+            json.dump(meta, file)
+        os.replace(tmp, entry + '.json')